@@ -6,6 +6,7 @@ from discord.ext import commands
 
 from cogs.bot import Algalon
 from cogs.config import LiveConfig as cfg
+from cogs.utils import get_discord_timestamp
 
 logger = logging.getLogger("discord.admin")
 
@@ -13,6 +14,8 @@ TRUSTED_GUILDS = cfg.get_cfg_value("discord", "trusted_guilds")
 
 HOME_GUILD = [cfg.get_debug_value("debug_guild")]
 
+SNAPSHOT_LIST_LIMIT = 15
+
 
 class AdminCog(commands.Cog):
     def __init__(self, bot: Algalon):
@@ -53,6 +56,27 @@ class AdminCog(commands.Cog):
             f"`{cog_name}` reloaded successfully."
         )
 
+    @commands.is_owner()
+    @admin_commands.command(name="reloadconfig")
+    async def reload_config(self, ctx: discord.ApplicationContext):
+        """Reloads the live config file."""
+        logger.info("Reloading live config")
+        try:
+            cfg.reload()
+        except Exception as exc:
+            logger.error("Error reloading live config", exc_info=True)
+            await self.bot.notify_owner_of_command_exception(ctx, exc)
+            await ctx.interaction.response.send_message(
+                f"busted.\n`{exc}`", ephemeral=True, delete_after=300
+            )
+            return
+
+        await ctx.interaction.response.send_message(
+            f"Live config reloaded. {cfg.hits} cache hit(s), {cfg.reloads} reload(s), {cfg.parse_time * 1000:.2f}ms spent parsing.",
+            ephemeral=True,
+            delete_after=300,
+        )
+
     @commands.is_owner()
     @admin_commands.command(name="guilds")
     async def get_all_guilds(self, ctx: discord.ApplicationContext):
@@ -77,8 +101,59 @@ Members (approx): {guild.approximate_member_count}\n
         """Forces a CDN check."""
         watcher = self.bot.get_cog("CDNCog")
         await ctx.defer()
-        await watcher.cdn_auto_refresh()
-        await ctx.respond("Updates complete.", ephemeral=True, delete_after=300)
+        # a cycle that's already running didn't necessarily poll every branch, this waits for it and then forces one
+        waited = watcher.is_refreshing()
+        generation = await watcher.refresh(force=True)
+        if waited:
+            message = f"Waited for the running update cycle, then ran update cycle {generation}. Updates complete."
+        else:
+            message = f"Update cycle {generation} complete."
+
+        await ctx.respond(message, ephemeral=True, delete_after=300)
+
+    @commands.is_owner()
+    @admin_commands.command(name="snapshots")
+    async def list_snapshots(self, ctx: discord.ApplicationContext):
+        """Lists the most recent CDN data snapshots."""
+        watcher = self.bot.get_cog("CDNCog")
+        snapshots = watcher.cdn_cache.snapshots.snapshots[-SNAPSHOT_LIST_LIMIT:]
+        if not snapshots:
+            message = "No snapshots yet."
+        else:
+            message = "## Recent snapshots:\n"
+            for snapshot in reversed(snapshots):
+                message += f"- `{snapshot.id}` {snapshot.kind} {get_discord_timestamp(snapshot.created_at)}\n"
+
+        await ctx.respond(message, ephemeral=True, delete_after=300)
+
+    @commands.is_owner()
+    @admin_commands.command(name="restore")
+    async def restore_snapshot(self, ctx: discord.ApplicationContext, snapshot_id: int):
+        """Rolls the CDN data back to a snapshot."""
+        watcher = self.bot.get_cog("CDNCog")
+        if watcher.is_refreshing():
+            await ctx.respond(
+                "An update is in progress, try again once it's done.",
+                ephemeral=True,
+                delete_after=300,
+            )
+            return
+
+        await ctx.defer()
+        logger.info(f"Restoring CDN data snapshot {snapshot_id}")
+        try:
+            changed = await watcher.cdn_cache.restore_snapshot(snapshot_id)
+        except Exception as exc:
+            logger.error(f"Error restoring snapshot {snapshot_id}", exc_info=True)
+            await self.bot.notify_owner_of_command_exception(ctx, exc)
+            await ctx.respond(f"busted.\n`{exc}`", ephemeral=True, delete_after=300)
+            return
+
+        await ctx.respond(
+            f"Restored snapshot `{snapshot_id}`, {changed} branch(es) changed.",
+            ephemeral=True,
+            delete_after=300,
+        )
 
     # funni commands
 
@@ -1,10 +1,25 @@
+import json
+import time
 import httpx
 import logging
 
+from typing import Optional
+
 from ..config import CacheConfig
+from ..blob_cache import get_blob_cache
+from ..single_flight import SingleFlight
+from .cdn_hosts import CDNHostPool
 
 logger = logging.getLogger("discord.api.blizzard.tact")
 
+CDN_INFO_TTL = 60 * 10  # seconds
+HTTP_TIMEOUT = 10  # seconds
+
+# config blobs come from a handful of CDN hosts, keeping their connections alive saves a handshake on every miss
+HTTP_LIMITS = httpx.Limits(
+    max_connections=10, max_keepalive_connections=10, keepalive_expiry=300
+)
+
 
 class BlizzardTACTExplorer:
     def __init__(self):
@@ -14,6 +29,27 @@ class BlizzardTACTExplorer:
         self.__API_URL = self.cfg.CDN_URL
         self.__API_ENDPOINT = "/cdns"
 
+        self.flights = SingleFlight()
+        self.hosts = CDNHostPool()
+        self.__client: Optional[httpx.AsyncClient] = None
+        # branch -> (fetched at, parsed cdns entry)
+        self.__cdn_info: dict[str, tuple[float, dict]] = {}
+
+    def __get_client(self) -> httpx.AsyncClient:
+        """Returns the shared HTTP client, creating it on first use."""
+        if self.__client is None or self.__client.is_closed:
+            self.logger.debug("Creating pooled TACT HTTP client...")
+            self.__client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+
+        return self.__client
+
+    async def shutdown(self):
+        self.logger.info("Shutting down TACT client...")
+        if self.__client is not None and not self.__client.is_closed:
+            await self.__client.aclose()
+
+        self.__client = None
+
     def parse_cdn_response(self, response):
         all_data = {}
 
@@ -51,54 +87,87 @@ class BlizzardTACTExplorer:
 
             return False
 
+    async def get_cdn_info(
+        self, client: httpx.AsyncClient, branch: str
+    ) -> Optional[dict]:
+        """Returns the `cdns` entry for `branch`, only asking the API again once the cached one is `CDN_INFO_TTL` old."""
+        cached = self.__cdn_info.get(branch)
+        if cached is not None and time.monotonic() - cached[0] < CDN_INFO_TTL:
+            return cached[1]
+
+        url = f"{self.__API_URL}{branch}{self.__API_ENDPOINT}"
+        try:
+            response = await client.get(url)
+        except httpx.HTTPError:
+            self.logger.warning(f"TACT CDN info request for {branch} failed")
+            # a stale host list is still better than none
+            return cached[1] if cached is not None else None
+
+        if response.status_code != 200:
+            return cached[1] if cached is not None else None
+
+        cdn_info = self.parse_cdn_response(response.text)
+        if not cdn_info or "us" not in cdn_info:
+            self.logger.warning(f"No CDN info found for branch '{branch}'")
+            return None
+
+        self.__cdn_info[branch] = (time.monotonic(), cdn_info["us"])
+        return cdn_info["us"]
+
     def construct_url(self, host: str, path: str, hash: str):
         return f"http://{host}/{path}/{hash[:2]}/{hash[2:4]}/{hash}"
 
     async def is_encrypted(self, branch: str, product_config_hash: str):
-        async with httpx.AsyncClient(timeout=10) as client:
-            url = f"{self.__API_URL}{branch}{self.__API_ENDPOINT}"
-            try:
-                response = await client.get(url)
-            except httpx.ConnectTimeout:
-                self.logger.warning(f"TACT CDN info request for {branch} timed out")
-                return None
-
-            if response.status_code != 200:
-                return None
-
-            data = self.parse_cdn_response(response.text)
-
-            product_config = None
-
-            while not product_config:  # loop over all possible hosts until one works
-                if not data["us"]["hosts"]:  # type: ignore
-                    self.logger.warning(
-                        f"No working CDN hosts found for branch '{branch}'"
-                    )
-                    return None
-
-                host = data["us"]["hosts"].pop(0)  # type: ignore
-                path = data["us"]["config_path"]  # type: ignore
-                cdn_config_url = self.construct_url(host, path, product_config_hash)
-
-                try:
-                    self.logger.debug(
-                        f"Attempting to fetch product config for {branch}..."
-                    )
-                    cdn_response = await client.get(cdn_config_url)
-
-                    if cdn_response.status_code != 200:
-                        self.logger.warning(
-                            "Blizzard TACT host returned non 200 status code. Skipping..."
-                        )
-                        continue
-                    else:
-                        self.logger.debug(
-                            f"{branch} product config found, returning encryption status..."
-                        )
-                        product_config = cdn_response.json()
-
-                except httpx.ConnectTimeout:
-                    self.logger.warning(f"CDN request for branch '{branch}' timed out")
-
-            return "decryption_key_name" in product_config["all"]["config"]
+        """Returns whether the product config for `branch` names a decryption key. Concurrent checks for the same config share one lookup."""
+        return await self.flights.do(
+            (branch, product_config_hash),
+            self.__is_encrypted,
+            branch,
+            product_config_hash,
+        )
+
+    async def __is_encrypted(self, branch: str, product_config_hash: str):
+        data = await self.fetch_config(branch, product_config_hash, True)
+        if data is None:
+            return None
+
+        product_config = json.loads(data)
+        return "decryption_key_name" in product_config["all"]["config"]
+
+    async def fetch_config(
+        self, branch: str, hash: str, is_product_config: bool = False
+    ) -> Optional[bytes]:
+        """
+        Returns the config blob for `hash`, downloading it only if it isn't in the local blob cache yet.
+
+        Product configs live under the config path listed by the `cdns` endpoint, build and CDN configs under `<path>/config`.
+        """
+        blobs = get_blob_cache()
+        data = blobs.get(hash)
+        if data is not None:
+            self.logger.debug(f"Using cached config {hash} for {branch}")
+            return data
+
+        client = self.__get_client()
+        cdn_info = await self.get_cdn_info(client, branch)
+        if cdn_info is None:
+            return None
+
+        if is_product_config:
+            path = cdn_info["config_path"]
+        else:
+            path = f"{cdn_info['path']}/config"
+
+        self.logger.debug(f"Attempting to fetch config {hash} for {branch}...")
+        # storing the blob doubles as verification, a response that doesn't match the hash is rejected
+        data = await self.hosts.fetch(
+            client,
+            cdn_info["hosts"],
+            lambda host: self.construct_url(host, path, hash),
+            lambda content: blobs.put(hash, content),
+        )
+        if data is not None:
+            return data
+
+        self.logger.warning(f"No working CDN hosts found for branch '{branch}'")
+        return None
@@ -0,0 +1,205 @@
+"""Tracks how healthy each CDN host is, and races downloads across the healthiest ones."""
+
+import time
+import httpx
+import asyncio
+import logging
+
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger("discord.api.blizzard.cdn_hosts")
+
+DEFAULT_ALPHA = 0.3  # weight of the newest sample in the moving averages
+DEFAULT_HEDGE_DELAY = 0.3  # seconds
+DEFAULT_HEDGE_WIDTH = 2
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 60  # seconds
+DEFAULT_TIMEOUT = 5  # seconds
+
+# assumed latency for hosts we haven't heard from yet, in seconds
+UNKNOWN_LATENCY = 0.5
+
+
+class HostStats:
+    __slots__ = ("latency", "error_rate", "failures", "open_until")
+
+    def __init__(self):
+        self.latency = UNKNOWN_LATENCY
+        self.error_rate = 0.0
+        self.failures = 0  # consecutive
+        self.open_until = 0.0
+
+    @property
+    def score(self) -> float:
+        """Expected cost of asking this host, lower is better. Errors count as much as a timeout."""
+        return self.latency + self.error_rate * DEFAULT_TIMEOUT
+
+
+class CDNHostPool:
+    """
+    Health-aware pool of CDN hosts.
+
+    Every request updates exponentially weighted moving averages of the host's latency and error rate. Downloads go
+    to the best scoring host, and if it hasn't answered within `hedge_delay` the same request is sent to the next best
+    one, up to `hedge_width` at a time. Whichever valid response arrives first wins. A host that fails
+    `failure_threshold` times in a row is skipped for `cooldown` seconds, then gets one trial request.
+    """
+
+    def __init__(
+        self,
+        alpha: float = DEFAULT_ALPHA,
+        hedge_delay: float = DEFAULT_HEDGE_DELAY,
+        hedge_width: int = DEFAULT_HEDGE_WIDTH,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        cooldown: float = DEFAULT_COOLDOWN,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.alpha = alpha
+        self.hedge_delay = hedge_delay
+        self.hedge_width = hedge_width
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.timeout = timeout
+
+        self.__stats: dict[str, HostStats] = {}
+
+    def get_stats(self, host: str) -> HostStats:
+        stats = self.__stats.get(host)
+        if stats is None:
+            stats = self.__stats[host] = HostStats()
+
+        return stats
+
+    def is_open(self, host: str, now: Optional[float] = None) -> bool:
+        """Returns whether the circuit breaker for `host` is currently keeping requests away from it."""
+        now = now or time.monotonic()
+        return self.get_stats(host).open_until > now
+
+    def rank(self, hosts: Iterable[str]) -> list[str]:
+        """Orders `hosts` best first, leaving out any host whose circuit breaker is open."""
+        now = time.monotonic()
+        hosts = list(dict.fromkeys(hosts))
+        available = [host for host in hosts if not self.is_open(host, now)]
+        if not available:
+            # every host is failing, so try whichever comes back soonest rather than nothing at all
+            return sorted(hosts, key=lambda host: self.get_stats(host).open_until)
+
+        return sorted(available, key=lambda host: self.get_stats(host).score)
+
+    def record_success(self, host: str, latency: float):
+        stats = self.get_stats(host)
+        stats.latency += self.alpha * (latency - stats.latency)
+        stats.error_rate -= self.alpha * stats.error_rate
+        stats.failures = 0
+        stats.open_until = 0.0
+
+    def record_slow(self, host: str, latency: float):
+        """Records a lower bound on the latency of a request that was abandoned before `host` answered."""
+        stats = self.get_stats(host)
+        if latency > stats.latency:
+            stats.latency += self.alpha * (latency - stats.latency)
+
+    def record_failure(self, host: str, latency: float):
+        stats = self.get_stats(host)
+        stats.latency += self.alpha * (latency - stats.latency)
+        stats.error_rate += self.alpha * (1 - stats.error_rate)
+        stats.failures += 1
+        if stats.failures >= self.failure_threshold:
+            stats.open_until = time.monotonic() + self.cooldown
+            logger.warning(
+                f"CDN host {host} failed {stats.failures} time(s) in a row, skipping it for {self.cooldown}s"
+            )
+
+    async def __request(
+        self,
+        client: httpx.AsyncClient,
+        host: str,
+        url: str,
+        validate: Optional[Callable[[bytes], bool]],
+    ) -> Optional[bytes]:
+        start = time.monotonic()
+        try:
+            response = await client.get(url, timeout=self.timeout)
+        except asyncio.CancelledError:
+            # lost a race, so the host is at least this slow
+            self.record_slow(host, time.monotonic() - start)
+            raise
+        except httpx.HTTPError as exc:
+            logger.warning(f"CDN request to {host} failed: {exc!r}")
+            self.record_failure(host, time.monotonic() - start)
+            return None
+
+        elapsed = time.monotonic() - start
+        if response.status_code != 200:
+            logger.warning(
+                f"CDN host {host} returned status code {response.status_code}"
+            )
+            self.record_failure(host, elapsed)
+            return None
+
+        try:
+            valid = validate is None or validate(response.content)
+        except Exception:
+            # a validator that can't make sense of the response counts against the host, not the whole download
+            logger.warning(
+                f"Error verifying the response from CDN host {host}", exc_info=True
+            )
+            valid = False
+
+        if not valid:
+            logger.warning(f"Response from CDN host {host} failed verification")
+            self.record_failure(host, elapsed)
+            return None
+
+        self.record_success(host, elapsed)
+        return response.content
+
+    async def fetch(
+        self,
+        client: httpx.AsyncClient,
+        hosts: Iterable[str],
+        build_url: Callable[[str], str],
+        validate: Optional[Callable[[bytes], bool]] = None,
+    ) -> Optional[bytes]:
+        """Downloads `build_url(host)` from the best available host. Returns None once every host has failed."""
+        candidates = self.rank(hosts)
+        pending: set[asyncio.Task] = set()
+
+        def launch():
+            host = candidates.pop(0)
+            pending.add(
+                asyncio.create_task(
+                    self.__request(client, host, build_url(host), validate)
+                )
+            )
+
+        try:
+            while True:
+                if not pending:
+                    if not candidates:
+                        return None
+
+                    launch()
+
+                can_hedge = bool(candidates) and len(pending) < self.hedge_width
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if not done:
+                    launch()
+                    continue
+
+                for task in done:
+                    data = task.result()
+                    if data is not None:
+                        return data
+
+                    # the host failed, so replace it right away rather than waiting on the slower ones still pending
+                    if candidates:
+                        launch()
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,161 @@
+"""On-disk cache for immutable TACT blobs, addressed by the MD5 hash of their contents."""
+
+import os
+import hashlib
+import logging
+
+from collections import OrderedDict
+from typing import Optional
+
+from .config import CacheConfig, LiveConfig
+
+SELF_PATH = os.path.dirname(os.path.realpath(__file__))
+
+logger = logging.getLogger("discord.cdn.blobs")
+
+DEFAULT_MAX_SIZE = 64  # MiB
+
+
+class BlobCache:
+    """
+    Size-bounded, content-addressed blob store.
+
+    Blobs are laid out like they are on the CDN (`ab/cd/abcd...`) and are only stored if their MD5 matches the hash
+    they're stored under. Once the cache grows past `max_bytes`, the least recently used blobs are evicted. Reads bump
+    a blob's mtime, so the LRU order survives restarts.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        # hash -> size, least recently used first
+        self.__entries: OrderedDict[str, int] = OrderedDict()
+        self.__size = 0
+        self.__load()
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __path(self, hash: str) -> str:
+        return os.path.join(self.root, hash[:2], hash[2:4], hash)
+
+    def __load(self):
+        entries = []
+        for dir_path, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dir_path, name)
+                # leftovers from an interrupted write
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, hash, size in sorted(entries):
+            self.__entries[hash] = size
+            self.__size += size
+
+        if entries:
+            logger.debug(f"Loaded {len(entries)} cached blob(s), {self.__size} bytes")
+
+        self.__evict()
+
+    def __evict(self):
+        while self.__size > self.max_bytes and self.__entries:
+            hash, size = self.__entries.popitem(last=False)
+            self.__size -= size
+            try:
+                os.remove(self.__path(hash))
+            except FileNotFoundError:
+                pass
+
+            logger.debug(f"Evicted blob {hash} ({size} bytes)")
+
+    def __forget(self, hash: str):
+        size = self.__entries.pop(hash, None)
+        if size is not None:
+            self.__size -= size
+
+    @staticmethod
+    def normalize(hash: str) -> str:
+        return hash.strip().lower()
+
+    def has(self, hash: str) -> bool:
+        return self.normalize(hash) in self.__entries
+
+    def get(self, hash: str) -> Optional[bytes]:
+        """Returns the cached blob for `hash`, or None if it isn't cached."""
+        hash = self.normalize(hash)
+        if hash not in self.__entries:
+            self.misses += 1
+            return None
+
+        path = self.__path(hash)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            logger.warning(f"Cached blob {hash} disappeared from disk")
+            self.__forget(hash)
+            self.misses += 1
+            return None
+
+        self.__entries.move_to_end(hash)
+        self.hits += 1
+        return data
+
+    def put(self, hash: str, data: bytes) -> bool:
+        """Stores `data` under `hash`. Returns False, and stores nothing, if `data` doesn't hash to `hash`."""
+        hash = self.normalize(hash)
+        actual = hashlib.md5(data).hexdigest()
+        if actual != hash:
+            logger.warning(
+                f"Refusing to cache blob {hash}, its contents hash to {actual}"
+            )
+            return False
+
+        if hash in self.__entries:
+            self.__entries.move_to_end(hash)
+            return True
+
+        path = self.__path(hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        self.__entries[hash] = len(data)
+        self.__size += len(data)
+        self.__evict()
+        return True
+
+
+_blob_cache: Optional[BlobCache] = None
+
+
+def get_blob_cache() -> BlobCache:
+    """Returns the blob cache shared by everything that downloads TACT configs."""
+    global _blob_cache
+    if _blob_cache is not None:
+        return _blob_cache
+
+    root = os.path.join(
+        SELF_PATH, CacheConfig.CACHE_FOLDER_NAME, CacheConfig.BLOB_CACHE_FOLDER_NAME
+    )
+    if not os.path.exists(root):
+        os.makedirs(root)
+
+    max_size = LiveConfig.get_cfg_value("meta", "blob_cache_max_mb", DEFAULT_MAX_SIZE)
+    _blob_cache = BlobCache(root, max_size * 1024 * 1024)
+    return _blob_cache
@@ -24,6 +24,17 @@ class Algalon(discord.Bot):
             except Exception:
                 logger.error(f"Error loading cog '{cog}'", exc_info=True)
 
+    async def close(self):
+        """Lets the watcher flush its state while the event loop is still running, then closes the bot."""
+        watcher = self.get_cog("CDNCog")
+        if watcher is not None:
+            try:
+                await watcher.shutdown()
+            except Exception:
+                logger.error("Error shutting down the watcher", exc_info=True)
+
+        await super().close()
+
     async def on_ready(self):
         """This `async` function runs once when the bot is connected to Discord and ready to execute commands."""
         logger.info(f"{self.user.name} has successfully connected to Discord!")  # type: ignore
@@ -1,21 +1,37 @@
 import os
 import sys
 import time
-import json
-import shutil
 import logging
 import asyncio
 
-from typing import Any
+from typing import Any, Optional
+from dataclasses import dataclass
 
 from cogs.user_config import Monitorable
 from .api.blizzard_tact import BlizzardTACTExplorer
 from .config import LiveConfig, CacheConfig
-from .ribbit_async import RibbitClient
+from .cdn_state import CDNState
+from .storage import get_storage
+from .ribbit_async import RibbitClient, Version
+from .poll_scheduler import PollScheduler
+from .history import get_build_history
+from .snapshots import SnapshotStore
 
 logger = logging.getLogger("discord.cdn.cache")
 
 
+@dataclass(frozen=True, slots=True)
+class BuildUpdate:
+    """A new build for a branch, along with the build it replaced, if there was one."""
+
+    new: Version
+    old: Optional[Version]
+
+    @property
+    def branch(self) -> str:
+        return self.new.branch
+
+
 class CDNCache:
     SELF_PATH = os.path.dirname(os.path.realpath(__file__))
     PLATFORM = sys.platform
@@ -26,54 +42,83 @@ class CDNCache:
     def __init__(self):
         self.cache_path = os.path.join(self.SELF_PATH, self.CONFIG.CACHE_FOLDER_NAME)
         self.cdn_path = os.path.join(self.cache_path, self.CONFIG.CACHE_FILE_NAME)
-        self.seqn_cache = os.path.join(self.cache_path, "seqn_cache.json")
+        self.journal_path = os.path.join(self.cache_path, "cdn.journal")
 
         self.fetch_interval = self.LIVE_CONFIG.get_cfg_value("meta", "fetch_interval")
+        self.poll_mode = self.LIVE_CONFIG.get_cfg_value(
+            "meta", "poll_mode", self.CONFIG.POLL_MODE_SUMMARY
+        )
+        self.watched_regions = self.LIVE_CONFIG.get_cfg_value(
+            "meta", "watched_regions", self.CONFIG.DEFAULT_WATCHED_REGIONS
+        )
 
         if not os.path.exists(self.cache_path):
             os.mkdir(self.cache_path)
-            self.init_cdn()
-
-        if not os.path.exists(self.seqn_cache):
-            with open(self.seqn_cache, "w") as file:
-                json.dump({}, file, indent=4)
 
+        self.snapshots = SnapshotStore(
+            os.path.join(self.cache_path, self.CONFIG.SNAPSHOT_FOLDER_NAME),
+            self.LIVE_CONFIG.get_cfg_value(
+                "meta", "snapshot_retention", self.CONFIG.SNAPSHOT_RETENTION
+            ),
+            self.LIVE_CONFIG.get_cfg_value(
+                "meta", "snapshot_max_age_days", self.CONFIG.SNAPSHOT_MAX_AGE_DAYS
+            )
+            * 60
+            * 60
+            * 24,
+        )
+        self.state = CDNState(
+            get_storage(),
+            self.journal_path,
+            self.LIVE_CONFIG.get_cfg_value(
+                "meta", "seqn_retention", self.CONFIG.SEQN_RETENTION
+            ),
+            self.snapshots,
+        )
         self.patch_cdn_keys()
 
         self.monitor = None
+        self.ribbit = RibbitClient()
+        self.processed_seqns = self.load_processed_seqns()
+        self.scheduler = self.create_scheduler()
+        self.history = get_build_history()
+
+        # product config hash -> encrypted, None if it couldn't be detected
+        self.__encryption_states: dict[str, Optional[bool]] = {}
+        self.__encryption_checks: set[asyncio.Task] = set()
+        self.__checked_stored_encryption = False
+        self.closed = False
+
+    def create_scheduler(self) -> PollScheduler:
+        get_value = self.LIVE_CONFIG.get_cfg_value
+        return PollScheduler(
+            [branch.name for branch in self.CONFIG.PRODUCTS],
+            hot_branches=get_value(
+                "meta", "hot_branches", self.CONFIG.DEFAULT_HOT_BRANCHES
+            ),
+            min_interval=get_value("meta", "poll_min_interval", 30),
+            base_interval=(self.fetch_interval or 5) * 60,
+            max_interval=get_value("meta", "poll_max_interval", 60 * 15),
+            backoff=get_value("meta", "poll_backoff", 1.5),
+        )
 
     def patch_cdn_keys(self):
-        with open(self.cdn_path, "r+") as file:
-            logger.debug("Patching CDN file...")
-            file_json = json.load(file)
-            build_data = file_json["buildInfo"]
-            try:
-                for branch in build_data:
-                    for key, value in self.CONFIG.REQUIRED_KEYS_DEFAULTS.items():
-                        if key not in build_data[branch]:
-                            logger.debug(
-                                f"Adding {key} to {branch} with value {value}..."
-                            )
-                            build_data[branch][key] = value
-
-            except KeyError:
-                logger.error("KeyError while patching CDN file", exc_info=True)
-
-            file_json["buildInfo"] = build_data
-
-            file.seek(0)
-            json.dump(file_json, file, indent=4)
-            file.truncate()
-
-    def init_cdn(self):
-        """Populates the `cdn.json` file with default values if it does not exist."""
-        with open(self.cdn_path, "w") as file:
-            template = {
-                "buildInfo": {},
-                self.CONFIG.indices.LAST_UPDATED_BY: self.PLATFORM,
-                self.CONFIG.indices.LAST_UPDATED_AT: time.time(),
-            }
-            json.dump(template, file, indent=4)
+        logger.debug("Patching CDN data...")
+        build_data = self.state.build_info
+        for branch in build_data:
+            for key, value in self.CONFIG.REQUIRED_KEYS_DEFAULTS.items():
+                if key not in build_data[branch]:
+                    logger.debug(f"Adding {key} to {branch} with value {value}...")
+                    build_data[branch][key] = value
+                    self.state.mark_patched(branch)
+
+    def load_processed_seqns(self) -> dict[str, int]:
+        """Returns the versions seqn we last processed for each branch, as recorded in the CDN state."""
+        return {
+            branch: int(data["seqn"])
+            for branch, data in self.state.build_info.items()
+            if "seqn" in data
+        }
 
     def register_monitor_cog(self, cog):
         self.monitor = cog
@@ -90,10 +135,7 @@ class CDNCache:
 
         Returns `True` if it has, else `False`.
         """
-        with open(self.seqn_cache, "r") as file:
-            seqn_cache = json.load(file)
-            if branch in seqn_cache:
-                return seqn in seqn_cache[branch]
+        return self.state.is_seen_seqn(branch, seqn)
 
     def mark_seqn_seen(self, branch, seqn):
         """
@@ -101,177 +143,285 @@ class CDNCache:
 
         This will prevent the same sequence number from being processed again.
         """
-        with open(self.seqn_cache, "r+") as file:
-            seqn_cache = json.load(file)
-            if branch not in seqn_cache:
-                seqn_cache[branch] = []
-            if seqn not in seqn_cache[branch]:
-                seqn_cache[branch].append(seqn)
-                file.seek(0)
-                json.dump(seqn_cache, file, indent=4)
-                file.truncate()
-
-    def compare_builds(self, branch: str, newBuild: dict) -> bool:
+        self.state.mark_seqn_seen(branch, seqn)
+
+    def compare_builds(self, branch: str, new_build: Version) -> bool:
         """
         Compares two builds.
 
         Returns `True` if the build is new, else `False`.
         """
-        if self.is_seen_seqn(branch, newBuild["seqn"]):
-            logger.info(f"Skipping {branch} with seqn {newBuild['seqn']}")
+        if self.is_seen_seqn(branch, new_build.seqn):
+            logger.info(f"Skipping {branch} with seqn {new_build.seqn}")
             return False
 
-        with open(self.cdn_path, "r") as file:
-            file_json = json.load(file)
+        if self.state.last_updated_by != self.PLATFORM and (
+            time.time() - self.state.last_updated_at
+        ) < (self.fetch_interval * 60):
+            logger.info(f"Skipping build comparison for '{branch}', data is outdated")
+            return False
 
-            if file_json[self.CONFIG.indices.LAST_UPDATED_BY] != self.PLATFORM and (
-                time.time() - file_json[self.CONFIG.indices.LAST_UPDATED_AT]
-            ) < (self.fetch_interval * 60):
-                logger.info(
-                    f"Skipping build comparison for '{branch}', data is outdated"
-                )
-                return False
+        old_build = self.state.get_version(branch)
+        if old_build is None:
+            logger.debug(f"No previous build data for {branch}")
+            return True
 
-            # ignore builds with lower seqn numbers because it's probably just a caching issue
-            new_seqn, old_seqn = int(newBuild["seqn"]), int(
-                file_json["buildInfo"][branch]["seqn"]
-            )
-            if (new_seqn > 0) and new_seqn < old_seqn:
-                logger.warning(f"Lower sequence number found for {branch}")
-                return False
-
-            build_info = file_json["buildInfo"]
-            for area in newBuild:
-                if area not in Monitorable._value2member_map_:
-                    continue
-
-                if branch not in build_info:
-                    break
-
-                if area not in build_info[branch]:
-                    build_info[branch][area] = None
-
-                if build_info[branch][area] != newBuild[area]:
-                    self.notify_watched_field_updated(branch, area, newBuild[area])
-
-            for area in self.CONFIG.AREAS_TO_CHECK_FOR_UPDATES:
-                if branch in build_info:
-                    if build_info[branch][area] != newBuild[area]:
-                        logger.debug(f"Updated info found for {branch} @ {area}")
-                        self.mark_seqn_seen(branch, newBuild["seqn"])
-                        return True
-                else:
-                    build_info[branch][area] = newBuild[area]
-                    self.mark_seqn_seen(branch, newBuild["seqn"])
-                    return True
+        # ignore builds with lower seqn numbers because it's probably just a caching issue
+        if (new_build.seqn > 0) and new_build.seqn < old_build.seqn:
+            logger.warning(f"Lower sequence number found for {branch}")
+            return False
+
+        if old_build == new_build:
             return False
 
+        for area in Monitorable:
+            new_value = getattr(new_build, area.value)
+            if getattr(old_build, area.value) != new_value:
+                self.notify_watched_field_updated(branch, area.value, new_value)
+
+        for area in self.CONFIG.AREAS_TO_CHECK_FOR_UPDATES:
+            if getattr(old_build, area) != getattr(new_build, area):
+                logger.debug(f"Updated info found for {branch} @ {area}")
+                return True
+
+        return False
+
     def set_default_entry(self, name: str):
         self.save_build_data(name, self.CONFIG.REQUIRED_KEYS_DEFAULTS)
 
     def get_all_config_entries(self):
-        with open(self.cdn_path, "r") as file:
-            file_json = json.load(file)
-            return file_json["buildInfo"].keys()
-
-    def create_cache_backup(self):
-        logger.debug("Backing up CDN cache file...")
-        backup_path = os.path.join(self.cache_path, "backups")
-        if not os.path.exists(backup_path):
-            os.mkdir(backup_path)
-
-        backup_files = os.listdir(backup_path)
-
-        if len(backup_files) >= self.CONFIG.FILE_BACKUP_COUNT:
-            oldest_file = min(
-                backup_files,
-                key=lambda x: os.path.getmtime(os.path.join(backup_path, x)),
-            )
-            os.remove(os.path.join(backup_path, oldest_file))
+        return self.state.build_info.keys()
 
-        backup_filename = os.path.join(
-            backup_path, f"cdn_{len(backup_files)+1}.json.bak"
-        )
-        shutil.copyfile(self.cdn_path, backup_filename)
-        logger.debug("Backup complete!")
+    async def restore_snapshot(self, id: int) -> int:
+        """Rolls the build data back to snapshot `id`. Returns the number of branches that changed."""
+        builds = await asyncio.to_thread(self.snapshots.restore, id)
+        changed = self.state.restore_builds(builds)
+        # compare upstream against the restored builds on the next cycle, instead of waiting for their seqns to move
+        self.processed_seqns = self.load_processed_seqns()
+        self.scheduler.force(builds.keys())
+        await self.state.flush()
 
-    def save_build_data(self, branch: str, data: dict):
-        """Saves new build data to the `cdn.json` file."""
-        with open(self.cdn_path, "r+") as file:
-            file_json = json.load(file)
-            file_json["buildInfo"][branch] = data
+        logger.info(f"Restored snapshot {id}, {changed} branch(es) changed")
+        return changed
 
-            file.seek(0)
-            json.dump(file_json, file, indent=4)
-            file.truncate()
+    def save_build_data(self, branch: str, data: dict):
+        """Saves new build data to the CDN state. It is written to storage on the next flush."""
+        data = {**self.CONFIG.REQUIRED_KEYS_DEFAULTS, **data}
+        self.state.set_build(branch, data)
 
     def load_build_data(self, branch: str):
-        """Loads existing build data from the `cdn.json` file."""
-        with open(self.cdn_path, "r") as file:
-            file_json = json.load(file)
-            if branch in file_json["buildInfo"]:
-                return file_json["buildInfo"][branch]
-            else:
-                file_json["buildInfo"][branch] = {
-                    "region": self.CONFIG.defaults.REGION,
-                    "build": self.CONFIG.defaults.BUILD,
-                    "build_text": self.CONFIG.defaults.BUILDTEXT,
-                }
-                return False
-
-    async def fetch_cdn(self):
+        """Loads existing build data from the CDN state."""
+        data = self.state.get_build(branch)
+        if data is None:
+            return False
+
+        return data
+
+    async def flush(self):
+        """Writes the CDN state changed since the last flush, such as newly seen seqns, to storage."""
+        await self.state.flush()
+
+    async def close(self):
+        """Flushes any pending state and releases the network resources held by the cache."""
+        if self.closed:
+            return
+
+        self.closed = True
+        for task in self.__encryption_checks:
+            task.cancel()
+
+        await self.state.close()
+        await self.ribbit.shutdown()
+        await self.TACT.shutdown()
+
+    async def fetch_cdn(self, force: bool = False):
         """This is sort of a disaster."""
-        logger.info("Fetching CDN versions...")
-        self.create_cache_backup()
-        coros = [
-            self.fetch_branch_ribbit(branch.name) for branch in self.CONFIG.PRODUCTS
-        ]
+        if force:
+            self.scheduler.force_all()
+
+        if not self.__checked_stored_encryption:
+            self.__checked_stored_encryption = True
+            self.detect_stored_encryption()
+
+        due = self.scheduler.get_due_branches()
+        if not due:
+            logger.debug("No branches are due for a poll")
+            return []
+
+        logger.info(f"Fetching CDN versions, {len(due)} branch(es) due...")
+        branches, polled = await self.get_branches_to_fetch(due)
+        seqns_before = dict(self.processed_seqns)
+        coros = [self.fetch_branch_ribbit(branch) for branch in branches]
         new_data = await asyncio.gather(*coros)
         new_data = [i for i in new_data if i is not None]
 
+        updated = {update.branch for update in new_data}
+        for branch in polled:
+            changed = branch in updated or (
+                self.processed_seqns.get(branch) != seqns_before.get(branch)
+            )
+            self.scheduler.record_poll(branch, changed)
+
+        # new builds aren't recorded yet, the caller commits them once their notifications are queued
         return new_data
 
+    def commit_updates(self, updates: list[BuildUpdate]):
+        """
+        Stores the builds returned by `fetch_cdn` and marks their seqns seen.
+
+        Until this is called the next cycle detects the same builds again, so call it only once everything announcing
+        them is queued. Nothing is written to storage before the next flush.
+        """
+        for update in updates:
+            self.state.set_version(update.branch, update.new)
+            self.mark_seqn_seen(update.branch, update.new.seqn)
+            self.processed_seqns[update.branch] = update.new.seqn
+            # picks up an encryption state that was detected while the update was pending
+            self.detect_encryption(update.branch, update.new.product_config)
+
+    async def get_branches_to_fetch(
+        self, due: list[str]
+    ) -> tuple[list[str], list[str]]:
+        """
+        Returns the branches that need their versions fetched this cycle, and the branches this cycle observed.
+
+        In full mode, every `due` branch is fetched. In summary mode, this fetches `v2/summary` once, which observes every
+        branch, and only returns branches whose versions seqn moved since we last processed them.
+        """
+        if self.poll_mode != self.CONFIG.POLL_MODE_SUMMARY:
+            return due, due
+
+        all_branches = [branch.name for branch in self.CONFIG.PRODUCTS]
+        summary, _ = await self.ribbit.fetch_summary()
+        if not summary:
+            logger.warning("No summary response, falling back to fetching due branches")
+            return due, due
+
+        changed = []
+        for branch in all_branches:
+            seqn = summary.get(branch)
+            if seqn is None:
+                logger.debug(f"{branch} is not listed in the summary, skipping...")
+                continue
+
+            if seqn != self.processed_seqns.get(branch):
+                changed.append(branch)
+
+        logger.info(f"Summary lists {len(changed)} changed branch(es)")
+        return changed, all_branches
+
+    def pick_region(self, branch: str, versions: dict) -> Optional[str]:
+        """Returns the watched region with the newest build. Ties go to the region listed first in `watched_regions`."""
+        if branch == "catalogs":
+            # catalogs only bump their version name, and it isn't always rolled out to every region at once
+            regions = versions.keys()
+            get_build = lambda version: int(version.build_text)
+        else:
+            regions = [region for region in self.watched_regions if region in versions]
+            get_build = lambda version: int(version.build)
+
+        highest_region = None
+        highest_build = -1
+        for region in regions:
+            build = get_build(versions[region])
+            if build > highest_build:
+                highest_build = build
+                highest_region = region
+
+        return highest_region
+
     async def fetch_branch_ribbit(self, branch: str):
         logger.info(f"Fetching versions for {branch}...")
-        _data, seqn = await RibbitClient().fetch_versions_for_product(product=branch)
+        regions = None if branch == "catalogs" else self.watched_regions
+        _data, seqn = await self.ribbit.fetch_versions_for_product(
+            product=branch, regions=regions
+        )
 
         if not _data:
             logger.warning(f"No response for {branch}")
             return
 
-        if branch == "catalogs":
-            highest_region = None
-            highest_build = 0
-            for region, data in _data.items():
-                build_text = int(data.build_text)
-                if build_text > highest_build:
-                    highest_build = build_text
-                    highest_region = region
-
-            region = highest_region
-        else:
-            region = "us"
+        region = self.pick_region(branch, _data)
+        if region is None:
+            logger.warning(f"None of the watched regions are listed for {branch}")
+            self.processed_seqns[branch] = int(seqn)
+            return
 
-        _data = _data[region]
-        data = _data.__dict__()
+        version = _data[region]
+        old = self.state.get_version(branch)
 
         logger.debug(f"Comparing build data for {branch}")
-        is_new = self.compare_builds(branch, data)
+        is_new = self.compare_builds(branch, version)
+
+        if old is None or old.seqn != version.seqn or old != version:
+            self.history.record(version)
+
+        # only goes to the network the first time a product config hash is seen
+        self.detect_encryption(branch, version.product_config)
 
         if is_new:
-            output_data = data.copy()
+            logger.debug(f"Found new build data for {branch}. New data: {version}")
+            return BuildUpdate(version, old)
 
-            old_data = self.load_build_data(branch)
+        self.processed_seqns[branch] = int(seqn)
+        self.state.set_version(branch, version)
+        logger.debug(f"No new data found for {branch}")
 
-            if old_data:
-                output_data["old"] = old_data
+    def detect_encryption(self, branch: str, product_config: str):
+        """Works out whether `branch` is encrypted in the background, so it never delays a notification."""
+        if not product_config:
+            return
 
-            output_data["branch"] = branch
-            logger.debug(f"Saving new build data for {branch}. New data: {output_data}")
-            self.save_build_data(branch, data)
+        if product_config in self.__encryption_states:
+            encrypted = self.__encryption_states[product_config]
+            if encrypted is not None:
+                self.state.set_encrypted(branch, product_config, encrypted)
 
-            return output_data
-        else:
-            logger.debug(f"No new data found for {branch}")
-            self.save_build_data(branch, data)
             return
+
+        # claim the hash straight away so a second branch sharing it doesn't start its own check
+        self.__encryption_states[product_config] = None
+        task = asyncio.create_task(self.__detect_encryption(branch, product_config))
+        self.__encryption_checks.add(task)
+        task.add_done_callback(self.__encryption_checks.discard)
+
+    def detect_stored_encryption(self):
+        """
+        Checks every stored branch whose encryption state hasn't been detected yet.
+
+        Detection otherwise only runs for builds that change, so a branch whose seqn never moves would never be checked.
+        """
+        for branch, data in list(self.state.build_info.items()):
+            if data.get("encrypted") is None:
+                self.detect_encryption(branch, data.get("product_config", ""))
+
+    async def __detect_encryption(self, branch: str, product_config: str):
+        try:
+            encrypted = await self.TACT.is_encrypted(branch, product_config)
+        except Exception:
+            logger.error(
+                f"Error detecting encryption state for {branch}", exc_info=True
+            )
+            # drop the claim so the next poll tries again
+            self.__encryption_states.pop(product_config, None)
+            return
+
+        if encrypted is None:
+            logger.warning(f"Unable to detect encryption state for {branch}")
+            self.__encryption_states.pop(product_config, None)
+            return
+
+        logger.info(f"Detected encryption state for {branch}: {encrypted}")
+        self.__encryption_states[product_config] = encrypted
+        # other branches can share the product config, so update every branch still using it
+        for other_branch, data in self.state.build_info.items():
+            if data.get("product_config") == product_config:
+                self.state.set_encrypted(other_branch, product_config, encrypted)
+
+    def is_encrypted(self, branch: str) -> bool:
+        """Returns whether `branch` is encrypted, preferring the detected state over the flag in the live config."""
+        encrypted = self.state.get_encrypted(branch)
+        if encrypted is None:
+            encrypted = self.LIVE_CONFIG.get_product_encryption_state(branch)
+
+        return bool(encrypted)
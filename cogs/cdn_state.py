@@ -0,0 +1,353 @@
+import os
+import json
+import asyncio
+import logging
+
+from collections import deque
+from typing import Any, Optional
+
+from .storage import StorageBackend
+from .ribbit_async import Version
+from .snapshots import SnapshotStore
+
+logger = logging.getLogger("discord.cdn.state")
+
+
+class SeqnWindow:
+    """
+    Bounded record of the sequence numbers seen for a single branch.
+
+    Keeps the most recent `retention` seqns in a set for O(1) lookups. Anything evicted from the window
+    raises the high-water mark, and every seqn at or below it counts as seen.
+    """
+
+    def __init__(self, retention: int, floor: int = 0, recent: Optional[list] = None):
+        self.floor = floor
+        self.__recent = deque(maxlen=retention)
+        self.__lookup = set()
+
+        for seqn in recent or []:
+            self.add(seqn)
+
+    @classmethod
+    def from_json(cls, data: dict | list, retention: int):
+        if isinstance(data, list):  # legacy append-only list from seqn_cache.json
+            seqns = sorted(set(data))
+            floor = seqns[-retention - 1] if len(seqns) > retention else 0
+            return cls(retention, floor, seqns[-retention:])
+
+        return cls(retention, data.get("floor", 0), data.get("recent", []))
+
+    def to_json(self) -> dict:
+        return {"floor": self.floor, "recent": list(self.__recent)}
+
+    def __contains__(self, seqn: int) -> bool:
+        return seqn <= self.floor or seqn in self.__lookup
+
+    def add(self, seqn: int):
+        if seqn in self:
+            return
+
+        if len(self.__recent) == self.__recent.maxlen:
+            evicted = self.__recent.popleft()
+            self.__lookup.discard(evicted)
+            self.floor = max(self.floor, evicted)
+
+        self.__recent.append(seqn)
+        self.__lookup.add(seqn)
+
+
+class CDNState:
+    """
+    Authoritative in-memory copy of the CDN build data and seen seqns.
+
+    The state is read from the storage backend once when it is created. Every change is appended to a journal file as
+    it is made, and replayed on the next start if the process dies before it reaches storage. `flush` syncs the journal
+    to disk once, writes the changed branches back to storage in one batch and then empties the journal. If a snapshot
+    store is given, every flush that changes build data also writes a snapshot of it.
+    """
+
+    JOURNAL_OP_BUILD = "build"
+    JOURNAL_OP_SEQN = "seqn"
+
+    def __init__(
+        self,
+        storage: StorageBackend,
+        journal_path: str,
+        seqn_retention: int,
+        snapshots: Optional[SnapshotStore] = None,
+    ):
+        self.storage = storage
+        self.journal_path = journal_path
+        self.seqn_retention = seqn_retention
+        self.snapshots = snapshots
+
+        self.__dirty_builds: set[str] = set()
+        self.__dirty_seqns: set[str] = set()
+        # opened on the first change, kept open for appending
+        self.__journal = None
+        # branch -> snapshot of its current build, created from build_info on first use
+        self.__versions: dict[str, Version] = {}
+        self.__flush_lock = asyncio.Lock()
+
+        self.__load()
+        self.__replay_journal()
+        # replayed entries stay in the journal until the next flush has written them to storage
+        self.__journal = open(self.journal_path, "a")
+
+    def __load(self):
+        self.__cdn = self.storage.load_cdn()
+        seqn_data = self.storage.load_seqns()
+
+        self.__seqns: dict[str, SeqnWindow] = {}
+        for branch, data in seqn_data.items():
+            if isinstance(data, list):
+                logger.info(f"Migrating legacy seqn list for {branch}...")
+                self.__dirty_seqns.add(branch)
+
+            self.__seqns[branch] = SeqnWindow.from_json(data, self.seqn_retention)
+
+    def __replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        replayed = 0
+        with open(self.journal_path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash mid-append leaves a partial last line behind
+                    logger.warning("Skipping malformed entry in CDN state journal")
+                    continue
+
+                self.__apply(entry)
+                replayed += 1
+
+        if replayed > 0:
+            logger.info(f"Replayed {replayed} unflushed change(s) from CDN journal")
+
+    def __apply(self, entry: dict):
+        op = entry["op"]
+        branch = entry["branch"]
+        if op == self.JOURNAL_OP_BUILD:
+            self.__cdn["buildInfo"][branch] = entry["data"]
+            self.__versions.pop(branch, None)
+            self.__dirty_builds.add(branch)
+        elif op == self.JOURNAL_OP_SEQN:
+            if branch not in self.__seqns:
+                self.__seqns[branch] = SeqnWindow(self.seqn_retention)
+
+            self.__seqns[branch].add(entry["seqn"])
+            self.__dirty_seqns.add(branch)
+
+    def __record(self, entry: dict):
+        """Applies a change to the in-memory state and appends it to the journal."""
+        self.__apply(entry)
+        try:
+            if self.__journal is None:
+                self.__journal = open(self.journal_path, "a")
+
+            # handed to the OS straight away so it survives the process dying, the fsync is left to `flush`
+            self.__journal.write(json.dumps(entry) + "\n")
+            self.__journal.flush()
+        except OSError:
+            logger.error("Failed to append to CDN state journal", exc_info=True)
+
+    # BUILD DATA
+
+    @property
+    def build_info(self) -> dict[str, dict]:
+        return self.__cdn["buildInfo"]
+
+    @property
+    def last_updated_by(self) -> str:
+        return self.__cdn["last_updated_by"]
+
+    @property
+    def last_updated_at(self) -> float:
+        return self.__cdn["last_updated_at"]
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.__dirty_builds or self.__dirty_seqns)
+
+    def get_build(self, branch: str) -> Optional[dict]:
+        return self.build_info.get(branch)
+
+    def set_build(self, branch: str, data: dict[str, Any]):
+        """Replaces the build data for `branch`. Does nothing if the data is unchanged."""
+        if self.build_info.get(branch) == data:
+            return
+
+        entry = {"op": self.JOURNAL_OP_BUILD, "branch": branch, "data": dict(data)}
+        self.__record(entry)
+
+    def mark_patched(self, branch: str):
+        """Flags a branch as changed after editing its `build_info` entry in place."""
+        self.__versions.pop(branch, None)
+        self.__dirty_builds.add(branch)
+
+    def get_encrypted(self, branch: str) -> Optional[bool]:
+        """Returns the detected encryption state for `branch`, or None if it hasn't been detected yet."""
+        return self.build_info.get(branch, {}).get("encrypted")
+
+    def set_encrypted(self, branch: str, product_config: str, encrypted: bool):
+        """Stores the detected encryption state for `branch`, as long as its build still uses `product_config`."""
+        data = self.build_info.get(branch)
+        if data is None or data.get("product_config") != product_config:
+            return
+
+        if data.get("encrypted") == encrypted:
+            return
+
+        self.set_build(branch, {**data, "encrypted": encrypted})
+
+    def get_version(self, branch: str) -> Optional[Version]:
+        """Returns the current build for `branch` as a snapshot. The same object is returned until the build changes."""
+        version = self.__versions.get(branch)
+        if version is None and branch in self.build_info:
+            version = Version.from_json(branch, self.build_info[branch])
+            self.__versions[branch] = version
+
+        return version
+
+    def set_version(self, branch: str, version: Version):
+        """Stores a newly fetched build. Does nothing if the build, region and seqn are all unchanged."""
+        current = self.get_version(branch)
+        if (
+            current == version
+            and current.seqn == version.seqn
+            and current.region == version.region
+        ):
+            return
+
+        # keep anything stored alongside the build that the snapshot doesn't carry
+        stored = self.build_info.get(branch, {})
+        data = {**stored, **version.to_json()}
+        if stored.get("product_config") != version.product_config:
+            # the detected encryption state belongs to the old product config
+            data["encrypted"] = None
+
+        self.__record({"op": self.JOURNAL_OP_BUILD, "branch": branch, "data": data})
+        self.__versions[branch] = version
+
+    def restore_builds(self, builds: dict[str, dict]) -> int:
+        """Replaces the build data of every branch in `builds`. Returns the number of branches that changed."""
+        changed = 0
+        for branch, data in builds.items():
+            if self.build_info.get(branch) != data:
+                self.set_build(branch, data)
+                changed += 1
+
+        return changed
+
+    # SEQUENCE NUMBERS
+
+    def is_seen_seqn(self, branch: str, seqn: int) -> bool:
+        if branch not in self.__seqns:
+            return False
+
+        return seqn in self.__seqns[branch]
+
+    def mark_seqn_seen(self, branch: str, seqn: int):
+        if self.is_seen_seqn(branch, seqn):
+            return
+
+        self.__record({"op": self.JOURNAL_OP_SEQN, "branch": branch, "seqn": seqn})
+
+    # PERSISTENCE
+
+    def __sync_journal(self):
+        if self.__journal is not None:
+            os.fsync(self.__journal.fileno())
+
+    def __trim_journal(self, flushed_bytes: int):
+        """Drops the journal entries that are now covered by storage."""
+        if self.__journal is None or flushed_bytes == 0:
+            return
+
+        if self.__journal.tell() == flushed_bytes:
+            # nothing was recorded while storage was written, which is the usual case. Replaying entries that are
+            # already in storage is harmless, so the truncation doesn't need a sync of its own
+            self.__journal.truncate(0)
+            self.__journal.seek(0)
+            return
+
+        with open(self.journal_path, "r") as file:
+            file.seek(flushed_bytes)
+            remaining = file.read()
+
+        # swap the file in whole, so a crash mid-trim can't lose the entries recorded during the flush
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(remaining)
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.__journal.close()
+        os.replace(temp_path, self.journal_path)
+        self.__journal = open(self.journal_path, "a")
+
+    async def flush(self):
+        """Writes the changed branches to storage in the background if anything changed since the last flush."""
+        async with self.__flush_lock:
+            if not self.dirty:
+                return
+
+            # snapshot on the event loop so the data can't change underneath the writer thread
+            dirty_builds, dirty_seqns = self.__dirty_builds, self.__dirty_seqns
+            builds = {branch: dict(self.build_info[branch]) for branch in dirty_builds}
+            seqns = {branch: self.__seqns[branch].to_json() for branch in dirty_seqns}
+            journal_size = self.__journal.tell() if self.__journal is not None else 0
+
+            snapshot_full = False
+            snapshot_builds = builds
+            if self.snapshots is not None and builds and self.snapshots.needs_full():
+                snapshot_full = True
+                snapshot_builds = {
+                    branch: dict(data) for branch, data in self.build_info.items()
+                }
+            self.__dirty_builds, self.__dirty_seqns = set(), set()
+
+            try:
+                await asyncio.to_thread(self.__sync_journal)
+            except Exception:
+                logger.error("Failed to sync CDN state journal", exc_info=True)
+                self.__dirty_builds |= dirty_builds
+                self.__dirty_seqns |= dirty_seqns
+                return
+
+            try:
+                await asyncio.to_thread(self.storage.save_cdn, {}, builds, seqns)
+            except Exception:
+                # the changes are in the journal now, so they are replayed if we crash before the next flush
+                logger.error("Failed to flush CDN state to storage", exc_info=True)
+                self.__dirty_builds |= dirty_builds
+                self.__dirty_seqns |= dirty_seqns
+                return
+
+            try:
+                # on the event loop, so no change can be recorded halfway through
+                self.__trim_journal(journal_size)
+            except Exception:
+                logger.error("Failed to trim CDN state journal", exc_info=True)
+
+            if self.snapshots is not None and builds:
+                try:
+                    await asyncio.to_thread(
+                        self.snapshots.write, snapshot_builds, snapshot_full
+                    )
+                except Exception:
+                    logger.error("Failed to write CDN state snapshot", exc_info=True)
+
+            logger.debug(
+                f"CDN state flushed to storage ({len(builds)} build(s), {len(seqns)} seqn record(s))"
+            )
+
+    async def close(self):
+        """Flushes any pending changes and closes the journal."""
+        await self.flush()
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
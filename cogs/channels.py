@@ -0,0 +1,118 @@
+"""Resolves notification channels without spending a REST request on every delivery."""
+
+import time
+import discord
+import logging
+
+from typing import Optional
+
+from cogs.delivery import RateLimiter
+
+logger = logging.getLogger("discord.cdn.channels")
+
+DEFAULT_TTL = 60 * 60  # seconds
+DEFAULT_NEGATIVE_TTL = 60 * 60 * 24  # seconds
+
+
+class ChannelResolver:
+    """
+    Looks channels up in the gateway cache first, then falls back to a REST fetch whose result is cached for `ttl` seconds.
+
+    Channels that came back as NotFound or Forbidden are cached as unavailable until a channel, role or member update
+    event for their guild invalidates them, or `negative_ttl` seconds pass.
+    """
+
+    def __init__(
+        self, ttl: int = DEFAULT_TTL, negative_ttl: int = DEFAULT_NEGATIVE_TTL
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self.__fetched: dict[int, tuple[discord.abc.GuildChannel, float]] = {}
+        # channel id -> (guild id, expiry)
+        self.__unavailable: dict[int, tuple[int, float]] = {}
+        # user id -> DM channel
+        self.__dm_channels: dict[int, discord.DMChannel] = {}
+
+        self.hits = 0
+        self.fetches = 0
+
+    def is_unavailable(self, channel_id: int) -> bool:
+        if channel_id not in self.__unavailable:
+            return False
+
+        _, expires_at = self.__unavailable[channel_id]
+        if expires_at < time.time():
+            del self.__unavailable[channel_id]
+            return False
+
+        return True
+
+    def mark_unavailable(self, guild_id: int, channel_id: int):
+        self.__fetched.pop(channel_id, None)
+        self.__unavailable[channel_id] = (guild_id, time.time() + self.negative_ttl)
+
+    def invalidate_channel(self, channel_id: int):
+        self.__fetched.pop(channel_id, None)
+        self.__unavailable.pop(channel_id, None)
+
+    def invalidate_guild(self, guild_id: int):
+        """Forgets every unavailable channel in a guild, since its permissions may have changed."""
+        for channel_id, (channel_guild_id, _) in list(self.__unavailable.items()):
+            if channel_guild_id == guild_id:
+                del self.__unavailable[channel_id]
+
+    async def resolve(
+        self, guild: discord.Guild, channel_id: int, limiter: RateLimiter
+    ) -> Optional[discord.abc.GuildChannel]:
+        if self.is_unavailable(channel_id):
+            logger.debug(f"Skipping unavailable channel {channel_id} in guild {guild}")
+            return None
+
+        channel = guild.get_channel(channel_id)
+        if channel is not None:
+            self.hits += 1
+            return channel
+
+        if channel_id in self.__fetched:
+            channel, expires_at = self.__fetched[channel_id]
+            if expires_at >= time.time():
+                self.hits += 1
+                return channel
+
+            del self.__fetched[channel_id]
+
+        try:
+            await limiter.acquire()
+            self.fetches += 1
+            channel = await guild.fetch_channel(channel_id)
+        except discord.NotFound:
+            logger.warning(f"Chosen channel not found for guild {guild}")
+            self.mark_unavailable(guild.id, channel_id)
+            return None
+        except discord.Forbidden:
+            logger.warning(f"No permission to access chosen channel for guild {guild}")
+            self.mark_unavailable(guild.id, channel_id)
+            return None
+
+        self.__fetched[channel_id] = (channel, time.time() + self.ttl)
+        return channel
+
+    def forget_dm(self, user_id: int):
+        self.__dm_channels.pop(user_id, None)
+
+    async def resolve_dm(
+        self, user: discord.User, limiter: RateLimiter
+    ) -> discord.DMChannel:
+        """Returns the DM channel for `user`, only opening one over REST the first time."""
+        channel = self.__dm_channels.get(user.id) or user.dm_channel
+        if channel is not None:
+            self.hits += 1
+            self.__dm_channels[user.id] = channel
+            return channel
+
+        await limiter.acquire()
+        self.fetches += 1
+        channel = await user.create_dm()
+        self.__dm_channels[user.id] = channel
+        return channel
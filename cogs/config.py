@@ -1,5 +1,7 @@
 import os
 import json
+import time
+import logging
 
 from discord import Color
 from dataclasses import dataclass
@@ -7,6 +9,8 @@ from typing import Optional, Any
 from enum import StrEnum
 from .locale import Locales
 
+logger = logging.getLogger("discord.config")
+
 ## GLOBAL CONFIGURATION
 
 FETCH_INTERVAL = 1
@@ -324,6 +328,11 @@ class CacheConfig(Singleton):
     AREAS_TO_CHECK_FOR_UPDATES = ["build", "build_text"]
     CACHE_FOLDER_NAME = "cache"
     CACHE_FILE_NAME = "cdn.json"
+    SEQN_FILE_NAME = "seqn_cache.json"
+    STORAGE_DB_FILE_NAME = "algalon.db"
+    OUTBOX_DB_FILE_NAME = "outbox.db"
+    HISTORY_DB_FILE_NAME = "history.db"
+    BLOB_CACHE_FOLDER_NAME = "blobs"
 
     GUILD_CFG_FILE_NAME = "guild_cfg.json"
     USER_CFG_FILE_NAME = "user_cfg.json"
@@ -331,7 +340,18 @@ class CacheConfig(Singleton):
     SUPPORTED_REGIONS = SUPPORTED_REGIONS
     SUPPORTED_REGIONS_STRING = SUPPORTED_REGIONS_STRINGS
 
-    FILE_BACKUP_COUNT = 10
+    SNAPSHOT_FOLDER_NAME = "snapshots"
+    SNAPSHOT_RETENTION = 50
+    SNAPSHOT_MAX_AGE_DAYS = 30
+    # seen seqns kept per branch, older ones fall under the high-water mark
+    SEQN_RETENTION = 100
+
+    DEFAULT_HOT_BRANCHES = ["wow", "wowt", "wowxptr", "wow_beta"]
+    # ties between regions go to whichever is listed first
+    DEFAULT_WATCHED_REGIONS = ["us"]
+
+    POLL_MODE_FULL = "full"  # request versions for every branch that is due for a poll
+    POLL_MODE_SUMMARY = "summary"  # only request versions for products whose seqn moved
 
     REQUIRED_KEYS_DEFAULTS = {
         "region": "us",
@@ -474,10 +494,24 @@ class BlizzardAPIConfig(Singleton):
 
 
 class LiveConfig(Singleton):
+    """
+    Settings that can be changed while the bot is running.
+
+    The parsed file is kept in memory and only read again when its mtime changes, or when `reload` is called.
+    Values returned from here are shared, so don't mutate them.
+    """
+
     cfg_path = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), "cache", "cfg.json"
     )
 
+    __data: Optional[dict] = None
+    __mtime: Optional[int] = None
+
+    hits = 0
+    reloads = 0
+    parse_time = 0.0  # total seconds spent parsing cfg.json
+
     def __init__(self):
         if not os.path.exists(self.cfg_path):
             with open(self.cfg_path, "w") as f:
@@ -505,12 +539,39 @@ class LiveConfig(Singleton):
             }
         return cfg
 
+    @staticmethod
+    def __parse(mtime: int, strict: bool = False):
+        start = time.perf_counter()
+        try:
+            with open(LiveConfig.cfg_path, "r") as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            if strict or LiveConfig.__data is None:
+                raise
+
+            # probably caught the file halfway through being saved, try again on the next call
+            logger.warning("Unable to parse live config, keeping previous values")
+            return
+
+        LiveConfig.parse_time += time.perf_counter() - start
+        LiveConfig.reloads += 1
+        LiveConfig.__data = data
+        LiveConfig.__mtime = mtime
+
     @staticmethod
     def __open():
-        with open(LiveConfig.cfg_path, "r") as f:
-            data = json.load(f)
+        mtime = os.stat(LiveConfig.cfg_path).st_mtime_ns
+        if LiveConfig.__data is None or mtime != LiveConfig.__mtime:
+            LiveConfig.__parse(mtime)
+        else:
+            LiveConfig.hits += 1
 
-        return data
+        return LiveConfig.__data
+
+    @staticmethod
+    def reload():
+        """Re-reads the config file, even if it doesn't look like it changed."""
+        LiveConfig.__parse(os.stat(LiveConfig.cfg_path).st_mtime_ns, strict=True)
 
     @staticmethod
     def get_cfg_value(
@@ -0,0 +1,156 @@
+"""Concurrent, rate limited delivery of update notifications."""
+
+import time
+import asyncio
+import discord
+import logging
+
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("discord.cdn.delivery")
+
+# Discord allows 50 requests per second globally, leave some headroom for everything else the bot does
+DEFAULT_GLOBAL_RATE = 40
+DEFAULT_CONCURRENCY = 16
+
+PRIORITY_ANNOUNCEMENT = 0
+PRIORITY_DEFAULT = 1
+
+
+class RateLimiter:
+    """Token bucket limiting how many requests can start per second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.__tokens = rate
+        self.__updated = time.monotonic()
+        self.__lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.__lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.__updated
+                self.__tokens = min(self.rate, self.__tokens + elapsed * self.rate)
+                self.__updated = now
+
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.__tokens) / self.rate)
+
+
+@dataclass
+class Delivery:
+    guild: discord.Guild
+    channel_id: int
+    embed: discord.Embed
+    game: str
+    priority: int = PRIORITY_DEFAULT
+    key: Optional[str] = None  # outbox job key, if this delivery came from the outbox
+    token: Optional[str] = None
+
+
+@dataclass
+class DeliveryReport:
+    sent: int = 0
+    failed: int = 0
+    errored: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    last_delivery_at: float = 0
+    sent_keys: list[str] = field(default_factory=list)
+    failed_keys: list[str] = field(default_factory=list)
+    errored_keys: list[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed + self.errored
+
+    @property
+    def time_to_last_delivery(self) -> float:
+        if self.last_delivery_at == 0:
+            return 0
+
+        return self.last_delivery_at - self.started_at
+
+    def __str__(self):
+        return (
+            f"{self.sent}/{self.total} delivered ({self.failed} failed, {self.errored} errored), "
+            f"last delivery after {self.time_to_last_delivery:.2f}s"
+        )
+
+
+DeliveryHandler = Callable[[Delivery, RateLimiter], Awaitable[bool]]
+
+
+class DeliveryScheduler:
+    """
+    Sends deliveries with bounded concurrency.
+
+    Deliveries are started in priority order, at most one at a time per channel, and every request made by the
+    handler should go through the shared `RateLimiter` so a cycle stays under Discord's global rate limit.
+    Per-route buckets and 429 retries are still handled by py-cord's HTTP client.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+    ):
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(global_rate)
+        self.__channel_locks: dict[int, asyncio.Lock] = {}
+
+    async def __deliver(
+        self,
+        delivery: Delivery,
+        handler: DeliveryHandler,
+        semaphore: asyncio.Semaphore,
+        report: DeliveryReport,
+    ):
+        lock = self.__channel_locks.setdefault(delivery.channel_id, asyncio.Lock())
+        async with semaphore, lock:
+            try:
+                success = await handler(delivery, self.limiter)
+            except Exception:
+                logger.error(
+                    f"Error delivering update to guild {delivery.guild.id}",
+                    exc_info=True,
+                )
+                report.errored += 1
+                if delivery.key is not None:
+                    report.errored_keys.append(delivery.key)
+                return
+
+            if success:
+                report.sent += 1
+                report.last_delivery_at = time.monotonic()
+                if delivery.key is not None:
+                    report.sent_keys.append(delivery.key)
+            else:
+                report.failed += 1
+                if delivery.key is not None:
+                    report.failed_keys.append(delivery.key)
+
+    async def run(
+        self, deliveries: list[Delivery], handler: DeliveryHandler
+    ) -> DeliveryReport:
+        report = DeliveryReport()
+        if not deliveries:
+            return report
+
+        # the semaphore wakes waiters in FIFO order, so sorting is enough to send priority channels first
+        deliveries = sorted(deliveries, key=lambda delivery: delivery.priority)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        await asyncio.gather(
+            *[
+                self.__deliver(delivery, handler, semaphore, report)
+                for delivery in deliveries
+            ]
+        )
+
+        self.__channel_locks.clear()
+        return report
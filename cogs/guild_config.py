@@ -1,29 +1,101 @@
-import os
 import sys
-import json
 import logging
 
+from typing import Any, Iterable, Optional
+
 from .config import CacheConfig, Setting
 from .config import SUPPORTED_GAMES, SUPPORTED_PRODUCTS
-
+from .storage import get_storage
 
 logger = logging.getLogger("discord.guild-cfg")
 
 
+class GuildIndex:
+    """In-memory reverse index from each branch to the guilds watching it, plus each guild's notification channels."""
+
+    CONFIG = CacheConfig()
+
+    def __init__(self):
+        self.built = False
+        self.__watchers: dict[str, set[str]] = {}
+        self.__watchlists: dict[str, set[str]] = {}
+        self.__channels: dict[str, dict[str, int]] = {}
+
+        self.__channel_settings = {
+            setting.name: game.value
+            for game, setting in self.CONFIG.SETTING_BY_GAME.items()
+        }
+
+    def build(self, guild_configs: dict[str, dict]):
+        logger.debug(f"Building watchlist index for {len(guild_configs)} guild(s)...")
+        self.__watchers.clear()
+        self.__watchlists.clear()
+        self.__channels.clear()
+
+        for guild_id, config in guild_configs.items():
+            self.update_guild(guild_id, config)
+
+        self.built = True
+
+    def update_guild(self, guild_id: str, config: Optional[dict]):
+        """Re-indexes a whole guild config. Passing `None` removes the guild from the index."""
+        self.set_watchlist(guild_id, [])
+        self.__channels.pop(guild_id, None)
+        if config is None:
+            self.__watchlists.pop(guild_id, None)
+            return
+
+        for key, value in config.items():
+            self.update_setting(guild_id, key, value)
+
+    def update_setting(self, guild_id: str, setting_name: str, value: Any):
+        if setting_name == self.CONFIG.settings.WATCHLIST.name:
+            self.set_watchlist(guild_id, value)
+        elif setting_name in self.__channel_settings:
+            game = self.__channel_settings[setting_name]
+            self.__channels.setdefault(guild_id, {})[game] = value
+
+    def set_watchlist(self, guild_id: str, watchlist: list[str] | str):
+        if isinstance(watchlist, str):
+            watchlist = [watchlist]
+
+        old_watchlist = self.__watchlists.get(guild_id, set())
+        new_watchlist = set(watchlist)
+
+        for branch in old_watchlist - new_watchlist:
+            self.__watchers[branch].discard(guild_id)
+
+        for branch in new_watchlist - old_watchlist:
+            self.__watchers.setdefault(branch, set()).add(guild_id)
+
+        self.__watchlists[guild_id] = new_watchlist
+
+    def get_guilds_for_branches(self, branches: Iterable[str]) -> set[str]:
+        guilds = set()
+        for branch in branches:
+            guilds |= self.__watchers.get(branch, set())
+
+        return guilds
+
+    def has_guild(self, guild_id: str) -> bool:
+        return guild_id in self.__watchlists
+
+    def get_watchlist(self, guild_id: str) -> set[str]:
+        return self.__watchlists.get(guild_id, set())
+
+    def get_channel(self, guild_id: str, game: str) -> Optional[int]:
+        return self.__channels.get(guild_id, {}).get(game)
+
+
 class GuildCFG:
-    SELF_PATH = os.path.dirname(os.path.realpath(__file__))
     PLATFORM = sys.platform
     CONFIG = CacheConfig()
 
-    def __init__(self):
-        self.cache_path = os.path.join(self.SELF_PATH, self.CONFIG.CACHE_FOLDER_NAME)
-        self.guild_cfg_path = os.path.join(
-            self.cache_path, self.CONFIG.GUILD_CFG_FILE_NAME
-        )
+    # shared by every GuildCFG instance so all of them see the same incremental updates
+    INDEX = GuildIndex()
 
-        if not os.path.exists(self.cache_path):
-            os.mkdir(self.cache_path)
-            self.init_guild_cfg()
+    def __init__(self):
+        self.storage = get_storage()
 
         # remember to clear and update with new builds - contains an old key and a new value
         self.KEYS_TO_PATCH = ["d4_channel"]
@@ -41,56 +113,39 @@ class GuildCFG:
             self.CONFIG.settings.LOCALE.name: self.CONFIG.settings.LOCALE.default,
         }
 
-    def init_guild_cfg(self, guild_id: int | str = 0):
-        """Populates the `guild_cfg.json` file with related guild configuration data."""
-        with open(self.guild_cfg_path, "w") as file:
-            file_json = json.load(file)
-            file_json[guild_id] = self.get_default_guild_cfg()
-            json.dump(file_json, file, indent=4)
-
     # GUILD CFG IO
 
     def does_guild_config_exist(self, guild_id: int | str):
-        with open(self.guild_cfg_path, "r+") as file:
-            file_json = json.load(file)
-            return str(guild_id) in file_json
+        return self.storage.get_guild(str(guild_id)) is not None
 
     def add_guild_config(self, guild_id: int | str):
-        logger.info("Adding new guild to configuration file...")
-        with open(self.guild_cfg_path, "r+") as file:
-            file_json = json.load(file)
-            file_json[guild_id] = self.get_default_guild_cfg()
+        logger.info("Adding new guild to configuration storage...")
+        guild_config = self.get_default_guild_cfg()
+        self.storage.put_guild(str(guild_id), guild_config)
 
-            file.seek(0)
-            json.dump(file_json, file, indent=4)
-            file.truncate()
+        if self.INDEX.built:
+            self.INDEX.update_guild(str(guild_id), guild_config)
 
     def remove_guild_config(self, guild_id: int | str):
-        logger.info("Removing guild from configuration file...")
-        with open(self.guild_cfg_path, "r+") as file:
-            file_json = json.load(file)
-            del file_json[str(guild_id)]
+        logger.info("Removing guild from configuration storage...")
+        self.storage.delete_guild(str(guild_id))
 
-            file.seek(0)
-            json.dump(file_json, file, indent=4)
-            file.truncate()
+        if self.INDEX.built:
+            self.INDEX.update_guild(str(guild_id), None)
 
     def get_guild_config(self, guild_id: int | str):
         logger.debug(f"Fetching guild config for guild {guild_id}...")
-        with open(self.guild_cfg_path, "r") as file:
-            file_json = json.load(file)
-            guild_id = str(guild_id)
-            if guild_id not in file_json and guild_id.isdigit():
-                self.add_guild_config(guild_id)
+        guild_id = str(guild_id)
+        guild_config = self.storage.get_guild(guild_id)
+        if guild_config is None and guild_id.isdigit():
+            self.add_guild_config(guild_id)
+            guild_config = self.storage.get_guild(guild_id)
 
-            return file_json[guild_id]
+        return guild_config
 
     def get_all_guild_configs(self):
         logger.debug(f"Fetching all guild configurations...")
-        with open(self.guild_cfg_path, "r") as file:
-            file_json = json.load(file)
-
-            return file_json
+        return self.storage.get_all_guilds()
 
     def get_guild_setting(self, guild_id: int | str, setting: str):
         logger.debug(f"Fetching {setting} for guild {guild_id}...")
@@ -140,16 +195,36 @@ class GuildCFG:
             f"Guild config update payload - new data: {new_data}, setting: {setting_name}."
         )
 
-        with open(self.guild_cfg_path, "r+") as file:
-            file_json = json.load(file)
-            file_json[str(guild_id)][setting_name] = new_data
+        self.storage.update_guild_setting(str(guild_id), setting_name, new_data)
 
-            file.seek(0)
-            json.dump(file_json, file, indent=4)
-            file.truncate()
+        if self.INDEX.built:
+            self.INDEX.update_setting(str(guild_id), setting_name, new_data)
 
         return True
 
+    # INDEX
+
+    def get_index(self) -> GuildIndex:
+        """Returns the shared watchlist index, building it from storage on first use."""
+        if not self.INDEX.built:
+            self.INDEX.build(self.get_all_guild_configs())
+
+        return self.INDEX
+
+    def ensure_indexed(self, guild_id: int | str):
+        """Indexes a guild that has no entry yet, creating its default config the way `get_guild_config` does."""
+        index = self.get_index()
+        guild_id = str(guild_id)
+        if index.has_guild(guild_id):
+            return
+
+        guild_config = self.get_guild_config(guild_id)
+        if guild_config is not None:
+            index.update_guild(guild_id, guild_config)
+
+    def get_guilds_watching(self, branches: Iterable[str]) -> set[str]:
+        return self.get_index().get_guilds_for_branches(branches)
+
     # WATCHLIST IO
 
     def add_to_guild_watchlist(self, guild_id: int | str, branch: str):
@@ -0,0 +1,181 @@
+"""Append-only history of every build Algalon has seen, so past builds can be looked up by branch or by build."""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .config import CacheConfig
+from .ribbit_async import Version
+
+SELF_PATH = os.path.dirname(os.path.realpath(__file__))
+
+logger = logging.getLogger("discord.cdn.history")
+
+DEFAULT_LIMIT = 10
+
+
+@dataclass(frozen=True, slots=True)
+class HistoryEntry:
+    branch: str
+    seqn: int
+    build: str
+    build_text: str
+    build_config: str
+    cdn_config: str
+    product_config: str
+    keyring: str
+    detected_at: float
+
+    @property
+    def version_string(self) -> str:
+        return f"{self.build_text}.{self.build}"
+
+
+class BuildHistory:
+    """
+    SQLite-backed log of builds, one row per versions seqn a branch was seen at.
+
+    Rows are only ever appended, then `compact` drops rows that repeat the build listed right before them on the same
+    branch, so only the first sighting of each build is kept. Lookups by branch and by build are answered from indices.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS builds (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        branch TEXT NOT NULL,
+        seqn INTEGER NOT NULL,
+        build TEXT NOT NULL,
+        build_text TEXT NOT NULL,
+        build_config TEXT NOT NULL,
+        cdn_config TEXT NOT NULL,
+        product_config TEXT NOT NULL,
+        keyring TEXT NOT NULL,
+        detected_at REAL NOT NULL,
+        fingerprint TEXT NOT NULL,
+        UNIQUE (branch, seqn)
+    );
+    CREATE INDEX IF NOT EXISTS builds_branch_time ON builds (branch, detected_at);
+    CREATE INDEX IF NOT EXISTS builds_time ON builds (detected_at);
+    CREATE INDEX IF NOT EXISTS builds_build ON builds (build, detected_at);
+    """
+
+    COLUMNS = "branch, seqn, build, build_text, build_config, cdn_config, product_config, keyring, detected_at"
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+        self.__db = sqlite3.connect(db_path)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.executescript(self.SCHEMA)
+        self.__db.commit()
+
+    @staticmethod
+    def get_fingerprint(version: Version) -> str:
+        """Hashes the fields that identify a build, so unchanged rows can be found with a single comparison."""
+        fields = (
+            version.build,
+            version.build_text,
+            version.build_config,
+            version.cdn_config,
+            version.product_config,
+            version.keyring,
+        )
+        return hashlib.sha1("|".join(fields).encode()).hexdigest()
+
+    def record(self, version: Version) -> bool:
+        """Appends a sighting of `version`. Returns False if its branch was already recorded at the same seqn."""
+        detected_at = version.fetched_at or time.time()
+        with self.__db:
+            cursor = self.__db.execute(
+                f"""INSERT OR IGNORE INTO builds ({self.COLUMNS}, fingerprint)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    version.branch,
+                    version.seqn,
+                    version.build,
+                    version.build_text,
+                    version.build_config,
+                    version.cdn_config,
+                    version.product_config,
+                    version.keyring,
+                    detected_at,
+                    self.get_fingerprint(version),
+                ),
+            )
+
+        return cursor.rowcount > 0
+
+    def get_branch_history(
+        self, branch: str, limit: int = DEFAULT_LIMIT
+    ) -> list[HistoryEntry]:
+        """Returns the builds `branch` has had, newest first, skipping sightings that didn't change anything."""
+        rows = self.__db.execute(
+            f"""SELECT {self.COLUMNS} FROM (
+                SELECT *, LAG(fingerprint) OVER (ORDER BY detected_at, id) AS previous
+                FROM builds WHERE branch = ?
+            )
+            WHERE previous IS NULL OR previous != fingerprint
+            ORDER BY detected_at DESC LIMIT ?""",
+            (branch, limit),
+        ).fetchall()
+
+        return [HistoryEntry(*row) for row in rows]
+
+    def find_build(
+        self, build: str, build_text: Optional[str] = None
+    ) -> list[HistoryEntry]:
+        """Returns the first sighting of `build` on every branch it was seen on, earliest first."""
+        query = f"SELECT {self.COLUMNS}, MIN(detected_at) FROM builds WHERE build = ?"
+        params: tuple = (build,)
+        if build_text is not None:
+            query += " AND build_text = ?"
+            params += (build_text,)
+
+        # SQLite fills the bare columns from the row that holds the MIN()
+        rows = self.__db.execute(
+            query + " GROUP BY branch ORDER BY detected_at", params
+        ).fetchall()
+
+        return [HistoryEntry(*row[:-1]) for row in rows]
+
+    def compact(self) -> int:
+        """Deletes rows that repeat the build listed right before them on the same branch. Returns the number deleted."""
+        with self.__db:
+            cursor = self.__db.execute("""DELETE FROM builds WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, fingerprint,
+                            LAG(fingerprint) OVER (PARTITION BY branch ORDER BY detected_at, id) AS previous
+                        FROM builds
+                    )
+                    WHERE previous = fingerprint
+                )""")
+
+        if cursor.rowcount > 0:
+            logger.info(f"Compacted {cursor.rowcount} unchanged build history row(s)")
+
+        return cursor.rowcount
+
+    def close(self):
+        self.__db.close()
+
+
+_history: Optional[BuildHistory] = None
+
+
+def get_build_history() -> BuildHistory:
+    """Returns the build history shared by the cache and the lookup commands."""
+    global _history
+    if _history is not None:
+        return _history
+
+    cache_path = os.path.join(SELF_PATH, CacheConfig.CACHE_FOLDER_NAME)
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+
+    _history = BuildHistory(os.path.join(cache_path, CacheConfig.HISTORY_DB_FILE_NAME))
+    return _history
@@ -1,5 +1,7 @@
 """Handles the more specific per-field tracking for users"""
 
+import time
+import asyncio
 import discord
 import logging
 
@@ -9,6 +11,7 @@ from discord.ext import commands
 
 from cogs.bot import Algalon
 from cogs.user_config import UserConfigFile, Monitorable
+from cogs.outbox import OutboxJob, get_outbox, KIND_USER_DIGEST
 from cogs.config import LiveConfig as livecfg
 from cogs.config import SUPPORTED_PRODUCTS
 from cogs.ui import MonitorUI
@@ -18,8 +21,11 @@ logger = logging.getLogger("discord.cdn.watcher")
 DELETE_AFTER = livecfg.get_cfg_value("discord", "delete_msgs_after", 120)
 COOLDOWN = livecfg.get_cfg_value("discord", "cmd_cooldown", 15)
 
+DIGEST_CONCURRENCY = livecfg.get_cfg_value("discord", "delivery_concurrency", 16)
+DIGEST_BATCH_SIZE = 200
 
-@dataclass
+
+@dataclass(frozen=True)
 class UpdatePackage:
     branch: SUPPORTED_PRODUCTS
     field: Monitorable
@@ -34,7 +40,13 @@ class MonitorCog(commands.Cog):
         self.user_cfg = UserConfigFile()
         self.live_cfg = livecfg()
 
-        self.updates = {}
+        # (branch name, field) -> latest change, shared by every user watching it
+        self.changes: dict[tuple[str, Monitorable], UpdatePackage] = {}
+        # user id -> (branch name, field) keys of the changes they should hear about
+        self.updates: dict[str, set[tuple[str, Monitorable]]] = {}
+
+        self.outbox = get_outbox()
+        self.__outbox_lock = asyncio.Lock()
 
         watcher = self.bot.get_cog("CDNCog")
         watcher.cdn_cache.register_monitor_cog(self)
@@ -50,13 +62,7 @@ class MonitorCog(commands.Cog):
     def get_all_watchers_for_branch_field(
         self, branch: SUPPORTED_PRODUCTS, field: Monitorable
     ) -> list[str]:
-        users = []
-        with self.user_cfg as cfg:
-            for user_id, user_entry in cfg.users:
-                if user_entry.is_monitoring(branch.name, field):
-                    users.append(user_id)
-
-        return users
+        return self.user_cfg.get_monitor_watchers(branch.name, field)
 
     def on_field_update(self, branch: str, field: str, new_data: Any):
         if self.is_disabled():
@@ -68,57 +74,132 @@ class MonitorCog(commands.Cog):
             return
 
         field = self.get_field_enum_from_value(field)
-        package = UpdatePackage(branch, field, new_data)
         watchers = self.get_all_watchers_for_branch_field(branch, field)
         if len(watchers) == 0:
             return
 
+        key = (branch.name, field)
+        self.changes[key] = UpdatePackage(branch, field, new_data)
         for user_id in watchers:
-            if user_id in self.updates:
-                self.updates[user_id].append(package)
+            self.updates.setdefault(user_id, set()).add(key)
+
+    def get_digest_packages(self, keys: set[tuple[str, Monitorable]]):
+        """Returns the changes that go into a user's digest, in a stable order."""
+        packages = []
+        has_cdn_config = False
+        for key in sorted(keys):
+            package = self.changes[key]
+            # CDN configs are shared between branches, so one is enough
+            if package.field == Monitorable.CDNConfig:
+                if has_cdn_config:
+                    continue
+
+                has_cdn_config = True
+
+            packages.append(package)
+
+        return tuple(packages)
+
+    def render_digest(self, packages: tuple[UpdatePackage, ...]) -> str:
+        i = len(packages)
+        message = f"## Field change{'s'[:i^1]} found:\n"
+        for package in packages:
+            new_data = package.new_data
+            if new_data == "":
+                new_data = "EMPTY"
             else:
-                self.updates[user_id] = [package]
-
-    async def distribute_notifications(self):
-        if self.is_disabled():
-            return
+                new_data = f"`{new_data}`"
+
+            message += f"**{package.branch}**: `{package.branch.name}`.`{package.field}` -> {new_data}\n"
+
+        return message
+
+    def build_digest_jobs(self) -> list[OutboxJob]:
+        """Renders one digest per distinct set of changes, and queues a copy of it for every user that should get it."""
+        digests: dict[tuple[UpdatePackage, ...], tuple[str, str]] = {}
+        jobs = []
+        # a field can legitimately flip back to an older value, so digests from different cycles never share a key
+        cycle = time.time()
+        for user_id, keys in self.updates.items():
+            packages = self.get_digest_packages(keys)
+            if packages not in digests:
+                message = self.render_digest(packages)
+                digests[packages] = (message, OutboxJob.make_key(cycle, message))
+
+            message, digest_key = digests[packages]
+            jobs.append(
+                OutboxJob(
+                    OutboxJob.make_key(KIND_USER_DIGEST, user_id, digest_key),
+                    KIND_USER_DIGEST,
+                    int(user_id),
+                    0,
+                    {"message": message},
+                )
+            )
 
-        updates = self.updates
-        if len(updates) == 0:
-            return
+        logger.debug(
+            f"Rendered {len(digests)} distinct field change digest(s) for {len(jobs)} user(s)"
+        )
+        return jobs
 
-        num_cdn_config_updates = 0
-        for user_id, packages in self.updates.items():
-            user = await self.bot.get_or_fetch_user(int(user_id))
-            if user is None:
-                logger.warning(
-                    f"Unable to fetch {user_id} from Discord to distribute field updates"
+    async def deliver_digest(self, job: OutboxJob) -> bool:
+        watcher = self.bot.get_cog("CDNCog")
+        try:
+            return await watcher.send_direct_message(
+                job.target_id, [job.payload["message"]], watcher.delivery.limiter
+            )
+        except (discord.NotFound, discord.Forbidden):
+            logger.warning(f"Unable to send field change digest to {job.target_id}")
+            return False
+
+    async def process_digests(self):
+        """Delivers every due digest in the outbox concurrently, so one user failing doesn't hold up the others."""
+        async with self.__outbox_lock:
+            while True:
+                jobs = self.outbox.get_due(KIND_USER_DIGEST, DIGEST_BATCH_SIZE)
+                if not jobs:
+                    return
+
+                semaphore = asyncio.Semaphore(DIGEST_CONCURRENCY)
+                delivered, failed, retry = [], [], []
+
+                async def deliver(job: OutboxJob):
+                    async with semaphore:
+                        try:
+                            success = await self.deliver_digest(job)
+                        except Exception:
+                            logger.error(
+                                f"Error sending field change digest to {job.target_id}",
+                                exc_info=True,
+                            )
+                            retry.append(job)
+                            return
+
+                        (delivered if success else failed).append(job.key)
+
+                await asyncio.gather(*[deliver(job) for job in jobs])
+                self.outbox.record(delivered, failed, retry)
+                logger.info(
+                    f"Sent {len(delivered)}/{len(jobs)} field change digest(s), {len(retry)} queued for retry"
                 )
-                return
 
-            i = len(packages)
-            message = f"## Field change{'s'[:i^1]} found:\n"
-            for package in packages:
-                package: UpdatePackage
-                if package.field == Monitorable.CDNConfig:
-                    if num_cdn_config_updates > 0:
-                        continue
-                    else:
-                        num_cdn_config_updates += 1
+                if len(jobs) < DIGEST_BATCH_SIZE:
+                    return
 
-                new_data = package.new_data
-                if new_data == "":
-                    new_data = "EMPTY"
-                else:
-                    new_data = f"`{new_data}`"
-
-                message += f"**{package.branch}**: `{package.branch.name}`.`{package.field}` -> {new_data}\n"
+    def queue_digests(self):
+        """Moves the field changes collected so far into the outbox as digests."""
+        if self.is_disabled():
+            return
 
-            dm_channel = await user.create_dm()
-            if dm_channel:
-                await dm_channel.send(message)
+        if len(self.updates) > 0:
+            self.outbox.enqueue(self.build_digest_jobs())
+            self.updates.clear()
+            self.changes.clear()
 
-        self.updates.clear()
+    async def distribute_notifications(self):
+        self.queue_digests()
+        # runs even while monitoring is disabled, so digests queued before that or waiting for a retry still go out
+        await self.process_digests()
 
     monitor_commands = discord.SlashCommandGroup(
         name="monitor",
@@ -159,7 +240,7 @@ class MonitorCog(commands.Cog):
             )
             return
 
-        view = MonitorUI.create(ctx.author.id, branch)
+        view = await MonitorUI.create(ctx.author.id, branch)
         await ctx.respond(
             f"Edit the fields you're watching for `{branch.name}` below.",
             view=view,
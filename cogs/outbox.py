@@ -0,0 +1,225 @@
+"""Durable queue of outbound notifications, so a restart or a Discord outage doesn't lose an update."""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .config import CacheConfig, LiveConfig
+
+SELF_PATH = os.path.dirname(os.path.realpath(__file__))
+
+logger = logging.getLogger("discord.cdn.outbox")
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+KIND_GUILD_EMBED = "guild_embed"
+KIND_USER_DIGEST = "user_digest"
+KIND_USER_BUILD_DM = "user_build_dm"
+
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_BASE_DELAY = 15  # seconds, doubled after every failed attempt
+DEFAULT_MAX_DELAY = 60 * 30  # seconds
+
+
+@dataclass
+class OutboxJob:
+    key: str
+    kind: str
+    target_id: int
+    channel_id: int
+    payload: dict
+    priority: int = 1
+    attempts: int = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Builds a deterministic idempotency key, so the same update for the same destination is only queued once."""
+        return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class Outbox:
+    """
+    SQLite-backed outbox of (update, destination) jobs.
+
+    Jobs stay pending until a worker records them as delivered or permanently failed. Jobs that raise are retried with
+    exponential backoff until `max_attempts` is reached. Pending jobs survive restarts.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        key TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        target_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_attempt_at);
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.__db = sqlite3.connect(db_path)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.executescript(self.SCHEMA)
+        self.__db.commit()
+
+    def enqueue(self, jobs: list[OutboxJob]) -> int:
+        """Queues jobs for delivery, ignoring any whose key is already known. Returns the number of new jobs."""
+        now = time.time()
+        rows = [
+            (
+                job.key,
+                job.kind,
+                job.target_id,
+                job.channel_id,
+                json.dumps(job.payload),
+                job.priority,
+                STATUS_PENDING,
+                now,
+                now,
+                now,
+            )
+            for job in jobs
+        ]
+
+        with self.__db:
+            before = self.__db.total_changes
+            self.__db.executemany(
+                """INSERT OR IGNORE INTO jobs
+                (key, kind, target_id, channel_id, payload, priority, status, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            added = self.__db.total_changes - before
+
+        if added < len(jobs):
+            logger.info(f"Skipped {len(jobs) - added} already queued job(s)")
+
+        return added
+
+    def get_due(self, kind: str, limit: int) -> list[OutboxJob]:
+        rows = self.__db.execute(
+            """SELECT key, kind, target_id, channel_id, payload, priority, attempts FROM jobs
+            WHERE status = ? AND kind = ? AND next_attempt_at <= ?
+            ORDER BY priority, created_at LIMIT ?""",
+            (STATUS_PENDING, kind, time.time(), limit),
+        ).fetchall()
+
+        return [
+            OutboxJob(
+                key,
+                kind,
+                target_id,
+                channel_id,
+                json.loads(payload),
+                priority,
+                attempts,
+            )
+            for key, kind, target_id, channel_id, payload, priority, attempts in rows
+        ]
+
+    def get_backoff(self, attempts: int) -> float:
+        return min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+
+    def record(
+        self,
+        delivered: list[str],
+        failed: list[str],
+        retry: list[OutboxJob],
+    ):
+        """Stores the outcome of a batch of jobs in a single transaction."""
+        now = time.time()
+        retry_rows = []
+        for job in retry:
+            attempts = job.attempts + 1
+            if attempts >= self.max_attempts:
+                logger.warning(
+                    f"Giving up on outbox job {job.key} after {attempts} attempts"
+                )
+                failed.append(job.key)
+                continue
+
+            retry_rows.append(
+                (attempts, now + self.get_backoff(attempts), now, job.key)
+            )
+
+        with self.__db:
+            self.__db.executemany(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE key = ?",
+                [(STATUS_DONE, now, key) for key in delivered]
+                + [(STATUS_FAILED, now, key) for key in failed],
+            )
+            self.__db.executemany(
+                "UPDATE jobs SET attempts = ?, next_attempt_at = ?, updated_at = ? WHERE key = ?",
+                retry_rows,
+            )
+
+    def count_pending(self, kind: Optional[str] = None) -> int:
+        if kind is None:
+            query, params = "SELECT COUNT(*) FROM jobs WHERE status = ?", (
+                STATUS_PENDING,
+            )
+        else:
+            query = "SELECT COUNT(*) FROM jobs WHERE status = ? AND kind = ?"
+            params = (STATUS_PENDING, kind)
+
+        return self.__db.execute(query, params).fetchone()[0]
+
+    def prune(self, older_than: float):
+        """Deletes finished jobs last updated more than `older_than` seconds ago. Their keys can then be queued again."""
+        cutoff = time.time() - older_than
+        with self.__db:
+            cursor = self.__db.execute(
+                "DELETE FROM jobs WHERE status != ? AND updated_at < ?",
+                (STATUS_PENDING, cutoff),
+            )
+
+        if cursor.rowcount > 0:
+            logger.info(f"Pruned {cursor.rowcount} finished outbox job(s)")
+
+    def close(self):
+        self.__db.close()
+
+
+_outbox: Optional[Outbox] = None
+
+
+def get_outbox() -> Outbox:
+    """Returns the outbox shared by every cog that sends notifications."""
+    global _outbox
+    if _outbox is not None:
+        return _outbox
+
+    cache_path = os.path.join(SELF_PATH, CacheConfig.CACHE_FOLDER_NAME)
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+
+    _outbox = Outbox(
+        os.path.join(cache_path, CacheConfig.OUTBOX_DB_FILE_NAME),
+        LiveConfig.get_cfg_value("meta", "outbox_max_attempts", DEFAULT_MAX_ATTEMPTS),
+    )
+    return _outbox
@@ -0,0 +1,100 @@
+"""Decides how often each branch gets polled, based on how often it actually changes."""
+
+import time
+import logging
+
+from typing import Iterable, Optional
+
+logger = logging.getLogger("discord.cdn.scheduler")
+
+DEFAULT_MIN_INTERVAL = 30  # seconds
+DEFAULT_BASE_INTERVAL = 60 * 5  # seconds
+DEFAULT_MAX_INTERVAL = 60 * 15  # seconds
+DEFAULT_BACKOFF = 1.5
+
+
+class BranchSchedule:
+    __slots__ = ("interval", "next_poll_at", "last_change_at", "changes")
+
+    def __init__(self, interval: float, next_poll_at: float):
+        self.interval = interval
+        self.next_poll_at = next_poll_at
+        self.last_change_at: Optional[float] = None
+        self.changes = 0
+
+
+class PollScheduler:
+    """
+    Gives every branch its own polling interval.
+
+    Hot branches never poll less often than `min_interval`. Every other branch starts at `base_interval`, drops to
+    `min_interval` as soon as it changes, and backs off by `backoff` after every poll that finds nothing new.
+    No branch ever waits longer than `max_interval` between polls.
+    """
+
+    def __init__(
+        self,
+        branches: Iterable[str],
+        hot_branches: Iterable[str] = (),
+        min_interval: float = DEFAULT_MIN_INTERVAL,
+        base_interval: float = DEFAULT_BASE_INTERVAL,
+        max_interval: float = DEFAULT_MAX_INTERVAL,
+        backoff: float = DEFAULT_BACKOFF,
+    ):
+        self.hot_branches = set(hot_branches)
+        self.min_interval = min_interval
+        self.base_interval = min(base_interval, max_interval)
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        now = time.time()
+        # every branch is due straight away so startup sees the current state of everything
+        self.__schedules = {
+            branch: BranchSchedule(self.get_start_interval(branch), now)
+            for branch in branches
+        }
+
+    def get_start_interval(self, branch: str) -> float:
+        return self.min_interval if branch in self.hot_branches else self.base_interval
+
+    def get_due_branches(self, now: Optional[float] = None) -> list[str]:
+        now = now or time.time()
+        return [
+            branch
+            for branch, schedule in self.__schedules.items()
+            if schedule.next_poll_at <= now
+        ]
+
+    def get_interval(self, branch: str) -> float:
+        return self.__schedules[branch].interval
+
+    def record_poll(self, branch: str, changed: bool, now: Optional[float] = None):
+        """Schedules the next poll for `branch` based on whether this one found a change."""
+        now = now or time.time()
+        schedule = self.__schedules.setdefault(
+            branch, BranchSchedule(self.get_start_interval(branch), now)
+        )
+
+        if changed:
+            schedule.changes += 1
+            schedule.last_change_at = now
+            schedule.interval = self.min_interval
+        elif branch in self.hot_branches:
+            schedule.interval = self.min_interval
+        else:
+            schedule.interval = min(schedule.interval * self.backoff, self.max_interval)
+
+        schedule.next_poll_at = now + schedule.interval
+
+    def force(self, branches: Iterable[str]):
+        """Makes `branches` due on the next check."""
+        for branch in branches:
+            schedule = self.__schedules.setdefault(
+                branch, BranchSchedule(self.get_start_interval(branch), 0)
+            )
+            schedule.next_poll_at = 0
+
+    def force_all(self):
+        """Makes every branch due on the next check."""
+        for schedule in self.__schedules.values():
+            schedule.next_poll_at = 0
@@ -0,0 +1,129 @@
+"""Incremental parser for the pipe-separated values (PSV) format Ribbit responds with."""
+
+import codecs
+
+from functools import lru_cache
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+SEQN_PREFIX = "## seqn = "
+COMMENT_PREFIX = "##"
+DELIMITER = "|"
+
+TYPE_DEC = "DEC"
+TYPE_HEX = "HEX"
+TYPE_STRING = "STRING"
+
+
+def convert_dec(value: str) -> Optional[int]:
+    return int(value) if value else None
+
+
+# HEX columns hold hashes, which are kept as strings
+CONVERTERS: dict[str, Callable[[str], Any]] = {TYPE_DEC: convert_dec}
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    type: str
+    size: int
+
+    @classmethod
+    def from_header(cls, header: str):
+        """Parses a header cell such as `BuildId!DEC:4`."""
+        name, _, type_info = header.partition("!")
+        type_name, _, size = type_info.partition(":")
+        return cls(name, type_name.upper(), int(size) if size else 0)
+
+
+@lru_cache(maxsize=64)
+def parse_header(
+    line: str,
+) -> tuple[tuple[Column, ...], tuple[str, ...], tuple[tuple[int, Callable], ...]]:
+    """Parses a header line into its columns, their names and the converters of the typed ones."""
+    columns = tuple(Column.from_header(header) for header in line.split(DELIMITER))
+    converters = tuple(
+        (i, CONVERTERS[column.type])
+        for i, column in enumerate(columns)
+        if column.type in CONVERTERS
+    )
+    return columns, tuple(column.name for column in columns), converters
+
+
+class PSVParser:
+    """
+    Parses a PSV document fed to it in chunks of any size.
+
+    The header is parsed once into a list of columns, and every row is then mapped onto it by position. Every Ribbit
+    response of a kind shares the same header, so parsed headers are cached across parsers.
+    Passing `keys` skips every row whose first column isn't in it before the row is split into fields. With `typed`,
+    DEC columns are converted to ints, otherwise every value is kept as a string.
+    """
+
+    def __init__(self, keys: Optional[Iterable[str]] = None, typed: bool = False):
+        self.keys = set(keys) if keys is not None else None
+        self.typed = typed
+
+        self.seqn: Optional[int] = None
+        self.columns: list[Column] = []
+        self.rows: list[dict[str, Any]] = []
+
+        self.__names: tuple[str, ...] = ()
+        self.__converters: tuple[tuple[int, Callable[[str], Any]], ...] = ()
+        # decodes whole chunks at once, holding back a multi-byte character split across two chunks
+        self.__decoder = codecs.getincrementaldecoder("utf-8")()
+        self.__buffer = ""
+
+    def feed(self, chunk: bytes):
+        lines = (self.__buffer + self.__decoder.decode(chunk)).split("\n")
+        # the last piece is either empty or a line that continues in the next chunk
+        self.__buffer = lines.pop()
+        self.__parse_lines(lines)
+
+    def close(self):
+        """Parses whatever is left in the buffer. Call this once the whole response has been fed."""
+        rest = self.__buffer + self.__decoder.decode(b"", final=True)
+        self.__buffer = ""
+        if rest:
+            self.__parse_lines([rest])
+
+    def __parse_lines(self, lines: list[str]):
+        # this runs for every line of every response, so everything it needs is looked up once per call
+        keys, typed, append = self.keys, self.typed, self.rows.append
+        names, converters = self.__names, self.__converters
+        for line in lines:
+            line = line.rstrip("\r")
+            if not line:
+                continue
+
+            if line.startswith(COMMENT_PREFIX):
+                if line.startswith(SEQN_PREFIX):
+                    self.seqn = int(line[len(SEQN_PREFIX) :])
+                continue
+
+            if not names:
+                columns, names, converters = parse_header(line)
+                self.columns = list(columns)
+                self.__names, self.__converters = names, converters
+                continue
+
+            if keys is not None and line.partition(DELIMITER)[0] not in keys:
+                continue
+
+            values = line.split(DELIMITER)
+            if typed:
+                for i, converter in converters:
+                    values[i] = converter(values[i])
+
+            append(dict(zip(names, values)))
+
+
+def parse(
+    data: bytes, keys: Optional[Iterable[str]] = None, typed: bool = False
+) -> PSVParser:
+    """Parses a complete PSV document."""
+    parser = PSVParser(keys, typed)
+    parser.feed(data)
+    parser.close()
+    return parser
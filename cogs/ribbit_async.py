@@ -1,10 +1,14 @@
+import time
 import httpx
 import logging
 import asyncio
 
-from dataclasses import dataclass
+from typing import Iterable, Optional
+from dataclasses import dataclass, field
 
 from .api.blizzard_tact import BlizzardTACTExplorer
+from .psv import PSVParser
+from .single_flight import SingleFlight
 
 logger = logging.getLogger("discord.ribbit")
 
@@ -17,44 +21,68 @@ url_raw = URL.split(":")
 HTTPS_TIMEOUT = 5  # seconds
 HTTPS_URL = "https://" + url_raw[0]
 
-field_name_conversions = {
-    "BuildConfig": "build_config",
-    "CDNConfig": "cdn_config",
-    "BuildId": "build",
-    "VersionsName": "build_text",
-    "ProductConfig": "product_config",
-    "KeyRing": "keyring",
-}
+# every Ribbit command goes to the same host, so one HTTP/2 connection can multiplex all of them
+HTTPS_LIMITS = httpx.Limits(
+    max_connections=2, max_keepalive_connections=2, keepalive_expiry=300
+)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Version:
-    region: str
+    """
+    Immutable snapshot of a single build, as listed in a versions response.
+
+    Two snapshots are equal when they describe the same build, no matter which region, seqn or fetch they came from.
+    """
+
+    branch: str
     build_config: str
     cdn_config: str
     build: str
     build_text: str
     product_config: str
-    branch: str
     keyring: str
-    seqn: int
-
-    def __init__(self, data: dict, seqn: int):
-        for k, v in data.items():
-            if k in field_name_conversions.keys():
-                key = field_name_conversions[k]
-            else:
-                key = k
-
-            self.__setattr__(key, v)
-
-        build_text_split = self.build_text.split(".")[:-1]
+    region: str = field(default="us", compare=False)
+    seqn: int = field(default=0, compare=False)
+    fetched_at: float = field(default=0.0, compare=False)
+
+    @classmethod
+    def from_row(cls, row: dict, branch: str, seqn: int, fetched_at: float):
+        """Creates a snapshot from a parsed versions row."""
+        build_text = row["VersionsName"]
+        build_text_split = build_text.split(".")[:-1]
         if len(build_text_split) > 1:
-            self.build_text = ".".join(build_text_split)
+            build_text = ".".join(build_text_split)
+
+        return cls(
+            branch=branch,
+            build_config=row["BuildConfig"],
+            cdn_config=row["CDNConfig"],
+            build=row["BuildId"],
+            build_text=build_text,
+            product_config=row.get("ProductConfig", ""),
+            keyring=row.get("KeyRing", ""),
+            region=row["Region"],
+            seqn=int(seqn),
+            fetched_at=fetched_at,
+        )
 
-        self.seqn = int(seqn)
+    @classmethod
+    def from_json(cls, branch: str, data: dict):
+        """Creates a snapshot from build data stored in the CDN state."""
+        return cls(
+            branch=branch,
+            build_config=data.get("build_config", ""),
+            cdn_config=data.get("cdn_config", ""),
+            build=data.get("build", ""),
+            build_text=data.get("build_text", ""),
+            product_config=data.get("product_config", ""),
+            keyring=data.get("keyring", ""),
+            region=data.get("region", "us"),
+            seqn=int(data.get("seqn", 0)),
+        )
 
-    def __dict__(self):
+    def to_json(self) -> dict:
         return {
             "region": self.region,
             "build_config": self.build_config,
@@ -75,43 +103,42 @@ class RibbitClient:
     url = url_raw[0]
     port = int(url_raw[1])
 
+    def __init__(self):
+        self.__client: Optional[httpx.AsyncClient] = None
+        # concurrent callers asking for the same command share one request, so results must be treated as read-only
+        self.flights = SingleFlight()
+
+    def __get_client(self) -> httpx.AsyncClient:
+        """Returns the shared HTTP/2 client, creating it on first use."""
+        if self.__client is None or self.__client.is_closed:
+            logger.debug("Creating pooled Ribbit HTTP client...")
+            self.__client = httpx.AsyncClient(
+                base_url=HTTPS_URL,
+                http2=True,
+                timeout=HTTPS_TIMEOUT,
+                limits=HTTPS_LIMITS,
+            )
+
+        return self.__client
+
     async def __connect(self):
         logger.debug("Initializing new socket connection...")
         self.reader, self.writer = await asyncio.open_connection(self.url, self.port)
 
-    def __parse(self, data: bytes):
-        data_str = data.decode("utf-8")
-        data_split = data_str.split("\n")
-        sequence = None
-        index = []
-        output = {}
+    def __index_rows(self, rows: list[dict], key: str) -> dict[str, dict]:
+        return {row[key]: row for row in rows}
 
-        for line in data_split:
-            if not line:
+    def __read_summary(self, parser: PSVParser) -> dict[str, int]:
+        """Turns a parsed `v2/summary` response into a `{product: versions seqn}` mapping."""
+        output = {}
+        for row in parser.rows:
+            # rows flagged 'cdn' or 'bgdl' track other endpoints, we only care about versions
+            if row.get("Flags"):
                 continue
 
-            if line.startswith("## seqn = "):
-                sequence = line.replace("## seqn = ", "")
-                continue
+            output[row["Product"]] = row["Seqn"]
 
-            line_split = line.split("|")
-
-            if len(line_split) > 1:
-                if not index:
-                    for index_key in line_split:
-                        l = index_key.split("!")
-                        if len(l) == 2:
-                            index.append(l[0])
-                    continue
-                else:
-                    key = line_split[0]
-                    for i, entry in enumerate(line_split):
-                        if key not in output.keys():
-                            output[key] = {}
-                        k = index[i]
-                        output[key][k] = entry
-
-        return sequence, output
+        return output
 
     # async def __send(self, command: str):
     #    logger.debug(f"Sending Ribbit command '{command}'...")
@@ -125,19 +152,21 @@ class RibbitClient:
 
     #    return seq, data
 
-    async def __send(self, command: str):
-        client = httpx.AsyncClient(
-            base_url=HTTPS_URL, http2=True, timeout=HTTPS_TIMEOUT
-        )
+    async def __send(self, command: str, parser: Optional[PSVParser] = None):
+        client = self.__get_client()
+        parser = parser or PSVParser()
 
         try:
-            res = await client.get(command)
-            if res.status_code != 200:
-                logger.warning(f"Non-200 response code for command '{command}'")
-                return None, None
+            async with client.stream("GET", command) as res:
+                if res.status_code != 200:
+                    logger.warning(f"Non-200 response code for command '{command}'")
+                    return None, None
+
+                async for chunk in res.aiter_bytes():
+                    parser.feed(chunk)
 
-            seqn, data = self.__parse(res.read())
-            return seqn, data
+            parser.close()
+            return parser.seqn, parser
         except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout) as exc:
             logger.warning(
                 f"HTTP {exc.__repr__()} while executing Ribbit command '{command}'",
@@ -152,56 +181,80 @@ class RibbitClient:
         return None, None
 
     async def __receive(self):
-        chunks = []
+        parser = PSVParser()
         async for chunk in self.reader:
             if chunk:
-                chunks.append(chunk)
+                parser.feed(chunk)
             else:
                 break
-        seq, data = self.__parse(b"".join(chunks))
-        return seq, data
+        parser.close()
+        return parser.seqn, parser
 
     async def __close(self):
         self.writer.close()
         await self.writer.wait_closed()
 
-    async def fetch_summary(self) -> tuple[dict, int]:
+    async def __fetch_summary(self) -> tuple[dict[str, int], int]:
         # await self.__connect()
-        sequence, data = await self.__send("v2/summary")
-        return data, sequence
+        sequence, parser = await self.__send("v2/summary", PSVParser(typed=True))
+        if parser is None:
+            return None, None
 
-    async def fetch_cdn_info_for_product(self, product: str) -> tuple[dict, int]:
-        # await self.__connect()
-        sequence, data = await self.__send(f"v2/products/{product}/cdns")
-        return data, sequence
+        return self.__read_summary(parser), sequence
 
-    async def fetch_versions_for_product(
-        self, product: str = "wow"
-    ) -> tuple[dict, int]:
+    async def fetch_summary(self) -> tuple[dict[str, int], int]:
+        return await self.flights.do("v2/summary", self.__fetch_summary)
+
+    async def __fetch_cdn_info_for_product(self, command: str) -> tuple[dict, int]:
         # await self.__connect()
-        command = f"v2/products/{product}/versions"
-        sequence, data = await self.__send(command)
-        if not data:
+        sequence, parser = await self.__send(command)
+        if parser is None:
             return None, None
 
-        output = {}
+        return self.__index_rows(parser.rows, "Name"), sequence
 
-        for region in data:
-            if region != "us" and product != "catalogs":
-                continue
+    async def fetch_cdn_info_for_product(self, product: str) -> tuple[dict, int]:
+        command = f"v2/products/{product}/cdns"
+        return await self.flights.do(
+            command, self.__fetch_cdn_info_for_product, command
+        )
 
-            d = data[region]
-            regionData = d
-            regionData["region"] = region
-            regionData["branch"] = product
+    async def __fetch_versions_for_product(
+        self, command: str, product: str, regions: Optional[frozenset[str]]
+    ) -> tuple[dict, int]:
+        # await self.__connect()
+        sequence, parser = await self.__send(command, PSVParser(keys=regions))
+        if not parser or not parser.rows:
+            return None, None
 
-            output[d["Region"]] = Version(regionData, sequence)
+        fetched_at = time.time()
+        output = {
+            row["Region"]: Version.from_row(row, product, sequence, fetched_at)
+            for row in parser.rows
+        }
 
         return output, sequence
 
-    def shutdown(self):
+    async def fetch_versions_for_product(
+        self, product: str = "wow", regions: Optional[Iterable[str]] = None
+    ) -> tuple[dict, int]:
+        """Fetches the versions for `product`, keeping only the rows for `regions`. Passing `None` keeps every region."""
+        command = f"v2/products/{product}/versions"
+        regions = frozenset(regions) if regions is not None else None
+        return await self.flights.do(
+            (command, regions),
+            self.__fetch_versions_for_product,
+            command,
+            product,
+            regions,
+        )
+
+    async def shutdown(self):
         logger.info("Shutting down Ribbit client...")
-        self.__close()
+        if self.__client is not None and not self.__client.is_closed:
+            await self.__client.aclose()
+
+        self.__client = None
 
 
 if __name__ == "__main__":
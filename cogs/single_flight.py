@@ -0,0 +1,50 @@
+"""Coalesces concurrent calls for the same work into a single in-flight call."""
+
+import asyncio
+import logging
+
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger("discord.single_flight")
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time.
+
+    Callers asking for a key that's already in flight wait for that call and share its result, or its exception,
+    instead of starting their own. The call runs as its own task, so a caller being cancelled doesn't cancel the work
+    the other callers are waiting on.
+    """
+
+    def __init__(self):
+        self.__calls: dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.joined = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self.__calls
+
+    def __done(self, key: Hashable, future: asyncio.Future):
+        if self.__calls.get(key) is future:
+            del self.__calls[key]
+
+        # every caller may have been cancelled, which would leave the exception unretrieved
+        if not future.cancelled():
+            future.exception()
+
+    async def do(
+        self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """Awaits `func(*args, **kwargs)`, or the call already running for `key`."""
+        future = self.__calls.get(key)
+        if future is not None:
+            self.joined += 1
+            logger.debug(f"Joining in-flight call for {key}")
+        else:
+            self.started += 1
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self.__calls[key] = future
+            future.add_done_callback(lambda done: self.__done(key, done))
+
+        return await asyncio.shield(future)
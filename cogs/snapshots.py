@@ -0,0 +1,166 @@
+"""Compressed snapshots of the CDN build data, written only when it changes."""
+
+import os
+import gzip
+import json
+import time
+import logging
+
+from dataclasses import dataclass
+
+logger = logging.getLogger("discord.cdn.snapshots")
+
+SNAPSHOT_FULL = "full"
+SNAPSHOT_DELTA = "delta"
+FILE_SUFFIX = ".json.gz"
+
+DEFAULT_MAX_COUNT = 50
+DEFAULT_MAX_AGE = 60 * 60 * 24 * 30  # seconds
+DEFAULT_FULL_EVERY = 20  # deltas between full snapshots
+
+
+@dataclass(frozen=True, slots=True)
+class Snapshot:
+    id: int
+    kind: str
+    created_at: float
+    path: str
+
+
+class SnapshotStore:
+    """
+    Directory of gzipped JSON snapshots of the build data.
+
+    A full snapshot holds every branch, a delta only the branches that changed since the snapshot before it. Every
+    `full_every` deltas a new full snapshot is written, so restoring never has to replay a long chain. Snapshots past
+    `max_count`, or older than `max_age` seconds, are deleted, except for the full snapshot the oldest kept delta
+    depends on. Snapshot ids only ever grow, so file names never collide.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_count: int = DEFAULT_MAX_COUNT,
+        max_age: float = DEFAULT_MAX_AGE,
+        full_every: int = DEFAULT_FULL_EVERY,
+    ):
+        self.path = path
+        self.max_count = max(max_count, 1)
+        self.max_age = max_age
+        self.full_every = full_every
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.__snapshots = self.__scan()
+
+    @property
+    def snapshots(self) -> list[Snapshot]:
+        return list(self.__snapshots)
+
+    def __scan(self) -> list[Snapshot]:
+        """Indexes the snapshot directory once, so writing a snapshot never has to list it again."""
+        snapshots = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+
+            if not name.endswith(FILE_SUFFIX):
+                continue
+
+            try:
+                id, kind, created_at = name[: -len(FILE_SUFFIX)].split("-")
+                snapshots.append(Snapshot(int(id), kind, float(created_at), path))
+            except ValueError:
+                logger.warning(f"Ignoring unrecognized file in snapshot folder: {name}")
+
+        return sorted(snapshots, key=lambda snapshot: snapshot.id)
+
+    def needs_full(self) -> bool:
+        """Returns whether the next snapshot has to hold every branch."""
+        deltas = 0
+        for snapshot in reversed(self.__snapshots):
+            if snapshot.kind == SNAPSHOT_FULL:
+                return deltas >= self.full_every
+
+            deltas += 1
+
+        return True
+
+    def write(self, builds: dict[str, dict], full: bool) -> Snapshot:
+        """Writes a snapshot of `builds`, which must hold every branch if `full` is set."""
+        id = self.__snapshots[-1].id + 1 if self.__snapshots else 1
+        kind = SNAPSHOT_FULL if full else SNAPSHOT_DELTA
+        created_at = int(time.time())
+        path = os.path.join(self.path, f"{id:08d}-{kind}-{created_at}{FILE_SUFFIX}")
+
+        data = gzip.compress(
+            json.dumps(
+                {"kind": kind, "created_at": created_at, "builds": builds}
+            ).encode()
+        )
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        snapshot = Snapshot(id, kind, created_at, path)
+        self.__snapshots.append(snapshot)
+        logger.debug(
+            f"Wrote {kind} snapshot {id} ({len(builds)} branch(es), {len(data)} bytes)"
+        )
+
+        self.prune()
+        return snapshot
+
+    def prune(self):
+        now = time.time()
+        snapshots = self.__snapshots
+        keep_from = max(len(snapshots) - self.max_count, 0)
+        while (
+            keep_from < len(snapshots) - 1
+            and now - snapshots[keep_from].created_at > self.max_age
+        ):
+            keep_from += 1
+
+        # a delta is useless without the full snapshot it builds on
+        while keep_from > 0 and snapshots[keep_from].kind != SNAPSHOT_FULL:
+            keep_from -= 1
+
+        for snapshot in snapshots[:keep_from]:
+            try:
+                os.remove(snapshot.path)
+            except FileNotFoundError:
+                pass
+
+        if keep_from > 0:
+            logger.debug(f"Pruned {keep_from} old snapshot(s)")
+            self.__snapshots = snapshots[keep_from:]
+
+    def __read(self, snapshot: Snapshot) -> dict[str, dict]:
+        with open(snapshot.path, "rb") as f:
+            return json.loads(gzip.decompress(f.read()))["builds"]
+
+    def restore(self, id: int) -> dict[str, dict]:
+        """Rebuilds the build data as it was when snapshot `id` was written."""
+        index = next(
+            (i for i, snapshot in enumerate(self.__snapshots) if snapshot.id == id),
+            None,
+        )
+        if index is None:
+            raise ValueError(f"No snapshot with id {id}")
+
+        start = index
+        while self.__snapshots[start].kind != SNAPSHOT_FULL:
+            if start == 0:
+                raise ValueError(f"No full snapshot found before snapshot {id}")
+
+            start -= 1
+
+        builds = {}
+        for snapshot in self.__snapshots[start : index + 1]:
+            builds.update(self.__read(snapshot))
+
+        return builds
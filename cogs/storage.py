@@ -0,0 +1,545 @@
+"""Storage backends for guild, user and CDN state."""
+
+import os
+import sys
+import copy
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from .config import CacheConfig, LiveConfig
+
+SELF_PATH = os.path.dirname(os.path.realpath(__file__))
+
+logger = logging.getLogger("discord.storage")
+
+
+class StorageBackend(ABC):
+    """
+    Base class for the places Algalon keeps its persistent state.
+
+    Every write method takes a batch of changes so backends can apply them in a single write or transaction.
+    Read methods return copies, so callers are free to mutate what they get back.
+    """
+
+    CONFIG = CacheConfig()
+
+    @classmethod
+    def get_default_cdn(cls) -> dict:
+        return {
+            "buildInfo": {},
+            cls.CONFIG.indices.LAST_UPDATED_BY: sys.platform,
+            cls.CONFIG.indices.LAST_UPDATED_AT: time.time(),
+        }
+
+    @staticmethod
+    def get_default_lookup() -> dict[str, list[str]]:
+        return {branch.name: [] for branch in CacheConfig.PRODUCTS}
+
+    # GUILDS
+
+    @abstractmethod
+    def get_guild(self, guild_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    def get_all_guilds(self) -> dict[str, dict]: ...
+
+    @abstractmethod
+    def put_guild(self, guild_id: str, config: dict): ...
+
+    @abstractmethod
+    def update_guild_setting(self, guild_id: str, setting: str, value: Any): ...
+
+    @abstractmethod
+    def delete_guild(self, guild_id: str): ...
+
+    # USERS
+
+    @abstractmethod
+    def load_users(self) -> dict:
+        """Returns the user config in the `{"lookup": ..., "users": ...}` layout used by `user_cfg.json`."""
+
+    @abstractmethod
+    def save_users(
+        self,
+        users: dict[str, dict],
+        removed: list[str],
+        subscriptions: list[tuple[str, str, bool]],
+    ):
+        """
+        Upserts `users`, deletes `removed` and applies `subscriptions`, `(branch, user id, subscribed)` changes in the
+        order they were made. A subscription goes to the end of the branch's subscriber list.
+        """
+
+    # CDN
+
+    @abstractmethod
+    def load_cdn(self) -> dict:
+        """Returns the CDN data in the layout used by `cdn.json`."""
+
+    @abstractmethod
+    def load_seqns(self) -> dict[str, Any]: ...
+
+    @abstractmethod
+    def save_cdn(
+        self, meta: dict[str, Any], builds: dict[str, dict], seqns: dict[str, Any]
+    ):
+        """Upserts the given CDN metadata, per-branch build data and per-branch seqn records."""
+
+    def close(self):
+        pass
+
+
+class JSONStorage(StorageBackend):
+    """
+    The original JSON file storage. Each file is parsed once and rewritten atomically when it changes.
+
+    Seqn records live in `cdn.json` next to the build data, so both change in the same atomic replace. Records from
+    the old `seqn_cache.json` are moved over on the first CDN write.
+    """
+
+    SEQNS_KEY = "seqns"
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self.guild_path = os.path.join(cache_path, self.CONFIG.GUILD_CFG_FILE_NAME)
+        self.user_path = os.path.join(cache_path, self.CONFIG.USER_CFG_FILE_NAME)
+        self.cdn_path = os.path.join(cache_path, self.CONFIG.CACHE_FILE_NAME)
+        self.seqn_path = os.path.join(cache_path, self.CONFIG.SEQN_FILE_NAME)
+
+        self.__docs: dict[str, Any] = {}
+        self.__lock = threading.Lock()
+
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+
+    def __get_default(self, path: str):
+        if path == self.user_path:
+            return {"lookup": self.get_default_lookup(), "users": {}}
+        elif path == self.cdn_path:
+            return self.get_default_cdn()
+
+        return {}
+
+    def __doc(self, path: str) -> dict:
+        if path not in self.__docs:
+            if os.path.exists(path):
+                with open(path, "r") as file:
+                    self.__docs[path] = json.load(file)
+            else:
+                self.__docs[path] = self.__get_default(path)
+                self.__write(path)
+
+        return self.__docs[path]
+
+    def __write(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.__docs[path], file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, path)
+
+    # GUILDS
+
+    def get_guild(self, guild_id: str) -> Optional[dict]:
+        with self.__lock:
+            config = self.__doc(self.guild_path).get(guild_id)
+            return copy.deepcopy(config)
+
+    def get_all_guilds(self) -> dict[str, dict]:
+        with self.__lock:
+            return copy.deepcopy(self.__doc(self.guild_path))
+
+    def put_guild(self, guild_id: str, config: dict):
+        with self.__lock:
+            self.__doc(self.guild_path)[guild_id] = copy.deepcopy(config)
+            self.__write(self.guild_path)
+
+    def update_guild_setting(self, guild_id: str, setting: str, value: Any):
+        with self.__lock:
+            self.__doc(self.guild_path)[guild_id][setting] = copy.deepcopy(value)
+            self.__write(self.guild_path)
+
+    def delete_guild(self, guild_id: str):
+        with self.__lock:
+            self.__doc(self.guild_path).pop(guild_id, None)
+            self.__write(self.guild_path)
+
+    # USERS
+
+    def load_users(self) -> dict:
+        with self.__lock:
+            return copy.deepcopy(self.__doc(self.user_path))
+
+    def save_users(
+        self,
+        users: dict[str, dict],
+        removed: list[str],
+        subscriptions: list[tuple[str, str, bool]],
+    ):
+        with self.__lock:
+            doc = self.__doc(self.user_path)
+            doc["users"].update(copy.deepcopy(users))
+            for user_id in removed:
+                doc["users"].pop(user_id, None)
+
+            for branch, user_id, subscribed in subscriptions:
+                subscribers = doc["lookup"].setdefault(branch, [])
+                if user_id in subscribers:
+                    subscribers.remove(user_id)
+
+                if subscribed:
+                    subscribers.append(user_id)
+
+            self.__write(self.user_path)
+
+    # CDN
+
+    def __get_seqns(self) -> dict[str, Any]:
+        doc = self.__doc(self.cdn_path)
+        if self.SEQNS_KEY not in doc:
+            legacy = {}
+            if os.path.exists(self.seqn_path):
+                with open(self.seqn_path, "r") as file:
+                    legacy = json.load(file)
+
+            doc[self.SEQNS_KEY] = legacy
+
+        return doc[self.SEQNS_KEY]
+
+    def load_cdn(self) -> dict:
+        with self.__lock:
+            doc = self.__doc(self.cdn_path)
+            return copy.deepcopy(
+                {key: value for key, value in doc.items() if key != self.SEQNS_KEY}
+            )
+
+    def load_seqns(self) -> dict[str, Any]:
+        with self.__lock:
+            return copy.deepcopy(self.__get_seqns())
+
+    def save_cdn(
+        self, meta: dict[str, Any], builds: dict[str, dict], seqns: dict[str, Any]
+    ):
+        with self.__lock:
+            doc = self.__doc(self.cdn_path)
+            doc.update(copy.deepcopy(meta))
+            doc["buildInfo"].update(copy.deepcopy(builds))
+            self.__get_seqns().update(copy.deepcopy(seqns))
+            self.__write(self.cdn_path)
+
+            if os.path.exists(self.seqn_path):
+                # everything in it was carried over into cdn.json by the write above
+                os.remove(self.seqn_path)
+
+
+class SQLiteStorage(StorageBackend):
+    """SQLite storage in WAL mode. Guilds, users and branches each get their own row, so updates only touch what changed."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS guilds (
+        guild_id TEXT PRIMARY KEY,
+        config TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        entry TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        branch TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        PRIMARY KEY (branch, user_id)
+    );
+    CREATE INDEX IF NOT EXISTS subscriptions_user ON subscriptions (user_id);
+    CREATE TABLE IF NOT EXISTS builds (
+        branch TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS seqns (
+        branch TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS cdn_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS storage_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """
+
+    IMPORT_MARKER = "json_import_complete"
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.__lock = threading.Lock()
+
+        # state is flushed from worker threads, so the connection is shared and guarded by __lock
+        self.__db = sqlite3.connect(db_path, check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+
+        # databases created before the import marker existed were imported when they were created
+        predates_marker = self.__has_table("guilds") and not self.__has_table(
+            "storage_meta"
+        )
+        self.__db.executescript(self.SCHEMA)
+        self.__db.commit()
+        self.__drop_subscription_positions()
+
+        if predates_marker:
+            self.mark_import_complete()
+
+    def __has_table(self, name: str) -> bool:
+        return (
+            self.__db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+            ).fetchone()
+            is not None
+        )
+
+    def __drop_subscription_positions(self):
+        """
+        Rebuilds a subscriptions table from before subscribers were ordered by rowid, keeping their order.
+
+        Rewriting every position of a branch on each subscribe made a single change cost as much as the whole list.
+        """
+        columns = [
+            row[1] for row in self.__db.execute("PRAGMA table_info(subscriptions)")
+        ]
+        if "position" not in columns:
+            return
+
+        logger.info("Migrating subscriptions table to rowid order...")
+        with self.__db:
+            self.__db.execute(
+                "CREATE TABLE subscriptions_new (branch TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (branch, user_id))"
+            )
+            self.__db.execute(
+                "INSERT INTO subscriptions_new (branch, user_id) SELECT branch, user_id FROM subscriptions ORDER BY branch, position"
+            )
+            self.__db.execute("DROP TABLE subscriptions")
+            self.__db.execute("ALTER TABLE subscriptions_new RENAME TO subscriptions")
+
+    def __query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self.__lock:
+            return self.__db.execute(sql, params).fetchall()
+
+    def __transaction(self, statements: list[tuple[str, list[tuple]]]):
+        with self.__lock:
+            with self.__db:
+                for sql, rows in statements:
+                    if rows:
+                        self.__db.executemany(sql, rows)
+
+    # IMPORT
+
+    def is_import_complete(self) -> bool:
+        rows = self.__query(
+            "SELECT 1 FROM storage_meta WHERE key = ?", (self.IMPORT_MARKER,)
+        )
+        return bool(rows)
+
+    def mark_import_complete(self):
+        self.__transaction(
+            [
+                (
+                    "INSERT OR REPLACE INTO storage_meta (key, value) VALUES (?, ?)",
+                    [(self.IMPORT_MARKER, json.dumps(time.time()))],
+                )
+            ]
+        )
+
+    # GUILDS
+
+    def get_guild(self, guild_id: str) -> Optional[dict]:
+        rows = self.__query("SELECT config FROM guilds WHERE guild_id = ?", (guild_id,))
+        if not rows:
+            return None
+
+        return json.loads(rows[0][0])
+
+    def get_all_guilds(self) -> dict[str, dict]:
+        rows = self.__query("SELECT guild_id, config FROM guilds")
+        return {guild_id: json.loads(config) for guild_id, config in rows}
+
+    def put_guild(self, guild_id: str, config: dict):
+        self.__transaction(
+            [
+                (
+                    "INSERT OR REPLACE INTO guilds (guild_id, config) VALUES (?, ?)",
+                    [(guild_id, json.dumps(config))],
+                )
+            ]
+        )
+
+    def update_guild_setting(self, guild_id: str, setting: str, value: Any):
+        self.__transaction(
+            [
+                (
+                    "UPDATE guilds SET config = json_set(config, '$.' || ?, json(?)) WHERE guild_id = ?",
+                    [(setting, json.dumps(value), guild_id)],
+                )
+            ]
+        )
+
+    def delete_guild(self, guild_id: str):
+        self.__transaction([("DELETE FROM guilds WHERE guild_id = ?", [(guild_id,)])])
+
+    # USERS
+
+    def load_users(self) -> dict:
+        users = {
+            user_id: json.loads(entry)
+            for user_id, entry in self.__query("SELECT user_id, entry FROM users")
+        }
+
+        lookup = self.get_default_lookup()
+        # rowids only grow, so they keep subscribers in the order they subscribed
+        rows = self.__query("SELECT branch, user_id FROM subscriptions ORDER BY rowid")
+        for branch, user_id in rows:
+            lookup.setdefault(branch, []).append(user_id)
+
+        return {"lookup": lookup, "users": users}
+
+    def save_users(
+        self,
+        users: dict[str, dict],
+        removed: list[str],
+        subscriptions: list[tuple[str, str, bool]],
+    ):
+        statements = [
+            (
+                "INSERT OR REPLACE INTO users (user_id, entry) VALUES (?, ?)",
+                [(user_id, json.dumps(entry)) for user_id, entry in users.items()],
+            ),
+            (
+                "DELETE FROM users WHERE user_id = ?",
+                [(user_id,) for user_id in removed],
+            ),
+        ]
+        # one statement per change, so they apply in order. REPLACE gives a resubscribed user a new rowid, moving them
+        # to the end of the list like the in-memory lookup
+        for branch, user_id, subscribed in subscriptions:
+            if subscribed:
+                sql = "INSERT OR REPLACE INTO subscriptions (branch, user_id) VALUES (?, ?)"
+            else:
+                sql = "DELETE FROM subscriptions WHERE branch = ? AND user_id = ?"
+
+            statements.append((sql, [(branch, user_id)]))
+
+        self.__transaction(statements)
+
+    # CDN
+
+    def load_cdn(self) -> dict:
+        meta = dict(self.__query("SELECT key, value FROM cdn_meta"))
+        if not meta:
+            cdn = self.get_default_cdn()
+            build_info = cdn.pop("buildInfo")
+            self.save_cdn(cdn, build_info, {})
+            meta = {key: json.dumps(value) for key, value in cdn.items()}
+
+        cdn = {key: json.loads(value) for key, value in meta.items()}
+        cdn["buildInfo"] = {
+            branch: json.loads(data)
+            for branch, data in self.__query("SELECT branch, data FROM builds")
+        }
+        return cdn
+
+    def load_seqns(self) -> dict[str, Any]:
+        rows = self.__query("SELECT branch, data FROM seqns")
+        return {branch: json.loads(data) for branch, data in rows}
+
+    def save_cdn(
+        self, meta: dict[str, Any], builds: dict[str, dict], seqns: dict[str, Any]
+    ):
+        self.__transaction(
+            [
+                (
+                    "INSERT OR REPLACE INTO cdn_meta (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value)) for key, value in meta.items()],
+                ),
+                (
+                    "INSERT OR REPLACE INTO builds (branch, data) VALUES (?, ?)",
+                    [(branch, json.dumps(data)) for branch, data in builds.items()],
+                ),
+                (
+                    "INSERT OR REPLACE INTO seqns (branch, data) VALUES (?, ?)",
+                    [(branch, json.dumps(data)) for branch, data in seqns.items()],
+                ),
+            ]
+        )
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+
+def import_from_json(source: JSONStorage, target: StorageBackend):
+    """
+    Copies everything in the JSON files into another backend.
+
+    Every write replaces what it targets, so an import that was interrupted can simply be run again.
+    """
+    logger.info("Importing JSON state into storage backend...")
+
+    guilds = source.get_all_guilds()
+    for guild_id, config in guilds.items():
+        target.put_guild(guild_id, config)
+
+    user_cfg = source.load_users()
+    subscriptions = [
+        (branch, user_id, True)
+        for branch, user_ids in user_cfg["lookup"].items()
+        for user_id in user_ids
+    ]
+    target.save_users(user_cfg["users"], [], subscriptions)
+
+    cdn = source.load_cdn()
+    build_info = cdn.pop("buildInfo")
+    target.save_cdn(cdn, build_info, source.load_seqns())
+
+    logger.info(
+        f"Imported {len(guilds)} guild(s), {len(user_cfg['users'])} user(s) and {len(build_info)} branch(es)"
+    )
+
+
+STORAGE_JSON = "json"
+STORAGE_SQLITE = "sqlite"
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """Returns the storage backend shared by every config class, selected by `meta.storage_backend`."""
+    global _storage
+    if _storage is not None:
+        return _storage
+
+    cache_path = os.path.join(SELF_PATH, CacheConfig.CACHE_FOLDER_NAME)
+    json_storage = JSONStorage(cache_path)
+    backend = LiveConfig.get_cfg_value("meta", "storage_backend", STORAGE_JSON)
+
+    if backend == STORAGE_SQLITE:
+        db_path = os.path.join(cache_path, CacheConfig.STORAGE_DB_FILE_NAME)
+        storage = SQLiteStorage(db_path)
+        # the marker is only written once everything was copied, so a crash mid-import retries it on the next start
+        if not storage.is_import_complete():
+            import_from_json(json_storage, storage)
+            storage.mark_import_complete()
+
+        _storage = storage
+    else:
+        _storage = json_storage
+
+    logger.info(f"Using {backend} storage backend")
+    return _storage
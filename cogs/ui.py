@@ -75,7 +75,7 @@ class UserSelectMenu(ui.Select):
         selected = interaction.data["values"]
         if len(selected) > 0:
             game = WatcherConfig.get_game_from_branch(selected[0])
-            with USER_CONFIG as cfg:
+            async with USER_CONFIG as cfg:
                 branches = get_branches_for_game(game)
                 old_watchlist = cfg.get_watchlist(user_id)
                 for branch in branches:
@@ -146,7 +146,7 @@ class MonitorSelectMenu(ui.Select):
 
         branch = self.branch.name
         selected = interaction.data["values"]
-        with USER_CONFIG as cfg:
+        async with USER_CONFIG as cfg:
             for field in Monitorable:
                 monitoring = cfg.is_monitoring(user_id, branch, field)
                 if field in selected and not monitoring:
@@ -162,11 +162,11 @@ class MonitorSelectMenu(ui.Select):
 
 class MonitorUI(ui.View):
     @classmethod
-    def create(cls, user_id: int, branch: SUPPORTED_PRODUCTS):
+    async def create(cls, user_id: int, branch: SUPPORTED_PRODUCTS):
         view = cls()
 
         min_values = 0
-        with USER_CONFIG as user_data:
+        async with USER_CONFIG.read() as user_data:
             options = []
             for field in Monitorable:
                 option = discord.SelectOption(
@@ -1,14 +1,15 @@
-import os
+import copy
 import json
+import asyncio
 import logging
 
 from enum import StrEnum
+from contextlib import asynccontextmanager
 from typing import TypeVar, Optional
 
 from .config import CacheConfig
 from .config import SUPPORTED_PRODUCTS
-
-SELF_PATH = os.path.dirname(os.path.realpath(__file__))
+from .storage import get_storage
 
 logger = logging.getLogger("discord.cdn.user-cfg")
 
@@ -264,66 +265,79 @@ class LookupTable:
         return True
 
 
-class UserConfigFile:
-    CONFIG = CacheConfig()
+class MonitorIndex:
+    """In-memory reverse index from each (branch, field) pair to the users monitoring it."""
 
     def __init__(self):
-        self.CACHE_PATH = os.path.join(SELF_PATH, self.CONFIG.CACHE_FOLDER_NAME)
-        self.CONFIG_PATH = os.path.join(self.CACHE_PATH, self.CONFIG.USER_CFG_FILE_NAME)
+        self.built = False
+        self.__watchers: dict[tuple[str, str], set[str]] = {}
 
-        if not os.path.exists(self.CONFIG_PATH):
-            self.__init_cfg_file()
+    def build(self, users: dict[str, dict]):
+        logger.debug(f"Building monitor index for {len(users)} user(s)...")
+        self.__watchers.clear()
 
-        self.__active = False
-        self.stale = True
+        for user_id, entry in users.items():
+            for field, branches in entry.get("monitor", {}).items():
+                for branch in branches:
+                    self.add(user_id, branch, field)
 
-    def __enter__(self):
-        with open(self.CONFIG_PATH, "r") as f:
-            data = json.load(f)
+        self.built = True
 
-        self.__populate(data)
-        self.__active = True
-        return self
+    def add(self, user_id: UID, branch: str, field: Monitorable | str):
+        self.__watchers.setdefault((branch, str(field)), set()).add(str(user_id))
 
-    def __exit__(self, exc_type, exc_value, exc_traceback):
-        self.__active = False
-        self.stale = True
-        if exc_type is not None:
-            logger.error(
-                f"Exception of type {exc_type.__name__} occurred within UserConfigFile context: {exc_value}",
-                exc_info=True,
-            )
+    def remove(self, user_id: UID, branch: str, field: Monitorable | str):
+        key = (branch, str(field))
+        if key not in self.__watchers:
             return
 
-        with open(self.CONFIG_PATH, "w") as f:
-            json.dump(self, f, indent=4, cls=ConfigFileEncoder)
+        self.__watchers[key].discard(str(user_id))
+        if len(self.__watchers[key]) == 0:
+            del self.__watchers[key]
 
-    def __init_cfg_file(self):
-        if not os.path.exists(self.CACHE_PATH):
-            os.makedirs(self.CACHE_PATH)
+    def get_watchers(self, branch: str, field: Monitorable | str) -> set[str]:
+        return self.__watchers.get((branch, str(field)), set())
 
-        default_lookup = LookupTable.get_default()
-        default_users = UserTable.get_default()
-        default = {"lookup": default_lookup, "users": default_users}
-        with open(self.CONFIG_PATH, "w") as f:
-            json.dump(default, f, indent=4)
 
-    def __populate(self, config: dict):
-        self.__config = config
+class UserConfigContext:
+    """
+    The user config as seen from inside a `UserConfigFile` context.
+
+    Every change made through it is tracked, so only the users and subscriptions that actually changed get written
+    back to storage when the context exits.
+    """
+
+    def __init__(
+        self,
+        users: UserTable,
+        lookup: LookupTable,
+        index: MonitorIndex,
+        read_only: bool,
+    ):
+        self.users = users
+        self.lookup = lookup
+        self.index = index
+        self.read_only = read_only
+        self.active = True
 
-        self.lookup = LookupTable(self.__config["lookup"])
-        self.users = UserTable(self.__config["users"])
+        self.dirty_users: set[str] = set()
+        # (branch, user id) -> whether the user is subscribed now, in the order of the latest change to each
+        self.subscription_changes: dict[tuple[str, str], bool] = {}
 
-        self.stale = False
+    @property
+    def dirty(self) -> bool:
+        return bool(self.dirty_users or self.subscription_changes)
+
+    def mark_subscription(self, user_id: str, branch: str, subscribed: bool):
+        key = (branch, user_id)
+        self.subscription_changes.pop(key, None)
+        self.subscription_changes[key] = subscribed
 
     def to_json(self):
         return {"lookup": self.lookup.to_json(), "users": self.users.to_json()}
 
     def get_watchlist(self, user_id: int) -> Optional[list[str]]:
-        if not self.__active:
-            return
-
-        if self.stale:
+        if not self.active:
             return
 
         user_id = str(user_id)
@@ -334,10 +348,7 @@ class UserConfigFile:
         return user.get_watchlist()
 
     def get_monitor_list(self, user_id: int) -> Optional[MonitorList]:
-        if not self.__active:
-            return
-
-        if self.stale:
+        if not self.active:
             return
 
         user_id = str(user_id)
@@ -350,11 +361,11 @@ class UserConfigFile:
     def monitor(
         self, user_id: int, branch: str, field: Monitorable
     ) -> tuple[bool, str]:
-        if not self.__active:
+        if not self.active:
             return False, "File context not active"
 
-        if self.stale:
-            return False, "Stale config file"
+        if self.read_only:
+            return False, "Read-only file context"
 
         if not self.lookup.has_branch(branch):
             return False, "Invalid branch"
@@ -371,6 +382,9 @@ class UserConfigFile:
 
         success = user.add_to_monitor(branch, field)
         if success:
+            self.dirty_users.add(user_id)
+            if self.index.built:
+                self.index.add(user_id, branch, field)
             message = "Success"
         else:
             message = "Error occurred adding branch and field to monitor list"
@@ -379,11 +393,11 @@ class UserConfigFile:
     def unmonitor(
         self, user_id: int, branch: str, field: Monitorable
     ) -> tuple[bool, str]:
-        if not self.__active:
+        if not self.active:
             return False, "File context not active"
 
-        if self.stale:
-            return False, "Stale config file"
+        if self.read_only:
+            return False, "Read-only file context"
 
         if not self.lookup.has_branch(branch):
             return False, "Invalid branch"
@@ -400,33 +414,34 @@ class UserConfigFile:
 
         success = user.remove_from_monitor(branch, field)
         if success:
+            self.dirty_users.add(user_id)
+            if self.index.built:
+                self.index.remove(user_id, branch, field)
             message = "Success"
         else:
             message = "Error occurred removing branch and fieldfrom monitor list"
         return success, message
 
     def is_monitoring(self, user_id: int, branch: str, field: Monitorable) -> bool:
-        if not self.__active:
+        if not self.active:
             return False, "File context not active"
 
-        if self.stale:
-            return False, "Stale config file"
-
         if not self.lookup.has_branch(branch):
             return False, "Invalid branch"
 
         user_id = str(user_id)
-        user = self.users.get_or_add_user(user_id)
+        user = self.users.get_user(user_id)
+        if not user:
+            return False
 
-        monitor_list = user.get_monitor_list()
-        return monitor_list.is_monitoring_field(branch, field)
+        return user.is_monitoring(branch, field)
 
     def subscribe(self, user_id: int, branch: str) -> tuple[bool, str]:
-        if not self.__active:
+        if not self.active:
             return False, "File context not active"
 
-        if self.stale:
-            return False, "Stale config file"
+        if self.read_only:
+            return False, "Read-only file context"
 
         if not self.lookup.has_branch(branch):
             return False, "Invalid branch"
@@ -439,6 +454,9 @@ class UserConfigFile:
 
         success = user.add_to_watchlist(branch)
         lookup_success = self.lookup.add_subscriber_to_branch(user_id, branch)
+        self.dirty_users.add(user_id)
+        if lookup_success:
+            self.mark_subscription(user_id, branch, True)
 
         if success and lookup_success:
             message = "Success"
@@ -451,11 +469,11 @@ class UserConfigFile:
         return success, message
 
     def unsubscribe(self, user_id: int, branch: str) -> tuple[bool, str]:
-        if not self.__active:
+        if not self.active:
             return False, "File context not active"
 
-        if self.stale:
-            return False, "Stale config file"
+        if self.read_only:
+            return False, "Read-only file context"
 
         if not self.lookup.has_branch(branch):
             return False, "Invalid branch"
@@ -471,6 +489,9 @@ class UserConfigFile:
 
         success = user.remove_from_watchlist(branch)
         lookup_success = self.lookup.remove_subscriber_from_branch(user_id, branch)
+        self.dirty_users.add(user_id)
+        if lookup_success:
+            self.mark_subscription(user_id, branch, False)
 
         if success and lookup_success:
             message = "Success"
@@ -483,6 +504,116 @@ class UserConfigFile:
         return success, message
 
 
+class UserConfigFile:
+    """
+    Shared access to the user config.
+
+    The tables are loaded from storage once and kept in memory for every instance. `async with` gives a writable
+    context, serialized by a lock, that only persists what changed. `async with read()` gives a read-only context that
+    never writes anything. It takes the same lock, so readers never see changes a writer hasn't saved yet.
+    """
+
+    CONFIG = CacheConfig()
+
+    # shared by every UserConfigFile instance so all of them see the same incremental updates
+    INDEX = MonitorIndex()
+
+    __tables: Optional[tuple[UserTable, LookupTable]] = None
+    __lock = asyncio.Lock()
+
+    def __init__(self):
+        self.storage = get_storage()
+
+    def __get_tables(self) -> tuple[UserTable, LookupTable]:
+        if UserConfigFile.__tables is None:
+            data = self.storage.load_users()
+            UserConfigFile.__tables = (
+                UserTable(data["users"]),
+                LookupTable(data["lookup"]),
+            )
+
+        return UserConfigFile.__tables
+
+    def __discard_tables(self):
+        """Forgets the in-memory tables, so the next context reloads them from storage."""
+        UserConfigFile.__tables = None
+        self.INDEX.built = False
+
+    @asynccontextmanager
+    async def read(self):
+        async with UserConfigFile.__lock:
+            users, lookup = self.__get_tables()
+            context = UserConfigContext(users, lookup, self.INDEX, read_only=True)
+            try:
+                yield context
+            finally:
+                context.active = False
+
+    async def __aenter__(self) -> UserConfigContext:
+        await UserConfigFile.__lock.acquire()
+        try:
+            users, lookup = self.__get_tables()
+        except:
+            UserConfigFile.__lock.release()
+            raise
+
+        self.__context = UserConfigContext(users, lookup, self.INDEX, read_only=False)
+        return self.__context
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        context = self.__context
+        context.active = False
+        try:
+            if exc_type is not None:
+                logger.error(
+                    f"Exception of type {exc_type.__name__} occurred within UserConfigFile context: {exc_value}",
+                    exc_info=True,
+                )
+                # changes made in this context are thrown away, so the tables can't be trusted anymore
+                if context.dirty:
+                    self.__discard_tables()
+                return
+
+            if context.dirty:
+                await self.__save_changes(context)
+        finally:
+            UserConfigFile.__lock.release()
+
+    async def __save_changes(self, context: UserConfigContext):
+        """Writes the users and subscriptions that changed within `context` to storage."""
+        users = {}
+        for user_id in context.dirty_users:
+            user = context.users.get_user(user_id)
+            if user is not None:
+                users[user_id] = copy.deepcopy(user.to_json())
+
+        subscriptions = [
+            (branch, user_id, subscribed)
+            for (branch, user_id), subscribed in context.subscription_changes.items()
+        ]
+
+        try:
+            await asyncio.to_thread(self.storage.save_users, users, [], subscriptions)
+        except Exception:
+            logger.error("Failed to save user config changes", exc_info=True)
+            self.__discard_tables()
+            raise
+
+    # INDEX
+
+    def get_index(self) -> MonitorIndex:
+        """Returns the monitor index, building it from the in-memory tables first if needed. Never writes anything."""
+        if not self.INDEX.built:
+            users, _ = self.__get_tables()
+            self.INDEX.build(users.to_json())
+
+        return self.INDEX
+
+    def get_monitor_watchers(self, branch: str, field: Monitorable) -> list[str]:
+        """Returns the IDs of every user monitoring `field` on `branch`. Doesn't need an active context."""
+        return list(self.get_index().get_watchers(branch, field))
+
+
 class ConfigFileEncoder(json.JSONEncoder):
     def default(self, obj):
         if obj.to_json:
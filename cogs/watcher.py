@@ -2,6 +2,7 @@
 
 import time
 import httpx
+import asyncio
 import secrets
 import discord
 import logging
@@ -12,7 +13,17 @@ from discord.ext import commands, pages, tasks
 from cogs.bot import Algalon
 from cogs.user_config import UserConfigFile
 from cogs.guild_config import GuildCFG
-from cogs.cdn_cache import CDNCache
+from cogs.cdn_cache import CDNCache, BuildUpdate
+from cogs.channels import ChannelResolver
+from cogs.outbox import OutboxJob, get_outbox, KIND_GUILD_EMBED, KIND_USER_BUILD_DM
+from cogs.single_flight import SingleFlight
+from cogs.delivery import (
+    Delivery,
+    DeliveryScheduler,
+    RateLimiter,
+    PRIORITY_ANNOUNCEMENT,
+    PRIORITY_DEFAULT,
+)
 from cogs.config import CommonStrings
 from cogs.config import LiveConfig as livecfg
 from cogs.config import WatcherConfig as cfg
@@ -34,6 +45,32 @@ ANNOUNCEMENT_CHANNELS = livecfg.get_cfg_value("discord", "announcement_channels"
 DELETE_AFTER = livecfg.get_cfg_value("discord", "delete_msgs_after", 120)
 COOLDOWN = livecfg.get_cfg_value("discord", "cmd_cooldown", 15)
 
+DELIVERY_CONCURRENCY = livecfg.get_cfg_value("discord", "delivery_concurrency", 16)
+DELIVERY_RATE = livecfg.get_cfg_value("discord", "delivery_rate_per_second", 40)
+
+DM_MAX_LENGTH = 2000
+
+OUTBOX_INTERVAL = livecfg.get_cfg_value("discord", "outbox_interval", 30)  # seconds
+OUTBOX_BATCH_SIZE = 200
+OUTBOX_RETENTION = 60 * 60 * 24 * 7  # seconds
+
+REFRESH_KEY = "refresh"
+
+# teardown tasks started by cogs unloaded during a reload, which would otherwise have nothing referencing them
+CLOSE_TASKS: set[asyncio.Task] = set()
+
+
+class EmbedCache:
+    """Holds everything shared between guilds while rendering a single update cycle's embeds."""
+
+    def __init__(self, product_config: dict, version: str):
+        self.product_config = product_config
+        self.version = version
+        self.description = (
+            f"{get_discord_timestamp()} **|** {get_discord_timestamp(relative=True)}"
+        )
+        self.embeds: dict[tuple[str, frozenset[str]], discord.Embed] = {}
+
 
 class CDNCog(commands.Cog):
     """This is the actual Cog that gets added to the Discord bot."""
@@ -45,6 +82,14 @@ class CDNCog(commands.Cog):
         self.user_cfg = UserConfigFile()
         self.live_cfg = livecfg()
         self.socials = SocialPlatforms()
+        self.delivery = DeliveryScheduler(DELIVERY_CONCURRENCY, DELIVERY_RATE)
+        self.channels = ChannelResolver()
+        self.outbox = get_outbox()
+        self.__outbox_lock = asyncio.Lock()
+        self.__refresh_flights = SingleFlight()
+        # first_run and force of the refresh cycle in flight
+        self.__refresh_options = (False, False)
+        self.generation = 0  # number of refresh cycles started so far
         self.last_update = 0
         self.last_update_formatted = ""
 
@@ -52,9 +97,35 @@ class CDNCog(commands.Cog):
             logger.info("<- Starting bot in DEBUG mode ->")
 
         if START_LOOPS:
+            # each branch has its own polling interval, so the loop only needs to tick as often as the shortest one
+            self.cdn_auto_refresh.change_interval(
+                seconds=self.cdn_cache.scheduler.min_interval
+            )
             self.cdn_auto_refresh.add_exception_type(httpx.ConnectTimeout)
             self.cdn_auto_refresh.start()
             self.integrity_check.start()
+            self.outbox_worker.start()
+
+    def __stop_loops(self):
+        self.cdn_auto_refresh.cancel()
+        self.integrity_check.cancel()
+        self.outbox_worker.cancel()
+
+    async def shutdown(self):
+        """Stops the loops and closes the CDN cache, flushing its state. The bot awaits this before it closes."""
+        self.__stop_loops()
+        await self.cdn_cache.close()
+
+    def cog_unload(self):
+        self.__stop_loops()
+        if self.cdn_cache.closed:
+            return
+
+        # only reached when the extension is reloaded, which keeps the event loop running so the close can finish
+        # in the background. The loop only keeps a weak reference to tasks, so hold on to this one until it's done
+        task = asyncio.create_task(self.cdn_cache.close())
+        CLOSE_TASKS.add(task)
+        task.add_done_callback(CLOSE_TASKS.discard)
 
     @staticmethod
     def user_is_admin_or_owner(ctx: discord.ApplicationContext):
@@ -97,6 +168,9 @@ class CDNCog(commands.Cog):
 
         logger.info("Cache configuration check complete")
 
+        self.outbox.prune(OUTBOX_RETENTION)
+        self.cdn_cache.history.compact()
+
     def get_command_link(
         self, command: str, cmd_group: Optional[discord.SlashCommandGroup] = None
     ):
@@ -127,107 +201,147 @@ class CDNCog(commands.Cog):
 
         await channel.send(message)
 
-    def build_embeds(self, data: dict, guild_id: int):
-        """This builds notification embeds with the given data."""
+    def new_embed_cache(self) -> EmbedCache:
+        product_config = self.live_cfg.get_all_products()
+        algalon_version = self.live_cfg.get_cfg_value("meta", "version", "Dev")
+        return EmbedCache(product_config, algalon_version)
 
-        guild_watchlist = self.guild_cfg.get_guild_watchlist(guild_id)
+    def render_embed(
+        self,
+        game: str,
+        update_data: list[BuildUpdate],
+        branches: frozenset[str],
+        cache: EmbedCache,
+    ) -> discord.Embed:
+        """Renders the update embed for `game`, listing only the updates for `branches`."""
+        product_config = cache.product_config
+
+        config = cfg.strings.EMBED_GAME_CONFIG[game]
+        color = config["color"]
+
+        embed = discord.Embed(
+            color=color,
+            title=config["title"],
+            description=cache.description,
+            url=config["url"],
+        )
 
-        product_config = self.live_cfg.get_all_products()
+        embed.set_author(
+            name=config["name"],
+            icon_url=config["icon_url"],
+        )
 
-        all_embeds = []
+        embed.set_footer(text=CommonStrings.EMBED_FOOTER.format(version=cache.version))
 
-        for game, update_data in data.items():
-            target_channel = self.guild_cfg.get_notification_channel(guild_id, game)
+        value_string = ""
 
-            if not target_channel or target_channel == 0:
-                logger.warning(
-                    f"Guild {guild_id} has not chosen a notification channel, skipping..."
-                )
+        for update in update_data:
+            branch = update.branch
+            if branch not in branches:
                 continue
 
-            config = cfg.strings.EMBED_GAME_CONFIG[game]
-            color = config["color"]
+            logger.debug(f"Building embed for {branch}")
 
-            embed = discord.Embed(
-                color=color,
-                title=config["title"],
-                description=f"{get_discord_timestamp()} **|** {get_discord_timestamp(relative=True)}",
-                url=config["url"],
-            )
+            if update.old is not None:
+                build_text_old = update.old.build_text
+                build_old = update.old.build
+            else:
+                build_text_old = cfg.cache_defaults.BUILDTEXT
+                build_old = cfg.cache_defaults.BUILD
 
-            embed.set_author(
-                name=config["name"],
-                icon_url=config["icon_url"],
-            )
+            build_text = update.new.build_text
+            build = update.new.build
+
+            public_name = product_config[branch]["public_name"]
 
-            algalon_version = self.live_cfg.get_cfg_value("meta", "version", "Dev")
-            embed.set_footer(
-                text=CommonStrings.EMBED_FOOTER.format(version=algalon_version)
+            build_text = (
+                f"**{build_text}**" if build_text != build_text_old else build_text
             )
+            build = f"**{build}**" if build != build_old else build
+
+            branch_is_encrypted = self.cdn_cache.is_encrypted(branch)
+            encrypted = ":lock:" if branch_is_encrypted else ""
+
+            value_string += f"`{public_name} ({branch})`{encrypted}: {build_text_old}.{build_old} --> {build_text}.{build}"
+
+            # hack to add diff links
+            if (
+                not branch_is_encrypted
+                and game == SUPPORTED_GAMES.Warcraft
+                and update.old is not None
+            ):
+                url = cfg.strings.EMBED_WAGOTOOLS_DIFF_URL
+                old_build = f"{update.old.build_text}.{update.old.build}"
+                new_build = f"{update.new.build_text}.{update.new.build}"
+                value_string += (
+                    f" | [Diffs]({url.format(old=old_build, new=new_build)})"
+                )
 
-            value_string = ""
+            value_string += "\n"
 
-            for ver in update_data:
-                branch = ver["branch"]
-                logger.debug(f"Building embed for {branch}")
+        embed.add_field(
+            name=cfg.strings.EMBED_UPDATE_TITLE, value=value_string, inline=False
+        )
 
-                if branch not in guild_watchlist:
-                    continue
+        return embed
 
-                if "old" in ver:
-                    build_text_old = ver["old"][cfg.indices.BUILDTEXT]
-                    build_old = ver["old"][cfg.indices.BUILD]
-                else:
-                    build_text_old = cfg.cache_defaults.BUILDTEXT
-                    build_old = cfg.cache_defaults.BUILD
+    def build_embeds(
+        self, data: dict, guild_id: int, cache: Optional[EmbedCache] = None
+    ):
+        """This builds notification embeds with the given data."""
 
-                build_text = ver[cfg.indices.BUILDTEXT]
-                build = ver[cfg.indices.BUILD]
+        if cache is None:
+            cache = self.new_embed_cache()
 
-                public_name = product_config[branch]["public_name"]
+        # guilds without a config yet, like the debug guild, get the default one
+        self.guild_cfg.ensure_indexed(guild_id)
+        guild_index = self.guild_cfg.get_index()
+        guild_id = str(guild_id)
+        guild_watchlist = guild_index.get_watchlist(guild_id)
 
-                build_text = (
-                    f"**{build_text}**" if build_text != build_text_old else build_text
-                )
-                build = f"**{build}**" if build != build_old else build
-
-                branch_is_encrypted = product_config[branch]["encrypted"]
-                encrypted = ":lock:" if branch_is_encrypted else ""
-
-                value_string += f"`{public_name} ({branch})`{encrypted}: {build_text_old}.{build_old} --> {build_text}.{build}"
-
-                # hack to add diff links
-                if (
-                    not branch_is_encrypted
-                    and game == SUPPORTED_GAMES.Warcraft
-                    and "old" in ver
-                ):
-                    url = cfg.strings.EMBED_WAGOTOOLS_DIFF_URL
-                    old_build = f"{ver["old"][cfg.indices.BUILDTEXT]}.{ver["old"][cfg.indices.BUILD]}"
-                    new_build = f"{ver[cfg.indices.BUILDTEXT]}.{ver[cfg.indices.BUILD]}"
-                    value_string += (
-                        f" | [Diffs]({url.format(old=old_build, new=new_build)})"
-                    )
+        all_embeds = []
 
-                value_string += "\n"
+        for game, update_data in data.items():
+            target_channel = guild_index.get_channel(guild_id, game)
 
-            if value_string == "":
+            if not target_channel or target_channel == 0:
+                logger.warning(
+                    f"Guild {guild_id} has not chosen a notification channel, skipping..."
+                )
                 continue
 
-            embed.add_field(
-                name=cfg.strings.EMBED_UPDATE_TITLE, value=value_string, inline=False
+            branches = frozenset(
+                update.branch
+                for update in update_data
+                if update.branch in guild_watchlist
             )
+            if not branches:
+                continue
 
-            all_embeds.append({"embed": embed, "target": target_channel, "game": game})
+            # guilds watching the same updated branches get the same embed
+            signature = (game, branches)
+            embed = cache.embeds.get(signature)
+            if embed is None:
+                embed = self.render_embed(game, update_data, branches, cache)
+                cache.embeds[signature] = embed
+
+            all_embeds.append(
+                {
+                    "embed": embed,
+                    "target": target_channel,
+                    "game": game,
+                    "branches": branches,
+                }
+            )
 
         return all_embeds
 
-    def preprocess_update_data(self, data: list):
+    def preprocess_update_data(self, data: list[BuildUpdate]):
         embed_data = {}
-        for branch in data:
-            game = cfg.get_game_from_branch(branch["branch"])
+        for update in data:
+            game = cfg.get_game_from_branch(update.branch)
             if not game:
-                logger.warning(f"Game could not be determined for {branch['branch']}")
+                logger.warning(f"Game could not be determined for {update.branch}")
                 continue
 
             game = game.value
@@ -237,56 +351,300 @@ class CDNCog(commands.Cog):
                 embed_data[game] = []
 
             logger.debug("Adding branch data to game entry")
-            embed_data[game].append(branch)
+            embed_data[game].append(update)
 
         return embed_data
 
-    async def distribute_direct_messages(self, data: dict, owner_only: bool = False):
-        with self.user_cfg as config:
+    async def build_direct_messages(
+        self, data: dict
+    ) -> dict[int, list[tuple[str, str]]]:
+        """
+        Snapshots the DM subscribers for every updated branch, returning the update lines to send each user.
+
+        Every line comes with the `branch:seqn` of the build it announces.
+        """
+        lines_by_user: dict[int, list[tuple[str, str]]] = {}
+
+        async with self.user_cfg.read() as config:
             for game, updates in data.items():
                 for update in updates:
-                    branch = update["branch"]
+                    branch = update.branch
                     subscribers = config.lookup.get_subscribers_for_branch(branch, True)
                     if subscribers is None or len(subscribers) == 0:
                         continue
 
-                    new_build_text = update["build_text"]
-                    if new_build_text != update["old"]["build_text"]:
+                    new, old = update.new, update.old
+
+                    new_build_text = new.build_text
+                    if old is None or new_build_text != old.build_text:
                         new_build_text = f"**{new_build_text}**"
 
-                    new_build_id = update["build"]
-                    if new_build_id != update["old"]["build"]:
+                    new_build_id = new.build
+                    if old is None or new_build_id != old.build:
                         new_build_id = f"**{new_build_id}**"
 
                     message = f"{SUPPORTED_GAMES._value2member_map_[game].name} build: `{branch}` -> {new_build_text}.{new_build_id}"
                     # more hacks for diff links
-                    if game == SUPPORTED_GAMES.Warcraft and "old" in update:
-                        product_config = self.live_cfg.get_all_products()
-                        encrypted = product_config[branch]["encrypted"]
-                        if not encrypted:
+                    if game == SUPPORTED_GAMES.Warcraft and old is not None:
+                        if not self.cdn_cache.is_encrypted(branch):
                             url = cfg.strings.EMBED_WAGOTOOLS_DIFF_URL
-                            old_build = f"{update["old"]["build_text"]}.{update["old"]["build"]}"
-                            new_build = f"{update["build_text"]}.{update["build"]}"
+                            old_build = f"{old.build_text}.{old.build}"
+                            new_build = f"{new.build_text}.{new.build}"
                             message += f" | [Diffs](<{url.format(old=old_build, new=new_build)}>)"
 
+                    build = f"{branch}:{new.seqn}"
                     for subscriber in subscribers:
-                        user = await self.bot.get_or_fetch_user(subscriber)
-                        is_owner = await self.bot.is_owner(user)
-                        if owner_only and not is_owner:
-                            continue
+                        lines_by_user.setdefault(subscriber, []).append(
+                            (build, message)
+                        )
+
+        return lines_by_user
+
+    @staticmethod
+    def combine_lines(lines: list[str]) -> list[str]:
+        """Joins lines into as few messages as possible without going over Discord's message length limit."""
+        messages = []
+        message = ""
+        for line in lines:
+            if message and len(message) + len(line) + 1 > DM_MAX_LENGTH:
+                messages.append(message)
+                message = ""
+
+            message = f"{message}\n{line}" if message else line
+
+        if message:
+            messages.append(message)
+
+        return messages
+
+    async def send_direct_message(
+        self,
+        user_id: int,
+        messages: list[str],
+        limiter: RateLimiter,
+        owner_only: bool = False,
+    ) -> bool:
+        user = self.bot.get_user(user_id)
+        if user is None:
+            await limiter.acquire()
+            user = await self.bot.fetch_user(user_id)
+
+        if owner_only and not await self.bot.is_owner(user):
+            return False
+
+        channel = await self.channels.resolve_dm(user, limiter)
+        try:
+            for message in messages:
+                await limiter.acquire()
+                await channel.send(message)
+        except discord.NotFound:
+            # the DM channel went away, open a new one next time
+            self.channels.forget_dm(user_id)
+            raise
+
+        return True
+
+    async def build_direct_message_jobs(self, data: dict) -> list[OutboxJob]:
+        """Queues one DM per subscriber, listing all of this cycle's updates to the branches they're subscribed to."""
+        jobs = []
+        for user_id, entries in (await self.build_direct_messages(data)).items():
+            builds = sorted(build for build, _ in entries)
+            # the same builds going to the same user should only ever be sent once
+            key = OutboxJob.make_key(KIND_USER_BUILD_DM, user_id, *builds)
+            messages = self.combine_lines([line for _, line in entries])
+            jobs.append(
+                OutboxJob(
+                    key, KIND_USER_BUILD_DM, int(user_id), 0, {"messages": messages}
+                )
+            )
+
+        return jobs
+
+    async def distribute_direct_messages(self, data: dict, owner_only: bool = False):
+        """Sends every subscriber one DM listing all of this cycle's updates right away. Only used for debug posts."""
+        entries_by_user = await self.build_direct_messages(data)
+        lines_by_user = {
+            user_id: [line for _, line in entries]
+            for user_id, entries in entries_by_user.items()
+        }
+        if not lines_by_user:
+            return
+
+        logger.info(f"Sending build update DMs to {len(lines_by_user)} user(s)...")
+        semaphore = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+        limiter = self.delivery.limiter
+        sent = 0
+
+        async def send(user_id: int, lines: list[str]):
+            nonlocal sent
+            async with semaphore:
+                try:
+                    messages = self.combine_lines(lines)
+                    if await self.send_direct_message(
+                        user_id, messages, limiter, owner_only
+                    ):
+                        sent += 1
+                except:
+                    logger.error(
+                        f"Encountered an error when sending DM to {user_id}",
+                        exc_info=True,
+                    )
+
+        await asyncio.gather(
+            *[send(user_id, lines) for user_id, lines in lines_by_user.items()]
+        )
+        logger.info(f"Sent build update DMs to {sent}/{len(lines_by_user)} user(s)")
 
-                        try:
-                            channel = await user.create_dm()
-                            await channel.send(message)
-                        except:
-                            logger.error(
-                                f"Encountered an error when sending DM to {user.id}",
-                                exc_info=True,
-                            )
+    async def deliver_embed(self, delivery: Delivery, limiter: RateLimiter) -> bool:
+        """Posts a single update embed to its target channel, publishing it if it's an announcement channel."""
+        guild = delivery.guild
+        channel = await self.channels.resolve(guild, delivery.channel_id, limiter)
+        if channel is None:
+            return False
+
+        logger.info("Sending CDN update post and tweet...")
+        try:
+            await limiter.acquire()
+            message = await channel.send(embed=delivery.embed)  # type: ignore
+        except discord.NotFound:
+            logger.warning(f"Chosen channel not found for guild {guild}")
+            self.channels.mark_unavailable(guild.id, delivery.channel_id)
+            return False
+        except discord.Forbidden:
+            logger.warning(f"No permission to post to chosen channel for guild {guild}")
+            self.channels.mark_unavailable(guild.id, delivery.channel_id)
+            return False
+
+        # the post is out, so anything failing past this point must not cause the job to be retried
+        if channel.id in ANNOUNCEMENT_CHANNELS.values():
+            try:
+                await limiter.acquire()
+                await message.publish()
+            except discord.HTTPException:
+                logger.error(
+                    f"Failed to publish CDN update post in {channel.id}", exc_info=True
+                )
+
+        if channel.id == ANNOUNCEMENT_CHANNELS["wow"]:
+            try:
+                await self.socials.distribute_posts(
+                    delivery.embed.to_dict(), delivery.token
+                )
+            except:
+                logger.error(
+                    "Encountered an error while distributing social media posts"
+                )
+
+        return True
+
+    def get_delivery_for_job(self, job: OutboxJob) -> Optional[Delivery]:
+        guild = self.bot.get_guild(job.target_id)
+        if guild is None:
+            return None
+
+        return Delivery(
+            guild,
+            job.channel_id,
+            discord.Embed.from_dict(job.payload["embed"]),
+            job.payload["game"],
+            job.priority,
+            job.key,
+            job.payload["token"],
+        )
 
-    async def distribute_embeds(self, first_run: bool = False):
+    async def process_outbox(self):
+        """Delivers every due build update DM and update post in the outbox, recording the outcome of each one."""
+        async with self.__outbox_lock:
+            await self.__process_direct_messages()
+            await self.__process_embeds()
+
+    async def __process_direct_messages(self):
+        limiter = self.delivery.limiter
+        while True:
+            jobs = self.outbox.get_due(KIND_USER_BUILD_DM, OUTBOX_BATCH_SIZE)
+            if not jobs:
+                return
+
+            logger.info(f"Sending build update DMs to {len(jobs)} user(s)...")
+            semaphore = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+            delivered, failed, retry = [], [], []
+
+            async def send(job: OutboxJob):
+                async with semaphore:
+                    try:
+                        success = await self.send_direct_message(
+                            job.target_id, job.payload["messages"], limiter
+                        )
+                    except (discord.NotFound, discord.Forbidden):
+                        logger.warning(
+                            f"Unable to send build update DM to {job.target_id}"
+                        )
+                        failed.append(job.key)
+                        return
+                    except Exception:
+                        logger.error(
+                            f"Encountered an error when sending DM to {job.target_id}",
+                            exc_info=True,
+                        )
+                        retry.append(job)
+                        return
+
+                    (delivered if success else failed).append(job.key)
+
+            await asyncio.gather(*[send(job) for job in jobs])
+            self.outbox.record(delivered, failed, retry)
+            logger.info(
+                f"Sent build update DMs to {len(delivered)}/{len(jobs)} user(s), {len(retry)} queued for retry"
+            )
+
+            if len(jobs) < OUTBOX_BATCH_SIZE:
+                return
+
+    async def __process_embeds(self):
+        while True:
+            jobs = self.outbox.get_due(KIND_GUILD_EMBED, OUTBOX_BATCH_SIZE)
+            if not jobs:
+                return
+
+            deliveries = []
+            gone = []
+            for job in jobs:
+                delivery = self.get_delivery_for_job(job)
+                if delivery is None:
+                    logger.warning(
+                        f"Guild {job.target_id} is unavailable, dropping queued CDN update post"
+                    )
+                    gone.append(job.key)
+                else:
+                    deliveries.append(delivery)
+
+            logger.info(f"Delivering {len(deliveries)} CDN update post(s)...")
+            report = await self.delivery.run(deliveries, self.deliver_embed)
+
+            errored = set(report.errored_keys)
+            retry = [job for job in jobs if job.key in errored]
+            self.outbox.record(report.sent_keys, report.failed_keys + gone, retry)
+
+            logger.info(f"CDN update delivery complete: {report}")
+            logger.debug(
+                f"Channel resolver: {self.channels.hits} cache hit(s), {self.channels.fetches} REST fetch(es) in total"
+            )
+
+            if len(jobs) < OUTBOX_BATCH_SIZE:
+                return
+
+    async def commit_updates(self, new_data: list[BuildUpdate]):
+        """Queues the field change digests, then marks the cycle's builds seen and writes them to storage."""
+        monitor = self.bot.get_cog("MonitorCog")
+        if monitor is not None:
+            monitor.queue_digests()
+
+        self.cdn_cache.commit_updates(new_data)
+        await self.cdn_cache.flush()
+
+    async def distribute_embeds(self, first_run: bool = False, force: bool = False):
         """This handles distributing the generated embeds to the various servers that should receive them."""
-        new_data = await self.cdn_cache.fetch_cdn()
+        new_data = await self.cdn_cache.fetch_cdn(force)
 
         token = secrets.token_urlsafe()
 
@@ -302,11 +660,21 @@ class CDNCog(commands.Cog):
             logger.info("New CDN version(s) found! Creating posts...")
 
             embed_data = self.preprocess_update_data(new_data)
-            await self.distribute_direct_messages(embed_data)
+            jobs = await self.build_direct_message_jobs(embed_data)
+
+            updated_branches = [update.branch for update in new_data]
+            guild_ids = self.guild_cfg.get_guilds_watching(updated_branches)
+            logger.info(f"{len(guild_ids)} guild(s) are watching the updated branches")
+
+            seqns = {update.branch: update.new.seqn for update in new_data}
+            embed_cache = self.new_embed_cache()
+            for guild_id in guild_ids:
+                guild = self.bot.get_guild(int(guild_id))
+                if guild is None:
+                    continue
 
-            for guild in self.bot.guilds:
                 try:
-                    embeds = self.build_embeds(embed_data, guild.id)
+                    embeds = self.build_embeds(embed_data, guild.id, embed_cache)
                 except Exception as exc:
                     logger.error(
                         f"Error distributing embed(s) for guild {guild.id}.",
@@ -323,55 +691,46 @@ class CDNCog(commands.Cog):
                     )
                     continue
 
+                announcement_channels = (ANNOUNCEMENT_CHANNELS or {}).values()
                 for embed in embeds:
-                    try:
-                        channel = await guild.fetch_channel(embed["target"])
-                    except discord.NotFound:
-                        logger.warning(f"Chosen channel not found for guild {guild}")
-                        continue
-                    except discord.Forbidden:
-                        logger.warning(
-                            f"No permission to access chosen channel for guild {guild}"
+                    priority = (
+                        PRIORITY_ANNOUNCEMENT
+                        if embed["target"] in announcement_channels
+                        else PRIORITY_DEFAULT
+                    )
+                    # the same builds going to the same channel should only ever be posted once
+                    builds = sorted(
+                        f"{branch}:{seqns[branch]}" for branch in embed["branches"]
+                    )
+                    key = OutboxJob.make_key(embed["game"], embed["target"], *builds)
+                    payload = {
+                        "embed": embed["embed"].to_dict(),
+                        "game": embed["game"],
+                        "token": token,
+                    }
+                    jobs.append(
+                        OutboxJob(
+                            key,
+                            KIND_GUILD_EMBED,
+                            guild.id,
+                            embed["target"],
+                            payload,
+                            priority,
                         )
-                        continue
+                    )
 
-                    actual_embed = embed["embed"]  # god save me
+            queued = self.outbox.enqueue(jobs)
+            logger.info(f"Queued {queued} build update DM(s) and CDN update post(s)")
 
-                    if actual_embed and channel:
-                        logger.info("Sending CDN update post and tweet...")
-                        try:
-                            message = await channel.send(embed=actual_embed)  # type: ignore
-                        except discord.NotFound:
-                            logger.warning(
-                                f"Chosen channel not found for guild {guild}"
-                            )
-                            continue
-                        except discord.Forbidden:
-                            logger.warning(
-                                f"No permission to post to chosen channel for guild {guild}"
-                            )
-                            continue
+            # the builds only count as seen once everything announcing them is safely queued, a failure or crash
+            # before this point detects them again on the next cycle, and the job keys keep them from being sent twice
+            await self.commit_updates(new_data)
 
-                        if channel.id == ANNOUNCEMENT_CHANNELS["wow"]:
-                            await message.publish()
-                            try:
-                                await self.socials.distribute_posts(
-                                    actual_embed.to_dict(), token
-                                )
-                            except:
-                                logger.error(
-                                    "Encountered an error while distributing social media posts"
-                                )
-                        elif channel.id in ANNOUNCEMENT_CHANNELS.values():
-                            await message.publish()
-                    elif actual_embed and not channel:
-                        logger.warning(f"No channel found for guild {guild}, aborting.")
-                        continue
-                    elif not embed:
-                        logger.warning(f"No embed built for guild {guild}, aborting.")
-                        continue
+            await self.process_outbox()
             return True
         else:
+            await self.commit_updates(new_data)
+
             if new_data:
                 if dbg.debug_enabled or first_run:
                     # Debug notifcations, as well as absorbing the first update check if cache is outdated.
@@ -429,7 +788,7 @@ class CDNCog(commands.Cog):
                 )
                 continue
 
-            encrypted = self.live_cfg.get_product_encryption_state(product.name)
+            encrypted = self.cdn_cache.is_encrypted(product.name)
             lock = ":lock:" if encrypted else ""
 
             embed = discord.Embed(
@@ -459,23 +818,65 @@ class CDNCog(commands.Cog):
 
         return paginator
 
-    @tasks.loop(minutes=FETCH_INTERVAL, reconnect=True)
-    async def cdn_auto_refresh(self):
-        """Forever problematic loop that handles auto-checking for CDN updates."""
+    @tasks.loop(seconds=OUTBOX_INTERVAL)
+    async def outbox_worker(self):
+        """Retries failed update posts, and picks up posts left pending by a restart."""
         await self.bot.wait_until_ready()
 
         try:
-            await self.distribute_embeds(self.cdn_auto_refresh.current_loop == 0)
+            await self.process_outbox()
+        except Exception:
+            logger.error("Error occurred when processing the outbox", exc_info=True)
+
+    def is_refreshing(self) -> bool:
+        return self.__refresh_flights.in_flight(REFRESH_KEY)
+
+    async def __refresh(self, first_run: bool, force: bool) -> int:
+        self.generation += 1
+        generation = self.generation
+        logger.debug(f"Starting refresh cycle {generation}")
+
+        try:
+            await self.distribute_embeds(first_run, force)
             monitor = self.bot.get_cog("MonitorCog")
             await monitor.distribute_notifications()
         except Exception as exc:
             logger.critical("Error occurred when distributing embeds", exc_info=True)
 
             await self.notify_owner_of_exception(exc)
-            return
+            return generation
 
         self.last_update = time.time()
         self.last_update_formatted = get_discord_timestamp(relative=True)
+        return generation
+
+    async def refresh(self, first_run: bool = False, force: bool = False) -> int:
+        """
+        Runs a refresh cycle and returns its generation number.
+
+        Cycles never overlap, so two of them never fetch or post the same build. If a cycle with the same options is
+        already running, this waits for that one instead of starting another. If the running cycle's options differ,
+        e.g. this call forces a fetch and it doesn't, this waits for it to finish and then runs its own.
+        """
+        options = (first_run, force)
+        while self.is_refreshing() and self.__refresh_options != options:
+            # joins the running cycle, whose result isn't ours to return
+            await self.__refresh_flights.do(
+                REFRESH_KEY, self.__refresh, first_run, force
+            )
+
+        if not self.is_refreshing():
+            self.__refresh_options = options
+
+        return await self.__refresh_flights.do(
+            REFRESH_KEY, self.__refresh, first_run, force
+        )
+
+    @tasks.loop(minutes=FETCH_INTERVAL, reconnect=True)
+    async def cdn_auto_refresh(self):
+        """Forever problematic loop that handles auto-checking for CDN updates."""
+        await self.bot.wait_until_ready()
+        await self.refresh(self.cdn_auto_refresh.current_loop == 0)
 
     # DISCORD LISTENERS
 
@@ -513,6 +914,27 @@ class CDNCog(commands.Cog):
 
         await ctx.respond(message, ephemeral=True, delete_after=delete_after)
 
+    @commands.Cog.listener(name="on_guild_channel_create")
+    @commands.Cog.listener(name="on_guild_channel_delete")
+    async def handle_channel_change(self, channel: discord.abc.GuildChannel):
+        self.channels.invalidate_channel(channel.id)
+
+    @commands.Cog.listener(name="on_guild_channel_update")
+    async def handle_channel_update(
+        self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel
+    ):
+        # permission overwrites may have changed
+        self.channels.invalidate_channel(after.id)
+
+    @commands.Cog.listener(name="on_guild_role_update")
+    async def handle_role_update(self, before: discord.Role, after: discord.Role):
+        self.channels.invalidate_guild(after.guild.id)
+
+    @commands.Cog.listener(name="on_member_update")
+    async def handle_member_update(self, before: discord.Member, after: discord.Member):
+        if after.id == self.bot.user.id:  # type: ignore
+            self.channels.invalidate_guild(after.guild.id)
+
     @commands.Cog.listener(name="on_unknown_application_command")
     async def handle_unk_command(self, ctx: discord.ApplicationContext):
         message = "Unknown command. Please try again in a few minutes."
@@ -796,6 +1218,74 @@ Changes are saved when you click out of the menu.
             delete_after=DELETE_AFTER,
         )
 
+    @discord.slash_command(
+        name="history",
+        contexts={
+            discord.InteractionContextType.private_channel,
+            discord.InteractionContextType.guild,
+            discord.InteractionContextType.bot_dm,
+        },
+        integration_types={
+            discord.IntegrationType.guild_install,
+            discord.IntegrationType.user_install,
+        },
+    )
+    @commands.cooldown(1, COOLDOWN, commands.BucketType.user)
+    @discord.option(name="branch", input_type=str, description="Branch name")
+    async def cdn_history(self, ctx: discord.ApplicationContext, branch: str):
+        """Returns the most recent builds seen on a branch."""
+        branch = branch.lower().strip()
+        if not SUPPORTED_PRODUCTS.has_key(branch):
+            await ctx.respond(
+                self.cdn_cache.CONFIG.errors.BRANCH_NOT_VALID,
+                ephemeral=True,
+                delete_after=DELETE_AFTER,
+            )
+            return
+
+        entries = self.cdn_cache.history.get_branch_history(branch)
+        if not entries:
+            message = f"I haven't recorded any builds for `{branch}` yet."
+        else:
+            message = (
+                f"## Recent builds for `{branch}` ({SUPPORTED_PRODUCTS[branch]}):\n"
+            )
+            for entry in entries:
+                message += f"- `{entry.version_string}` {get_discord_timestamp(entry.detected_at)} ({get_discord_timestamp(entry.detected_at, relative=True)})\n"
+
+        await ctx.respond(message, ephemeral=True, delete_after=DELETE_AFTER)
+
+    @discord.slash_command(
+        name="when",
+        contexts={
+            discord.InteractionContextType.private_channel,
+            discord.InteractionContextType.guild,
+            discord.InteractionContextType.bot_dm,
+        },
+        integration_types={
+            discord.IntegrationType.guild_install,
+            discord.IntegrationType.user_install,
+        },
+    )
+    @commands.cooldown(1, COOLDOWN, commands.BucketType.user)
+    @discord.option(
+        name="build",
+        input_type=str,
+        description="Build number, e.g. 56421 or 11.0.2.56421",
+    )
+    async def cdn_when(self, ctx: discord.ApplicationContext, build: str):
+        """Returns when a build first showed up on each branch."""
+        build_text, _, build_id = build.strip().rpartition(".")
+        entries = self.cdn_cache.history.find_build(build_id, build_text or None)
+        if not entries:
+            message = f"I haven't seen build `{build}` on any branch."
+        else:
+            message = f"## Build `{build}` first seen on:\n"
+            for entry in entries:
+                message += f"- `{entry.branch}` as `{entry.version_string}` {get_discord_timestamp(entry.detected_at)} ({get_discord_timestamp(entry.detected_at, relative=True)})\n"
+
+        await ctx.respond(message, ephemeral=True, delete_after=DELETE_AFTER)
+
     dm_commands = discord.SlashCommandGroup(
         name="dm",
         description="DM notification commands",
@@ -823,7 +1313,8 @@ Changes are saved when you click out of the menu.
         message = ""
         user_id = ctx.author.id
         branch = branch.lower()
-        with self.user_cfg as config:
+        # the changes are saved when the context exits, respond after that so the lock isn't held across the reply
+        async with self.user_cfg as config:
             if DELIMITER in branch:  # batch adding
                 branches = branch.split(",")
                 message = "Successfully subscribed to the following branches:\n```diff"
@@ -835,9 +1326,6 @@ Changes are saved when you click out of the menu.
                         message += f"\n+ {_branch} added successfully."
 
                 message += "```"
-                await ctx.interaction.response.send_message(
-                    message, ephemeral=True, delete_after=DELETE_AFTER
-                )
             else:  # single adding
                 success, result = config.subscribe(user_id, branch)
                 if not success:
@@ -845,9 +1333,9 @@ Changes are saved when you click out of the menu.
                 else:
                     message = f"Successfully subscribed to branch `{branch}`!"
 
-                await ctx.interaction.response.send_message(
-                    message, ephemeral=True, delete_after=DELETE_AFTER
-                )
+        await ctx.interaction.response.send_message(
+            message, ephemeral=True, delete_after=DELETE_AFTER
+        )
 
     @dm_commands.command(
         name="unsubscribe",
@@ -862,7 +1350,7 @@ Changes are saved when you click out of the menu.
         message = ""
         user_id = ctx.author.id
         branch = branch.lower()
-        with self.user_cfg as config:
+        async with self.user_cfg as config:
             if DELIMITER in branch:  # batch removal
                 branches = branch.split(",")
                 message = "No longer watching the following branches:\n```diff"
@@ -874,9 +1362,6 @@ Changes are saved when you click out of the menu.
                         message += f"\n- {_branch} successfully removed."
 
                 message += "```"
-                await ctx.interaction.response.send_message(
-                    message, ephemeral=True, delete_after=DELETE_AFTER
-                )
             else:  # single removal
                 success, result = config.unsubscribe(user_id, branch)
                 if not success:
@@ -886,9 +1371,9 @@ Changes are saved when you click out of the menu.
                 else:
                     message = f"Successfully unsubscribed from branch `{branch}`!"
 
-                await ctx.interaction.response.send_message(
-                    message, ephemeral=True, delete_after=DELETE_AFTER
-                )
+        await ctx.interaction.response.send_message(
+            message, ephemeral=True, delete_after=DELETE_AFTER
+        )
 
     @dm_commands.command(name="edit")
     @commands.cooldown(1, COOLDOWN, commands.BucketType.user)
@@ -904,7 +1389,7 @@ Changes are saved when you click out of the menu.
             )
             return
 
-        with self.user_cfg as config:
+        async with self.user_cfg.read() as config:
             watchlist = config.get_watchlist(ctx.author.id)
 
         menu = WatchlistUI.create_menu(watchlist, game, WatchlistMenuType.USER)
@@ -927,7 +1412,7 @@ Changes are saved when you click out of the menu.
     async def user_subscribed(self, ctx: discord.ApplicationContext):
         """View all branches you're receiving DM updates for."""
         user_id = ctx.author.id
-        with self.user_cfg as config:
+        async with self.user_cfg.read() as config:
             watchlist = config.get_watchlist(user_id)
 
         if watchlist is None or len(watchlist) == 0:
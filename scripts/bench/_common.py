@@ -0,0 +1,149 @@
+"""
+Shared helpers for the benchmark scripts in this folder.
+
+The scripts are standalone and only need the bot's own requirements. Run them from anywhere, e.g.
+`python scripts/bench/psv_bench.py --help`.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import hashlib
+import statistics
+
+from typing import Callable, Iterable, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+CFG_PATH = os.path.join(ROOT, "cogs", "cache", "cfg.json")
+
+REGIONS = ["us", "eu", "cn", "kr", "tw", "sg", "xx"]
+
+
+def ensure_live_config():
+    """
+    Importing most cogs reads cogs/cache/cfg.json. If the bot hasn't created one yet, this writes a throwaway default
+    config and removes it again when the script exits.
+    """
+    if os.path.exists(CFG_PATH):
+        return
+
+    os.makedirs(os.path.dirname(CFG_PATH), exist_ok=True)
+    with open(CFG_PATH, "w") as f:
+        json.dump(
+            {
+                "products": {},
+                "meta": {},
+                "discord": {},
+                "debug": {"debug_mode": True},
+                "features": {},
+            },
+            f,
+        )
+
+    atexit.register(os.remove, CFG_PATH)
+
+
+# PAYLOADS
+
+
+def fake_hash(*parts) -> str:
+    """Deterministic 32 character hex string, shaped like the MD5 hashes in real responses."""
+    return hashlib.md5(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def make_versions_payload(product: str, seqn: int, build: int = 56421) -> bytes:
+    """Builds a `versions` response shaped like the real one, with one row per region."""
+    lines = [
+        "Region!STRING:0|BuildConfig!HEX:16|CDNConfig!HEX:16|KeyRing!HEX:16|BuildId!DEC:4|VersionsName!String:0|ProductConfig!HEX:16",
+        f"## seqn = {seqn}",
+    ]
+    for region in REGIONS:
+        lines.append(
+            "|".join(
+                [
+                    region,
+                    fake_hash(product, region, "build_config"),
+                    fake_hash(product, region, "cdn_config"),
+                    "",
+                    str(build),
+                    f"11.0.2.{build}",
+                    fake_hash(product, "product_config"),
+                ]
+            )
+        )
+
+    return ("\n".join(lines) + "\n").encode()
+
+
+def make_cdns_payload(product: str, seqn: int) -> bytes:
+    """Builds a `cdns` response shaped like the real one, with one row per region."""
+    hosts = "blzddist1-a.akamaihd.net level3.blizzard.com us.cdn.blizzard.com"
+    servers = " ".join(
+        f"http://{host}/?maxhosts=4 https://{host}/?fallback=1&maxhosts=4"
+        for host in hosts.split(" ")
+    )
+    lines = [
+        "Name!STRING:0|Path!STRING:0|Hosts!STRING:0|Servers!STRING:0|ConfigPath!STRING:0",
+        f"## seqn = {seqn}",
+    ]
+    for region in REGIONS[:-1]:
+        lines.append(f"{region}|tpr/{product}|{hosts}|{servers}|tpr/configs/data")
+
+    return ("\n".join(lines) + "\n").encode()
+
+
+def make_summary_payload(products: Iterable[str], seqn: int) -> bytes:
+    """Builds a `v2/summary` response listing the versions, cdns and bgdl seqns of every product."""
+    lines = ["Product!STRING:0|Seqn!DEC:7|Flags!STRING:0", f"## seqn = {seqn}"]
+    for i, product in enumerate(products):
+        lines.append(f"{product}|{seqn - i}|")
+        lines.append(f"{product}|{seqn - i - 1000}|cdn")
+        lines.append(f"{product}|{seqn - i - 2000}|bgdl")
+
+    return ("\n".join(lines) + "\n").encode()
+
+
+def load_payload(capture_dir: Optional[str], name: str, fallback: bytes) -> bytes:
+    """Returns the captured response `name` from `capture_dir` if there is one, otherwise `fallback`."""
+    if capture_dir:
+        path = os.path.join(capture_dir, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+
+        print(f"No captured '{name}' in {capture_dir}, using a generated payload")
+
+    return fallback
+
+
+# REPORTING
+
+
+def describe(samples: list[float], unit: float = 1e6, suffix: str = "us") -> str:
+    """Formats timing samples, given in seconds, as median / p99 in `suffix` units."""
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return f"median {statistics.median(ordered) * unit:9.2f}{suffix}  p99 {p99 * unit:9.2f}{suffix}"
+
+
+def print_table(headers: list[str], rows: list[list]):
+    widths = [
+        max(len(str(row[i])) for row in [headers, *rows]) for i in range(len(headers))
+    ]
+    for row in [headers, ["-" * width for width in widths], *rows]:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+def sample(func: Callable[[], object], repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return samples
@@ -0,0 +1,317 @@
+"""
+Load test for update delivery against a fake Discord REST API.
+
+A local aiohttp server stands in for discord.com. It answers `POST /channels/{id}/messages` after `--latency` ms and
+enforces Discord's limits: a global bucket of `--global-limit` requests per second, and a per-channel bucket of
+`--channel-limit` messages per `--channel-window` seconds, both answered with 429s shaped like the real ones. Requests
+go through py-cord's own HTTP client, so its bucket handling and 429 retries are part of what's measured.
+
+Every guild gets one embed in its own channel. `serial` sends them one after another, like distribution used to,
+and `scheduler` uses `DeliveryScheduler` with the bot's concurrency and rate settings.
+
+    python scripts/bench/delivery_harness.py --guilds 1000,10000,50000 --modes serial,scheduler
+
+At Discord's real limits a 50k guild run takes around 20 minutes per mode. Raise `--global-limit`, together with
+`--rate`, to shorten it.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+from types import SimpleNamespace
+from typing import Optional
+
+from aiohttp import web
+
+from _common import ensure_live_config, print_table
+
+ensure_live_config()
+
+import discord
+
+from discord.http import HTTPClient, Route
+
+from cogs.delivery import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_GLOBAL_RATE,
+    Delivery,
+    DeliveryReport,
+    DeliveryScheduler,
+    RateLimiter,
+)
+
+API_PATH = f"/api/v{discord.http.API_VERSION}"
+CHANNEL_ID_OFFSET = 300000000000000000
+
+
+def json_response(
+    data: dict, status: int = 200, headers: Optional[dict] = None
+) -> web.Response:
+    """
+    JSON response the way Discord sends it. py-cord only parses bodies typed exactly `application/json`, and treats
+    a 429 without a `Via` header as a Cloudflare ban that isn't worth retrying.
+    """
+    return web.Response(
+        body=json.dumps(data).encode(),
+        status=status,
+        headers={
+            "Content-Type": "application/json",
+            "Via": "1.1 google",
+            **(headers or {}),
+        },
+    )
+
+
+class FakeDiscord:
+    """Discord REST stand-in with a global and a per-channel rate limit. Counts what it received and rejected."""
+
+    def __init__(
+        self,
+        latency: float,
+        global_limit: int,
+        channel_limit: int,
+        channel_window: float,
+    ):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.channel_limit = channel_limit
+        self.channel_window = channel_window
+        self.reset()
+
+    def reset(self):
+        self.messages = 0
+        self.global_429s = 0
+        self.channel_429s = 0
+        self.__global_window = 0.0
+        self.__global_count = 0
+        # channel id -> (window start, messages in window)
+        self.__channels: dict[str, tuple[float, int]] = {}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(f"{API_PATH}/users/@me", self.get_me)
+        app.router.add_post(
+            f"{API_PATH}/channels/{{channel_id}}/messages", self.create_message
+        )
+        return app
+
+    async def get_me(self, request: web.Request) -> web.Response:
+        return json_response(
+            {"id": "1", "username": "algalon", "discriminator": "0", "bot": True}
+        )
+
+    def __take_global(self, now: float) -> float:
+        """Counts a request against the global bucket. Returns how long to wait if it's already used up."""
+        if now - self.__global_window >= 1:
+            self.__global_window = now
+            self.__global_count = 0
+
+        if self.__global_count >= self.global_limit:
+            return self.__global_window + 1 - now
+
+        self.__global_count += 1
+        return 0
+
+    async def create_message(self, request: web.Request) -> web.Response:
+        now = time.monotonic()
+        retry_after = self.__take_global(now)
+        if retry_after > 0:
+            self.global_429s += 1
+            return json_response(
+                {
+                    "message": "You are being rate limited.",
+                    "retry_after": retry_after,
+                    "global": True,
+                },
+                status=429,
+                headers={
+                    "X-RateLimit-Global": "true",
+                    "X-RateLimit-Scope": "global",
+                },
+            )
+
+        channel_id = request.match_info["channel_id"]
+        started, count = self.__channels.get(channel_id, (now, 0))
+        if now - started >= self.channel_window:
+            started, count = now, 0
+
+        reset_after = started + self.channel_window - now
+        if count >= self.channel_limit:
+            self.channel_429s += 1
+            return json_response(
+                {
+                    "message": "You are being rate limited.",
+                    "retry_after": reset_after,
+                    "global": False,
+                },
+                status=429,
+                headers={
+                    "X-RateLimit-Limit": str(self.channel_limit),
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+                    "X-RateLimit-Bucket": "channel-messages",
+                    "X-RateLimit-Scope": "user",
+                },
+            )
+
+        self.__channels[channel_id] = (started, count + 1)
+        await asyncio.sleep(self.latency)
+
+        self.messages += 1
+        return json_response(
+            {"id": str(self.messages), "channel_id": channel_id},
+            headers={
+                "X-RateLimit-Limit": str(self.channel_limit),
+                "X-RateLimit-Remaining": str(self.channel_limit - count - 1),
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+                "X-RateLimit-Bucket": "channel-messages",
+            },
+        )
+
+
+def make_deliveries(count: int, embed: discord.Embed) -> list[Delivery]:
+    return [
+        Delivery(
+            SimpleNamespace(id=i),  # type: ignore
+            CHANNEL_ID_OFFSET + i,
+            embed,
+            "wow",
+        )
+        for i in range(count)
+    ]
+
+
+async def run_serial(
+    http: HTTPClient, deliveries: list[Delivery], payload: dict
+) -> DeliveryReport:
+    """One message after another, the way distribution worked before the scheduler."""
+    report = DeliveryReport()
+    for delivery in deliveries:
+        try:
+            await http.send_message(delivery.channel_id, None, embed=payload)  # type: ignore
+        except discord.HTTPException:
+            report.failed += 1
+            continue
+
+        report.sent += 1
+        report.last_delivery_at = time.monotonic()
+
+    return report
+
+
+async def run_scheduler(
+    http: HTTPClient, deliveries: list[Delivery], payload: dict, args
+) -> DeliveryReport:
+    scheduler = DeliveryScheduler(args.concurrency, args.rate)
+
+    async def handler(delivery: Delivery, limiter: RateLimiter) -> bool:
+        await limiter.acquire()
+        try:
+            await http.send_message(delivery.channel_id, None, embed=payload)  # type: ignore
+        except discord.HTTPException:
+            return False
+
+        return True
+
+    return await scheduler.run(deliveries, handler)
+
+
+async def main(args):
+    server = FakeDiscord(
+        args.latency / 1000, args.global_limit, args.channel_limit, args.channel_window
+    )
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+
+    # point py-cord at the stand-in instead of discord.com
+    Route.base = property(lambda self: f"http://127.0.0.1:{port}{API_PATH}")  # type: ignore
+    http = HTTPClient()
+    await http.static_login("bench-token")
+
+    embed = discord.Embed(
+        title="World of Warcraft",
+        description="`wow` -> 11.0.2.56421 | [Diffs](<https://wago.tools>)",
+    )
+    payload = embed.to_dict()
+
+    rows = []
+    for count in args.guilds:
+        deliveries = make_deliveries(count, embed)
+        for mode in args.modes:
+            server.reset()
+            print(f"Delivering to {count} guild(s), {mode}...")
+            if mode == "serial":
+                report = await run_serial(http, deliveries, payload)
+            else:
+                report = await run_scheduler(http, deliveries, payload, args)
+
+            elapsed = report.time_to_last_delivery
+            rows.append(
+                [
+                    count,
+                    mode,
+                    f"{report.sent}/{count}",
+                    f"{elapsed:.2f}",
+                    f"{report.sent / elapsed:.1f}" if elapsed else "-",
+                    server.global_429s,
+                    server.channel_429s,
+                ]
+            )
+
+    await http.close()
+    await runner.cleanup()
+
+    print(
+        f"\nlatency {args.latency}ms, global limit {args.global_limit}/s, "
+        f"scheduler concurrency {args.concurrency} at {args.rate}/s\n"
+    )
+    print_table(
+        [
+            "guilds",
+            "mode",
+            "delivered",
+            "time to last delivery (s)",
+            "msg/s",
+            "global 429s",
+            "channel 429s",
+        ],
+        rows,
+    )
+
+
+def parse_list(value: str, type=str) -> list:
+    return [type(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--guilds",
+        type=lambda value: parse_list(value, int),
+        default="1000,10000,50000",
+    )
+    parser.add_argument(
+        "--modes", type=parse_list, default="serial,scheduler", help="serial,scheduler"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=50, help="fake API latency in ms"
+    )
+    parser.add_argument("--global-limit", type=int, default=50)
+    parser.add_argument("--channel-limit", type=int, default=5)
+    parser.add_argument("--channel-window", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument(
+        "--rate", type=float, default=DEFAULT_GLOBAL_RATE, help="scheduler rate limit"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    # py-cord logs every 429 it retries
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    asyncio.run(main(args))
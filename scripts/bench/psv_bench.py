@@ -0,0 +1,140 @@
+"""
+Micro-benchmarks for parsing Ribbit's PSV responses.
+
+Compares the line splitting parser `RibbitClient` used to have with `PSVParser`, both on a whole response and fed in
+network sized chunks the way `RibbitClient.__send` streams it. Payloads are generated in the shape of real `versions`,
+`cdns` and `v2/summary` responses. Pass `--capture-dir` with files named `versions`, `cdns` and `summary` to use
+captured responses instead.
+
+    python scripts/bench/psv_bench.py --repeat 2000
+"""
+
+import argparse
+
+from _common import (
+    REGIONS,
+    describe,
+    load_payload,
+    make_cdns_payload,
+    make_summary_payload,
+    make_versions_payload,
+    print_table,
+    sample,
+)
+
+from cogs.psv import PSVParser, parse
+
+WATCHED_REGIONS = ["us", "eu"]
+
+
+def legacy_parse(data: bytes):
+    """The parser `RibbitClient` used before `PSVParser`, kept verbatim for comparison."""
+    data_str = data.decode("utf-8")
+    data_split = data_str.split("\n")
+    sequence = None
+    index = []
+    output = {}
+
+    for line in data_split:
+        if not line:
+            continue
+
+        if line.startswith("## seqn = "):
+            sequence = line.replace("## seqn = ", "")
+            continue
+
+        line_split = line.split("|")
+
+        if len(line_split) > 1:
+            if not index:
+                for index_key in line_split:
+                    l = index_key.split("!")
+                    if len(l) == 2:
+                        index.append(l[0])
+                continue
+            else:
+                key = line_split[0]
+                for i, entry in enumerate(line_split):
+                    if key not in output.keys():
+                        output[key] = {}
+                    k = index[i]
+                    output[key][k] = entry
+
+    return sequence, output
+
+
+def chunked_parse(data: bytes, chunk_size: int, **kwargs) -> PSVParser:
+    parser = PSVParser(**kwargs)
+    for i in range(0, len(data), chunk_size):
+        parser.feed(data[i : i + chunk_size])
+
+    parser.close()
+    return parser
+
+
+def check(payload: bytes):
+    """Makes sure both parsers agree before timing them."""
+    sequence, legacy_rows = legacy_parse(payload)
+    parser = parse(payload)
+    assert str(parser.seqn) == sequence, "parsers disagree on the seqn"
+    assert {row[parser.columns[0].name]: row for row in parser.rows} == legacy_rows
+
+
+def main(args):
+    products = [f"product{i}" for i in range(args.products)]
+    payloads = {
+        "versions": load_payload(
+            args.capture_dir, "versions", make_versions_payload("wow", 2800000)
+        ),
+        "cdns": load_payload(
+            args.capture_dir, "cdns", make_cdns_payload("wow", 2800000)
+        ),
+        "summary": load_payload(
+            args.capture_dir, "summary", make_summary_payload(products, 2800000)
+        ),
+    }
+
+    rows = []
+    for name, payload in payloads.items():
+        check(payload)
+        size = f"{len(payload)} B"
+
+        cases = [
+            ("legacy", lambda: legacy_parse(payload)),
+            ("PSVParser", lambda: parse(payload)),
+            (
+                f"PSVParser, {args.chunk_size} B chunks",
+                lambda: chunked_parse(payload, args.chunk_size),
+            ),
+        ]
+        if name == "versions":
+            # what fetch_versions_for_product does, only the watched regions are split into fields
+            cases.append(
+                (
+                    f"PSVParser, {len(WATCHED_REGIONS)}/{len(REGIONS)} regions",
+                    lambda: chunked_parse(
+                        payload, args.chunk_size, keys=WATCHED_REGIONS
+                    ),
+                )
+            )
+        elif name == "summary":
+            cases.append(
+                ("PSVParser, typed", lambda: parse(payload, typed=True)),
+            )
+
+        for case, func in cases:
+            sample(func, args.repeat // 10)  # warm up
+            rows.append([name, size, case, describe(sample(func, args.repeat))])
+
+    print_table(["payload", "size", "parser", "time per parse"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument(
+        "--products", type=int, default=120, help="products in the generated summary"
+    )
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--capture-dir", help="folder with captured responses")
+    main(parser.parse_args())
@@ -0,0 +1,248 @@
+"""
+Compares TLS handshakes and per-cycle wall time of the pooled RibbitClient against one HTTP client per command.
+
+A local HTTPS stand-in for us.version.battle.net serves generated `versions` responses over HTTP/2 (or HTTP/1.1 if
+that's all the client offers). Every accepted connection costs a simulated TCP + TLS handshake of `2 * rtt`, and every
+response is delayed by `rtt`. One cycle fetches the versions of `--products` products concurrently, like
+`CDNCache.fetch_cdn` does.
+
+    python scripts/bench/ribbit_pool_bench.py --products 50 --cycles 5 --rtt 30
+"""
+
+import os
+import ssl
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import h2.config
+import h2.events
+import h2.connection
+
+from _common import ensure_live_config, make_versions_payload, print_table
+
+ensure_live_config()
+
+import httpx
+
+from cogs import ribbit_async
+from cogs.ribbit_async import RibbitClient
+
+
+class StandInServer:
+    """Ribbit HTTPS stand-in that counts the connections, and so the TLS handshakes, it accepts."""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.handshakes = 0
+        self.requests = 0
+        self.seqn = 2800000
+
+    def get_body(self, path: str) -> tuple[int, bytes]:
+        parts = path.strip("/").split("/")
+        if (
+            len(parts) == 4
+            and parts[:2] == ["v2", "products"]
+            and parts[3] == "versions"
+        ):
+            self.requests += 1
+            return 200, make_versions_payload(parts[2], self.seqn)
+
+        return 404, b""
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.handshakes += 1
+        await asyncio.sleep(self.rtt * 2)
+
+        ssl_object = writer.get_extra_info("ssl_object")
+        try:
+            if ssl_object.selected_alpn_protocol() == "h2":
+                await self.serve_h2(reader, writer)
+            else:
+                await self.serve_http1(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_h2(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        )
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+
+        async def respond(stream_id: int, path: str):
+            await asyncio.sleep(self.rtt)
+            status, body = self.get_body(path)
+            conn.send_headers(
+                stream_id,
+                [(":status", str(status)), ("content-length", str(len(body)))],
+                end_stream=not body,
+            )
+            if body:
+                conn.send_data(stream_id, body, end_stream=True)
+
+            writer.write(conn.data_to_send())
+
+        while True:
+            data = await reader.read(65535)
+            if not data:
+                return
+
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    asyncio.create_task(respond(event.stream_id, headers[":path"]))
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+
+            writer.write(conn.data_to_send())
+            await writer.drain()
+
+    async def serve_http1(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        while True:
+            request = await reader.readuntil(b"\r\n\r\n")
+            path = request.split(b" ", 2)[1].decode()
+            await asyncio.sleep(self.rtt)
+            status, body = self.get_body(path)
+            writer.write(
+                f"HTTP/1.1 {status} X\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+
+
+def create_certificate(folder: str) -> tuple[str, str]:
+    cert_path = os.path.join(folder, "cert.pem")
+    key_path = os.path.join(folder, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost,IP:127.0.0.1",
+            "-keyout",
+            key_path,
+            "-out",
+            cert_path,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert_path, key_path
+
+
+async def fetch_per_request_client(base_url: str, product: str):
+    """What `RibbitClient.__send` used to do: a brand new HTTP/2 client for every command."""
+    async with httpx.AsyncClient(base_url=base_url, http2=True, timeout=5) as client:
+        res = await client.get(f"v2/products/{product}/versions")
+        return res.read()
+
+
+async def run_cycles(name: str, server: StandInServer, cycles: int, fetch) -> list:
+    handshakes_before = server.handshakes
+    times = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        await fetch()
+        times.append(time.perf_counter() - start)
+
+    handshakes = server.handshakes - handshakes_before
+    return [
+        name,
+        handshakes,
+        f"{handshakes / cycles:.1f}",
+        f"{times[0] * 1000:.1f}",
+        f"{sum(times[1:]) / max(len(times) - 1, 1) * 1000:.1f}",
+    ]
+
+
+async def main(args):
+    products = [f"product{i}" for i in range(args.products)]
+    with tempfile.TemporaryDirectory() as folder:
+        cert_path, key_path = create_certificate(folder)
+        # httpx trusts SSL_CERT_FILE when it creates a client
+        os.environ["SSL_CERT_FILE"] = cert_path
+
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(cert_path, key_path)
+        ssl_context.set_alpn_protocols(["h2", "http/1.1"])
+
+        server = StandInServer(args.rtt / 1000)
+        tcp_server = await asyncio.start_server(
+            server.handle, "127.0.0.1", 0, ssl=ssl_context
+        )
+        port = tcp_server.sockets[0].getsockname()[1]
+        base_url = f"https://localhost:{port}"
+
+        rows = []
+
+        async def per_request_cycle():
+            await asyncio.gather(
+                *[fetch_per_request_client(base_url, product) for product in products]
+            )
+
+        rows.append(
+            await run_cycles(
+                "client per command", server, args.cycles, per_request_cycle
+            )
+        )
+
+        ribbit_async.HTTPS_URL = base_url
+        client = RibbitClient()
+
+        async def pooled_cycle():
+            results = await asyncio.gather(
+                *[
+                    client.fetch_versions_for_product(product, regions=["us"])
+                    for product in products
+                ]
+            )
+            assert all(data for data, _ in results), "pooled client got no data"
+
+        rows.append(
+            await run_cycles("pooled RibbitClient", server, args.cycles, pooled_cycle)
+        )
+        await client.shutdown()
+
+        tcp_server.close()
+        await tcp_server.wait_closed()
+
+    print(
+        f"{args.products} products per cycle, {args.cycles} cycles, simulated rtt {args.rtt}ms\n"
+    )
+    print_table(
+        [
+            "mode",
+            "handshakes",
+            "per cycle",
+            "first cycle (ms)",
+            "later cycles, mean (ms)",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument(
+        "--rtt", type=float, default=30, help="simulated round trip time in ms"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,160 @@
+"""
+Compares lookup and update latency of the JSON and SQLite storage backends.
+
+Both backends are filled with the same generated state, 10k guilds and 100k users by default, in a temporary folder.
+Every operation is then timed the way the config classes call it: single guild reads and setting updates, loading the
+user tables, and saving one user's watchlist change.
+
+    python scripts/bench/storage_bench.py --guilds 10000 --users 100000
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from _common import ensure_live_config, describe, print_table, sample
+
+ensure_live_config()
+
+from cogs.config import CacheConfig
+from cogs.storage import JSONStorage, SQLiteStorage, import_from_json
+
+BRANCHES = [branch.name for branch in CacheConfig.PRODUCTS]
+
+
+def make_state(guild_count: int, user_count: int, rng: random.Random):
+    guilds = {}
+    for i in range(guild_count):
+        guild_id = str(100000000000000000 + i)
+        guilds[guild_id] = {
+            "channel": rng.randrange(10**17, 10**18),
+            "d4_channel": None,
+            "gryphon_channel": None,
+            "bnet_channel": None,
+            "watchlist": rng.sample(BRANCHES, min(len(BRANCHES), rng.randint(1, 8))),
+            "region": "us",
+            "locale": "enUS",
+        }
+
+    users = {}
+    lookup = {branch: [] for branch in BRANCHES}
+    for i in range(user_count):
+        user_id = str(200000000000000000 + i)
+        watchlist = rng.sample(BRANCHES, min(len(BRANCHES), rng.randint(1, 4)))
+        users[user_id] = {"watchlist": watchlist, "monitor": {}}
+        for branch in watchlist:
+            lookup[branch].append(user_id)
+
+    return guilds, {"lookup": lookup, "users": users}
+
+
+def write_json_state(folder: str, guilds: dict, user_cfg: dict):
+    with open(os.path.join(folder, CacheConfig.GUILD_CFG_FILE_NAME), "w") as f:
+        json.dump(guilds, f)
+
+    with open(os.path.join(folder, CacheConfig.USER_CFG_FILE_NAME), "w") as f:
+        json.dump(user_cfg, f)
+
+
+def bench_backend(name, storage, guild_ids, user_cfg, args, rng) -> list[list]:
+    rows = []
+
+    def row(operation: str, samples: list[float]):
+        rows.append([name, operation, len(samples), describe(samples, 1e3, "ms")])
+
+    # parse the file once, like the bot does on its first read
+    storage.get_guild(guild_ids[0])
+
+    sampled_ids = [rng.choice(guild_ids) for _ in range(args.repeat)]
+    ids = iter(sampled_ids)
+    row("get_guild", sample(lambda: storage.get_guild(next(ids)), args.repeat))
+
+    ids = iter(sampled_ids)
+    regions = iter(rng.choice(["us", "eu", "kr"]) for _ in range(args.repeat))
+    row(
+        "update_guild_setting",
+        sample(
+            lambda: storage.update_guild_setting(next(ids), "region", next(regions)),
+            args.update_repeat,
+        ),
+    )
+
+    row("load_users", sample(storage.load_users, args.load_repeat))
+
+    user_ids = list(user_cfg["users"])
+
+    def save_one_user():
+        # what leaving a `/dm subscribe` or `/dm unsubscribe` context writes: the user and their one subscription
+        user_id = rng.choice(user_ids)
+        branch = rng.choice(BRANCHES)
+        entry = user_cfg["users"][user_id]
+        subscribed = branch not in entry["watchlist"]
+        if subscribed:
+            entry["watchlist"].append(branch)
+        else:
+            entry["watchlist"].remove(branch)
+
+        storage.save_users({user_id: entry}, [], [(branch, user_id, subscribed)])
+
+    row("save_users (1 user)", sample(save_one_user, args.update_repeat))
+
+    return rows
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    print(f"Generating {args.guilds} guilds and {args.users} users...")
+    guilds, user_cfg = make_state(args.guilds, args.users, rng)
+    guild_ids = list(guilds)
+
+    with tempfile.TemporaryDirectory() as folder:
+        json_folder = os.path.join(folder, "json")
+        os.makedirs(json_folder)
+        write_json_state(json_folder, guilds, user_cfg)
+
+        json_storage = JSONStorage(json_folder)
+        sqlite_storage = SQLiteStorage(
+            os.path.join(folder, CacheConfig.STORAGE_DB_FILE_NAME)
+        )
+
+        start = time.perf_counter()
+        import_from_json(json_storage, sqlite_storage)
+        print(f"Imported into SQLite in {time.perf_counter() - start:.2f}s")
+
+        json_size = sum(
+            os.path.getsize(os.path.join(json_folder, name))
+            for name in os.listdir(json_folder)
+        )
+        print(f"JSON files: {json_size / 1024 / 1024:.1f} MiB\n")
+
+        rows = []
+        # fresh instances, so neither backend starts out with anything parsed
+        rows += bench_backend(
+            "json", JSONStorage(json_folder), guild_ids, user_cfg, args, rng
+        )
+        sqlite_storage.close()
+        sqlite_storage = SQLiteStorage(
+            os.path.join(folder, CacheConfig.STORAGE_DB_FILE_NAME)
+        )
+        rows += bench_backend("sqlite", sqlite_storage, guild_ids, user_cfg, args, rng)
+        sqlite_storage.close()
+
+    print_table(["backend", "operation", "samples", "latency"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=2000, help="samples per read")
+    parser.add_argument(
+        "--update-repeat", type=int, default=50, help="samples per write"
+    )
+    parser.add_argument(
+        "--load-repeat", type=int, default=5, help="samples per full user load"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())